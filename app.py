@@ -1,135 +1,111 @@
 import os
+import json
 import logging
-import psycopg2
 from slack_bolt import App
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 
+from autocomplete import duplicate_ticket_warning, option_index, skill_group_options, ticket_options
+from blocks import create_modal_metadata, render_create_modal, render_swarm_message
+from dedup import release_delivery, skip_duplicates
+from home import follow_skill_groups, load_more, publish_home
+from installations import OAUTH_ENABLED, authorize, installation_store, oauth_settings
+from journal import journal, APPLIED, REJECTED
+from metrics import record_ack_time, start_server as start_metrics_server, timed_handler
+from readiness import FAST_STARTUP, await_token_verification, start_warm_up
+from rollups import render_summary
+from search import SearchError, parse_query, render_results, search
+from slack_dispatch import slack
+from storage import get_db_connection, get_read_connection, rollups, swarms
+from sweeper import start_sweeper
+from thread_activity import active_threads, record_reply
+from user_directory import user_directory
+from workers import export_executor, listener_executor, run_concurrently
+
+
+# Initialize the Slack app: installable into any number of workspaces over OAuth when
+# SLACK_CLIENT_ID is set, otherwise for the single workspace of SLACK_BOT_TOKEN
+if OAUTH_ENABLED:
+    app = App(
+        client=slack.build_client(None),
+        authorize=authorize,
+        installation_store=installation_store,
+        oauth_settings=oauth_settings(),
+        listener_executor=listener_executor,
+    )
+else:
+    app = App(
+        client=slack.build_client(os.environ.get("SLACK_BOT_TOKEN")),
+        token_verification_enabled=not FAST_STARTUP,
+        before_authorize=await_token_verification if FAST_STARTUP else None,
+        listener_executor=listener_executor,
+    )
+app.use(skip_duplicates)
+app.use(record_ack_time)
 
-# Initialize the Slack app
-app = App(token=os.environ.get("SLACK_BOT_TOKEN"))
+# How long a button click waits for its status change to be stored before updating the message
+TRANSITION_WAIT_SECONDS = float(os.environ.get("TRANSITION_WAIT_SECONDS", 2))
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 
-# Database connection function
-def get_db_connection():
-    try:
-        conn = psycopg2.connect(os.environ.get("DATABASE_URL"))
-        return conn
-    except Exception as e:
-        logging.error(f"Error connecting to the database: {e}")
-        raise
-
 # Handle the slash command
 @app.command("/swarmrequest")
+@timed_handler("/swarmrequest")
 def handle_swarm_request(ack, body, client):
     # Acknowledge the command request immediately
     ack()
 
     # Open a modal with fields for the swarm request
-    client.views_open(
+    slack.views_open(
+        client,
         trigger_id=body["trigger_id"],
-        view={
-            "type": "modal",
-            "callback_id": "swarm_request_form",
-            "title": {"type": "plain_text", "text": "Create Swarm Request"},
-            "submit": {"type": "plain_text", "text": "Submit"},
-            "close": {"type": "plain_text", "text": "Cancel"},
-            "blocks": [
-                {
-                    "type": "input",
-                    "block_id": "ticket",
-                    "element": {"type": "plain_text_input", "action_id": "ticket_input"},
-                    "label": {"type": "plain_text", "text": "Ticket"}
-                },
-                {
-                    "type": "input",
-                    "block_id": "entitlement",
-                    "element": {
-                        "type": "static_select",
-                        "action_id": "entitlement_select",
-                        "placeholder": {"type": "plain_text", "text": "Select Entitlement"},
-                        "options": [
-                            {"text": {"type": "plain_text", "text": "Enterprise Signature"}, "value": "Enterprise Signature"},
-                            {"text": {"type": "plain_text", "text": "Enterprise Premier"}, "value": "Enterprise Premier"},
-                            {"text": {"type": "plain_text", "text": "Enterprise Standard"}, "value": "Enterprise Standard"},
-                            {"text": {"type": "plain_text", "text": "Online Customer"}, "value": "Online Customer"}
-                        ]
-                    },
-                    "label": {"type": "plain_text", "text": "Entitlement"}
-                },
-                {
-                    "type": "input",
-                    "block_id": "skill_group",
-                    "element": {
-                        "type": "static_select",
-                        "action_id": "skill_group_select",
-                        "placeholder": {"type": "plain_text", "text": "Select Skill Group"},
-                        "options": [
-                            {"text": {"type": "plain_text", "text": "Data"}, "value": "Data"},
-                            {"text": {"type": "plain_text", "text": "Runtime"}, "value": "Runtime"},
-                            {"text": {"type": "plain_text", "text": "Platform/Web Services"}, "value": "Platform/Web Services"},
-                            {"text": {"type": "plain_text", "text": "Account Management"}, "value": "Account Management"},
-                            {"text": {"type": "plain_text", "text": "Other"}, "value": "Other"}
-                        ]
-                    },
-                    "label": {"type": "plain_text", "text": "Skill Group"}
-                },
-                {
-                    "type": "input",
-                    "block_id": "support_tier",
-                    "element": {
-                        "type": "static_select",
-                        "action_id": "support_tier_select",
-                        "placeholder": {"type": "plain_text", "text": "Select Support Tier"},
-                        "options": [
-                            {"text": {"type": "plain_text", "text": "High Complexity"}, "value": "High Complexity"},
-                            {"text": {"type": "plain_text", "text": "General Usage"}, "value": "General Usage"}
-                        ]
-                    },
-                    "label": {"type": "plain_text", "text": "Support Tier"}
-                },
-                {
-                    "type": "input",
-                    "block_id": "priority",
-                    "element": {
-                        "type": "static_select",
-                        "action_id": "priority_select",
-                        "placeholder": {"type": "plain_text", "text": "Select Priority"},
-                        "options": [
-                            {"text": {"type": "plain_text", "text": "Critical"}, "value": "Critical"},
-                            {"text": {"type": "plain_text", "text": "Urgent"}, "value": "Urgent"},
-                            {"text": {"type": "plain_text", "text": "High"}, "value": "High"},
-                            {"text": {"type": "plain_text", "text": "Normal"}, "value": "Normal"},
-                            {"text": {"type": "plain_text", "text": "Low"}, "value": "Low"}
-                        ]
-                    },
-                    "label": {"type": "plain_text", "text": "Priority"}
-                },
-                {
-                    "type": "input",
-                    "block_id": "issue_description",
-                    "element": {"type": "plain_text_input", "multiline": True, "action_id": "issue_description_input"},
-                    "label": {"type": "plain_text", "text": "Issue Description"}
-                },
-                {
-                    "type": "input",
-                    "block_id": "help_required",
-                    "element": {"type": "plain_text_input", "multiline": True, "action_id": "help_required_input"},
-                    "label": {"type": "plain_text", "text": "Help Required"}
-                }
-            ],
-            "private_metadata": body["channel_id"]
-        }
+        view=render_create_modal(body["channel_id"])
     )
 
-@app.view("swarm_request_form")
-def handle_modal_submission(ack, body, view, client):
+
+# The modal's Ticket and Skill Group options, answered from the in-memory index
+@app.options("ticket_select")
+@timed_handler("ticket_select")
+def handle_ticket_options(ack, payload):
+    ack(options=ticket_options(payload.get("value")))
+
+
+@app.options("skill_group_select")
+@timed_handler("skill_group_select")
+def handle_skill_group_options(ack, payload):
+    ack(options=skill_group_options(payload.get("value")))
+
+
+# A ticket that already has an open swarm is flagged: the modal comes back with a warning, and
+# submitting the same ticket again posts it. Checked once in listener middleware, since the ack
+# and the lazy listener run concurrently.
+def check_duplicate_ticket(context, view, next):
+    ticket = view["state"]["values"]["ticket"]["ticket_select"]["selected_option"]["value"]
+    _, confirmed_ticket = create_modal_metadata(view)
+    context["duplicate_ticket_warning"] = None if ticket == confirmed_ticket else duplicate_ticket_warning(ticket)
+    next()
+
+
+# Modal submissions are acked immediately and processed in a lazy listener
+def ack_swarm_request_form(ack, body, view, context):
+    warning = context["duplicate_ticket_warning"]
+    if warning:
+        channel_id, _ = create_modal_metadata(view)
+        ticket = view["state"]["values"]["ticket"]["ticket_select"]["selected_option"]["value"]
+        release_delivery(body)
+        ack(response_action="update", view=render_create_modal(channel_id, warning, ticket))
+        return
     ack()
 
+
+@timed_handler("swarm_request_form")
+def process_swarm_request_form(body, view, client, context):
+    if context["duplicate_ticket_warning"]:
+        return
+
     # Extract values from the modal submission
-    ticket = view["state"]["values"]["ticket"]["ticket_input"]["value"]
+    ticket = view["state"]["values"]["ticket"]["ticket_select"]["selected_option"]["value"]
     entitlement = view["state"]["values"]["entitlement"]["entitlement_select"]["selected_option"]["value"]
     skill_group = view["state"]["values"]["skill_group"]["skill_group_select"]["selected_option"]["value"]
     support_tier = view["state"]["values"]["support_tier"]["support_tier_select"]["selected_option"]["value"]
@@ -138,484 +114,372 @@ def handle_modal_submission(ack, body, view, client):
     help_required = view["state"]["values"]["help_required"]["help_required_input"]["value"]
     
     # Get the channel ID from the context
-    channel_id = body["view"]["private_metadata"]
+    channel_id, _ = create_modal_metadata(body["view"])
     user_id = body["user"]["id"]
 
+    swarm = {
+        "ticket": ticket,
+        "entitlement": entitlement,
+        "skill_group": skill_group,
+        "support_tier": support_tier,
+        "priority": priority,
+        "issue_description": issue_description,
+        "help_required": help_required,
+        "user_id": user_id,
+        "channel_id": channel_id,
+        "enterprise_id": context.enterprise_id,
+        "team_id": context.team_id,
+        "status": "open",
+    }
 
-    # Fetch user info to display in the message
-    try:
-        user_info = client.users_info(user=user_id)
-        user_name = user_info["user"]["real_name"]
-    except SlackApiError as e:
-        user_name = "Unknown User"
-        logging.error(f"Error fetching user info: {e.response['error']}")
-    
-    
     # Post message to the channel with buttons
+    message_ts = None
+    blocks, text = render_swarm_message(swarm)
     try:
-        result = client.chat_postMessage(
+        result = slack.chat_postMessage(
+            client,
             channel=channel_id,
-            blocks=[
-                # Header block
-                {
-                    "type": "header",
-                    "text": {
-                        "type": "plain_text",
-                        "text": "New Swarm Request",
-                        "emoji": True
-                    }
-                },
-                # Section with inline fields for Ticket, Entitlement, Skill Group, Support Tier, and Priority
-                {
-                    "type": "section",
-                    "block_id": "details-section",
-                    "fields": [
-                        {
-                            "type": "mrkdwn",
-                            "text": "*Ticket:*\n" + ticket
-                        },
-                        {
-                            "type": "mrkdwn",
-                            "text": "*Entitlement:*\n" + entitlement
-                        },
-                        {
-                            "type": "mrkdwn",
-                            "text": "*Skill Group:*\n" + skill_group
-                        },
-                        {
-                            "type": "mrkdwn",
-                            "text": "*Support Tier:*\n" + support_tier
-                        },
-                        {
-                            "type": "mrkdwn",
-                            "text": "*Priority:*\n" + priority
-                        },
-                        {
-                            "type": "mrkdwn", 
-                            "text": f"*Opened By:*\n<@{user_id}>"
-                        }
-
-                    ]
-                },
-                # Divider block to separate sections
-                {
-                    "type": "divider"
-                },
-                # Section with detailed description
-                {
-                    "type": "section",
-                    "block_id": "description-section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": "*Issue Description:*\n" + issue_description
-                    }
-                },
-                {
-                    "type": "section",
-                    "block_id": "help-required-section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": "*Help Required:*\n" + help_required
-                    }
-                },
-                # Actions block
-                {
-                    "type": "actions",
-                    "block_id": "actions-block",
-                    "elements": [
-                        {
-                            "type": "button",
-                            "text": {"type": "plain_text", "text": "Resolve Swarm"},
-                            "style": "primary",
-                            "value": "resolve",
-                            "action_id": "resolve_button"
-                        },
-                        {
-                            "type": "button",
-                            "text": {"type": "plain_text", "text": "Discard Swarm"},
-                            "style": "danger",
-                            "value": "discard",
-                            "action_id": "discard_button"
-                        }
-                    ]
-                }
-            ],
-            text="New Swarm Request",
+            blocks=blocks,
+            text=text,
             user=user_id,
             unfurl_links=True
         )
-        # Pin the message to the channel
-        client.pins_add(channel=channel_id, timestamp=result["ts"])
+        message_ts = result["ts"]
     except SlackApiError as e:
         logging.error(f"Error posting message: {e.response['error']}")
 
-    
-    # Store the form data in the database
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            """
-            INSERT INTO swarm_requests (ticket, entitlement, skill_group, support_tier, priority, issue_description, help_required, user_id)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """,
-            (ticket, entitlement, skill_group, support_tier, priority, issue_description, help_required, user_id)
-        )
-        conn.commit()
-    except Exception as e:
-        logging.error(f"Error storing data in database: {e}")
-    finally:
-        cur.close()
-        conn.close()
+    # Pin the message to the channel
+    def pin_message():
+        try:
+            slack.pins_add(client, channel=channel_id, timestamp=message_ts)
+        except SlackApiError as e:
+            logging.error(f"Error pinning message: {e.response['error']}")
 
+    # Queue the form data for the database, keyed by the message it was posted as
+    journal.create(message_ts=message_ts, **{field: swarm[field] for field in swarms.CREATE_FIELDS if field != "message_ts"})
 
-# Handle the "Resolve Swarm" button click
-@app.action("resolve_button")
-def handle_resolve_button(ack, body, client):
+    if message_ts:
+        option_index.note(dict(swarm, message_ts=message_ts))
+        active_threads.note(dict(swarm, message_ts=message_ts))
+        pin_message()
+
+
+app.view("swarm_request_form", middleware=[check_duplicate_ticket])(
+    ack=ack_swarm_request_form, lazy=[process_swarm_request_form]
+)
+
+
+# Buttons only need an immediate ack; the rest runs in lazy listeners
+def ack_button(ack):
     ack()
-    user_id = body["user"]["id"]
-    channel_id = body["channel"]["id"]
-    message_ts = body["message"]["ts"]
 
+
+# Queue a lifecycle action and wait briefly for the journal to apply it.
+# Returns the stored swarm record in its new status, False when the database rejected the action
+# (the swarm is in no state that allows it), or None if the record could not be loaded yet.
+def _transition(channel_id, message_ts, action, user_id):
+    ticket = journal.transition(channel_id, message_ts, action, user_id)
+    outcome = ticket.wait(TRANSITION_WAIT_SECONDS)
+    if outcome == REJECTED:
+        logging.error(f"No swarm request to {action} found for message_ts: {message_ts}")
+        return False
+    if outcome == APPLIED:
+        return ticket.swarm
+
+    # The database is slow or down; render from the stored record with the status the action leads to
     try:
-        # Remove the pin from the message
-        client.pins_remove(channel=channel_id, timestamp=message_ts)
-        
-        # Update the original message to reflect the resolved status
-        updated_blocks = [
-            block for block in body["message"]["blocks"] if block["type"] != "actions"
-        ] + [
-            {
-                "type": "section",
-                "text": {"type": "mrkdwn", "text": f"Swarm request resolved by <@{user_id}>."}
-            },
-            {
-                "type": "actions",
-                "elements": [
-                    {
-                        "type": "button",
-                        "text": {"type": "plain_text", "text": "Re-Open Swarm"},
-                        "style": "primary",
-                        "value": "reopen",
-                        "action_id": "reopen_button"
-                    }
-                ]
-            }
-        ]
-        client.chat_update(
-            channel=channel_id,
-            ts=message_ts,
-            blocks=updated_blocks
-        )
+        with get_db_connection() as conn, conn.cursor() as cur:
+            swarm = swarms.get_swarm(cur, channel_id, message_ts)
+    except Exception as e:
+        logging.error(f"Error loading swarm request from database: {e}")
+        return None
+    return dict(swarm, status=swarms.TRANSITIONS[action][1]) if swarm else None
 
-        # Update or insert the row in the database
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id FROM swarm_requests WHERE message_ts = %s", (message_ts,))
-        existing_record = cur.fetchone()
-        if existing_record:
-            # Update the existing swarm request status to 'resolved'
-            cur.execute("""
-                UPDATE swarm_requests
-                SET status = %s, updated_at = NOW()
-                WHERE message_ts = %s
-            """, ('resolved', message_ts))
-        else:
-            logging.error(f"No existing swarm request found for message_ts: {message_ts}")
-
-        conn.commit()
-        cur.close()
-        conn.close()
-        
-    except SlackApiError as e:
-        logging.error(f"Error resolving swarm request: {e.response['error']}")
 
-# Handle the "Discard Swarm" button click
-@app.action("discard_button")
-def handle_discard_button(ack, body, client):
-    ack()
+def _apply_action(body, client, action, verb, *steps):
     user_id = body["user"]["id"]
     channel_id = body["channel"]["id"]
     message_ts = body["message"]["ts"]
 
-    try:
-        # Remove the pin from the message
-        client.pins_remove(channel=channel_id, timestamp=message_ts)
-        
-        # Update the original message to reflect the discarded status
-        updated_blocks = [
-            block for block in body["message"]["blocks"] if block["type"] != "actions"
-        ] + [
-            {
-                "type": "section",
-                "text": {"type": "mrkdwn", "text": f"Swarm request discarded by <@{user_id}>."}
-            },
-            {
-                "type": "actions",
-                "elements": [
-                    {
-                        "type": "button",
-                        "text": {"type": "plain_text", "text": "Re-Open Swarm"},
-                        "style": "primary",
-                        "value": "reopen",
-                        "action_id": "reopen_button"
-                    }
-                ]
-            }
-        ]
-        client.chat_update(
-            channel=channel_id,
-            ts=message_ts,
-            blocks=updated_blocks
-        )
+    swarm = _transition(channel_id, message_ts, action, user_id)
+    # A concurrent click already moved this swarm on, so leave the message alone
+    if swarm is False:
+        return
+    if swarm is not None:
+        option_index.note(swarm)
+        active_threads.note(swarm)
+
+    # Re-render the original message from the swarm record to reflect the new status
+    def update_message():
+        if swarm is None:
+            logging.error(f"Swarm request not found for message_ts: {message_ts}, message left unchanged")
+            return
+        blocks, text = render_swarm_message(swarm, actor_id=user_id)
+        try:
+            slack.chat_update(client, channel=channel_id, ts=message_ts, blocks=blocks, text=text)
+        except SlackApiError as e:
+            logging.error(f"Error {verb} swarm request: {e.response['error']}")
+
+    def run_step(step):
+        def run():
+            try:
+                step(client, channel_id, message_ts)
+            except SlackApiError as e:
+                logging.error(f"Error {verb} swarm request: {e.response['error']}")
+        return run
+
+    run_concurrently(update_message, *[run_step(step) for step in steps])
+
+
+def _pin(client, channel_id, message_ts):
+    slack.pins_add(client, channel=channel_id, timestamp=message_ts)
+
+
+def _unpin(client, channel_id, message_ts):
+    slack.pins_remove(client, channel=channel_id, timestamp=message_ts)
+
+
+# Post a new message in the thread indicating the swarm request has been reopened
+def _post_reopen_notice(client, channel_id, message_ts):
+    slack.chat_postMessage(
+        client,
+        channel=channel_id,
+        thread_ts=message_ts,
+        text="The swarm request has been reopened and needs attention."
+    )
+
+
+# Handle the "Resolve Swarm" button click
+@timed_handler("resolve_button")
+def handle_resolve_button(body, client):
+    _apply_action(body, client, "resolve", "resolving", _unpin)
+
+
+# Handle the "Discard Swarm" button click
+@timed_handler("discard_button")
+def handle_discard_button(body, client):
+    _apply_action(body, client, "discard", "discarding", _unpin)
 
-        # Update or insert the row in the database
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id FROM swarm_requests WHERE message_ts = %s", (message_ts,))
-        existing_record = cur.fetchone()
-
-        if existing_record:
-            # Update the existing swarm request status to 'discarded'
-            cur.execute("""
-                UPDATE swarm_requests
-                SET status = %s, updated_at = NOW()
-                WHERE message_ts = %s
-            """, ('discarded', message_ts))
-        else:
-            logging.error(f"No existing swarm request found for message_ts: {message_ts}")
-
-        conn.commit()
-        cur.close()
-        conn.close()
-        
-    except SlackApiError as e:
-        logging.error(f"Error discarding swarm request: {e.response['error']}")
 
 # Handle the "Re-Open Swarm" button click
-@app.action("reopen_button")
-def handle_reopen_swarm(ack, body, client):
+@timed_handler("reopen_button")
+def handle_reopen_swarm(body, client):
+    _apply_action(body, client, "reopen", "reopening", _post_reopen_notice, _pin)
+
+
+app.action("resolve_button")(ack=ack_button, lazy=[handle_resolve_button])
+app.action("discard_button")(ack=ack_button, lazy=[handle_discard_button])
+app.action("reopen_button")(ack=ack_button, lazy=[handle_reopen_swarm])
+
+
+# /swarmsearch [words] [skill:...] [priority:...] [status:...] answers with an ephemeral page of results
+def ack_swarm_search(ack):
     ack()
-    user_id = body["user"]["id"]
-    channel_id = body["channel"]["id"]
-    message_ts = body["message"]["ts"]
 
+
+def _respond_with_search(respond, client, text, filters, after=None, replace_original=False):
     try:
-        # Post a new message in the thread indicating the swarm request has been reopened
-        client.chat_postMessage(
-            channel=channel_id,
-            thread_ts=message_ts,
-            text="The swarm request has been reopened and needs attention."
-        )
+        rows, has_more = search(text, filters, after)
+    except Exception as e:
+        logging.error(f"Error searching swarm requests: {e}")
+        respond(text="Search is unavailable right now, please try again.", replace_original=replace_original)
+        return
+    respond(
+        text="Swarm request search results",
+        blocks=render_results(client, text, filters, rows, has_more),
+        response_type="ephemeral",
+        replace_original=replace_original
+    )
 
-        updated_blocks = [
-            block for block in body["message"]["blocks"]
-            if not (
-                (block.get("type") == "section" and
-                 ("Swarm request resolved by" in block.get("text", {}).get("text", "") or
-                  "Swarm request discarded by" in block.get("text", {}).get("text", ""))) or
-                (block.get("type") == "actions" and
-                 any(button.get("text", {}).get("text", "") == "Re-Open Swarm" for button in block.get("elements", [])))
-            )
-        ]
-
-        
-        updated_blocks.append(
-            {
-                "type": "actions",
-                "elements": [
-                    {"type": "button", "text": {"type": "plain_text", "text": "Resolve Swarm"}, "style": "primary", "action_id": "resolve_button"},
-                    {"type": "button", "text": {"type": "plain_text", "text": "Discard Swarm"}, "style": "danger", "action_id": "discard_button"}
-                ]
-            }
-        )
 
-        client.chat_update(
-            channel=channel_id,
-            ts=message_ts,
-            blocks=updated_blocks
-        )
+@timed_handler("/swarmsearch")
+def run_swarm_search(body, client, respond):
+    try:
+        text, filters = parse_query(body.get("text", ""))
+    except SearchError as e:
+        respond(text=str(e), response_type="ephemeral")
+        return
+    _respond_with_search(respond, client, text, filters)
 
-        client.pins_add(channel=channel_id, timestamp=message_ts)
-
-
-        # Update or insert the row in the database
-        conn = get_db_connection()
-        cur = conn.cursor()
-        '''cur.execute(
-            """
-            INSERT INTO swarm_requests (message_ts, status)
-            VALUES (%s, 'reopened')
-            ON CONFLICT (message_ts) DO UPDATE
-            SET status = 'reopened', updated_at = CURRENT_TIMESTAMP
-            """,
-            (message_ts,)
-        )'''
-
-        # Fetch existing swarm request data using the message timestamp
-        cur.execute("""
-            SELECT ticket, entitlement, skill_group, support_tier, priority,
-                   issue_description, help_required, user_id, channel_id
-            FROM swarm_requests
-            WHERE message_ts = %s
-        """, (message_ts,))
-        swarm_data = cur.fetchone()
-
-        if not swarm_data:
-            logging.error(f"Swarm request not found for message_ts: {message_ts}")
-            conn.close()
-            return
 
-        # Ensure you have all data from the database
-        ticket, entitlement, skill_group, support_tier, priority, issue_description, help_required, user_id, channel_id = swarm_data
+@timed_handler("swarmsearch_next")
+def handle_search_next_page(body, client, respond):
+    page = json.loads(body["actions"][0]["value"])
+    _respond_with_search(respond, client, page["q"], page["f"], page["after"], replace_original=True)
 
-        # Update the status, preserving other fields
-        cur.execute("""
-            UPDATE swarm_requests
-            SET status = %s,
-                updated_at = NOW()
-            WHERE message_ts = %s
-        """, (new_status, message_ts))
-        conn.commit()
 
-        conn.commit()
-        cur.close()
-        conn.close()
+app.command("/swarmsearch")(ack=ack_swarm_search, lazy=[run_swarm_search])
+app.action("swarmsearch_next")(ack=ack_button, lazy=[handle_search_next_page])
+
+
+# /swarmexport [from:YYYY-MM-DD] [to:YYYY-MM-DD] [skill:...] [status:...] [format:csv|ndjson]
+# uploads a gzipped export to the channel. The export runs on its own pool, off the request thread.
+@app.command("/swarmexport")
+@timed_handler("/swarmexport")
+def handle_swarm_export(ack, body, client, respond):
+    # Imported on first use, to keep it out of the import path before the port binds
+    from export import ExportError, export_to_slack, parse_export
+
+    try:
+        export = parse_export(body.get("text", ""))
+    except ExportError as e:
+        ack(text=str(e))
+        return
+    ack(text=f"Exporting swarm requests {export.describe()}, the file will be posted here shortly.")
+
+    def run():
+        try:
+            export_to_slack(client, export, body["channel_id"], body["user_id"])
+        except SlackApiError as e:
+            logging.error(f"Error uploading swarm export: {e.response['error']}")
+            respond(text=f"The export could not be posted here ({e.response['error']}). Is the app in this channel?")
+        except Exception as e:
+            logging.error(f"Error exporting swarm requests: {e}")
+            respond(text="The export failed, please try again.")
+
+    export_executor.submit(run)
+
+
+# /swarmstats [skill:...] [priority:...] answers with time-to-resolve and time-to-first-response
+# percentiles and the weekly trend, read from the pre-aggregated rollups
+def ack_swarm_stats(ack, body):
+    try:
+        text, filters = parse_query(body.get("text", ""))
+    except SearchError as e:
+        ack(text=str(e))
+        return
+    if text or "status" in filters:
+        ack(text="Filter with `skill:` and `priority:`, for example `/swarmstats skill:Data priority:High`.")
+        return
+    ack()
 
-    except SlackApiError as e:
-        logging.error(f"Error reopening swarm request: {e.response['error']}")
+
+@timed_handler("/swarmstats")
+def run_swarm_stats(body, respond):
+    # the ack already answered a query it couldn't use
+    try:
+        text, filters = parse_query(body.get("text", ""))
+    except SearchError:
+        return
+    if text or "status" in filters:
+        return
+    try:
+        with get_read_connection(body["user_id"]) as conn, conn.cursor() as cur:
+            summary = rollups.summarize(cur, **filters)
+    except Exception as e:
+        logging.error(f"Error reading swarm rollups: {e}")
+        respond(text="Swarm statistics are unavailable right now, please try again.", response_type="ephemeral")
+        return
+    described = " · ".join(filters.values()) or "all swarm requests"
+    respond(
+        text=f"Swarm resolution time for {described}",
+        blocks=render_summary(summary, f"Resolution time, {described}"),
+        response_type="ephemeral"
+    )
+
+
+app.command("/swarmstats")(ack=ack_swarm_stats, lazy=[run_swarm_stats])
 
 
-def get_user_info(client, user_id):
+# Keep cached names fresh when a profile changes
+@app.event("user_change")
+@timed_handler("user_change")
+def handle_user_change(event):
+    user_directory.invalidate(event["user"]["id"])
+
+
+# Replies in an open swarm's thread are recorded, and ones in a thread that may be a swarm this
+# process doesn't know yet are checked by the journal; every other message is dropped in memory.
+# A new helper is added to the swarm message once their reply is stored.
+@app.event("message")
+@timed_handler("message")
+def handle_message(event, client, context):
+    ticket = record_reply(event, context.bot_user_id)
+    if ticket is None or ticket.wait(TRANSITION_WAIT_SECONDS) != APPLIED or ticket.swarm["status"] != "open":
+        return
+    swarm = ticket.swarm
+    blocks, text = render_swarm_message(swarm)
     try:
-        response = client.users_info(user=user_id)
-        return response['user']['real_name']
+        slack.chat_update(client, channel=swarm["channel_id"], ts=swarm["message_ts"], blocks=blocks, text=text)
     except SlackApiError as e:
-        logging.error(f"Error fetching user info: {e.response['error']}")
-        return user_id  # Return the user_id if fetching fails
+        logging.error(f"Error updating swarm request activity: {e.response['error']}")
+
+
+# Forget a workspace's tokens (and this process's cached authorization) once they are revoked
+# or the app is uninstalled. Bolt's built-in listeners don't pass is_enterprise_install, which
+# an org-wide install is stored under.
+@timed_handler("tokens_revoked")
+def handle_tokens_revoked(event, context):
+    tokens = event.get("tokens", {})
+    for user_id in tokens.get("oauth", []):
+        installation_store.delete_installation(
+            enterprise_id=context.enterprise_id, team_id=context.team_id, user_id=user_id,
+            is_enterprise_install=context.is_enterprise_install
+        )
+    if tokens.get("bot"):
+        installation_store.delete_bot(
+            enterprise_id=context.enterprise_id, team_id=context.team_id,
+            is_enterprise_install=context.is_enterprise_install
+        )
+
+
+@timed_handler("app_uninstalled")
+def handle_app_uninstalled(context):
+    installation_store.delete_all(
+        enterprise_id=context.enterprise_id, team_id=context.team_id,
+        is_enterprise_install=context.is_enterprise_install
+    )
 
 
+if OAUTH_ENABLED:
+    app.event("tokens_revoked")(handle_tokens_revoked)
+    app.event("app_uninstalled")(handle_app_uninstalled)
 
+
+# The Home tab: the viewer's open swarms, open swarms in the skill groups they follow, the
+# leaderboard and resolution times
 @app.event("app_home_opened")
+@timed_handler("app_home_opened")
 def app_home_opened(client, event):
-    user_id = event["user"]
+    if event.get("tab", "home") != "home":
+        return
+    try:
+        publish_home(client, event["user"])
+    except SlackApiError as e:
+        logging.error(f"Error opening app home: {e.response['error']}")
 
+
+@timed_handler("home_load_more")
+def handle_home_load_more(body, client):
+    page = json.loads(body["actions"][0]["value"])
+    state = json.loads(body["view"].get("private_metadata") or "{}")
     try:
-        # Fetch user info to get the real name
-        user_info = client.users_info(user=user_id)
-        user_name = user_info["user"]["real_name"]
-
-        # Query the database to get total statistics
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        # Get total counts
-        cur.execute("""
-            SELECT
-                COUNT(*) AS total_requests,
-                COUNT(*) FILTER (WHERE status = 'open') AS total_open,
-                COUNT(*) FILTER (WHERE status = 'resolved') AS total_resolved,
-                COUNT(*) FILTER (WHERE status = 'discarded') AS total_discarded
-            FROM swarm_requests
-        """)
-        stats = cur.fetchone()
-
-        if stats:
-            total_requests, total_open, total_resolved, total_discarded = stats
-        else:
-            total_requests = total_open = total_resolved = total_discarded = 0
-        
-        # Prepare statistics for display
-        blocks = [
-            {
-                "type": "section",
-                "block_id": "total_swarm_requests",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f"*Total Swarm Requests:* {total_requests}"
-                }
-            },
-            {
-                "type": "section",
-                "block_id": "total_open_requests",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f"*Total Open Requests:* {total_open}"
-                }
-            },
-            {
-                "type": "section",
-                "block_id": "total_resolved_requests",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f"*Total Resolved Requests:* {total_resolved}"
-                }
-            },
-            {
-                "type": "section",
-                "block_id": "total_discarded_requests",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f"*Total Discarded Requests:* {total_discarded}"
-                }
-            },
-            {"type": "divider"}
-        ]
-
-        # Query to get the request counts by user
-        cur.execute("""
-            SELECT 
-                user_id,
-                COUNT(*) AS total_requests,
-                COUNT(*) FILTER (WHERE status = 'open') AS total_open,
-                COUNT(*) FILTER (WHERE status = 'resolved') AS total_resolved,
-                COUNT(*) FILTER (WHERE status = 'discarded') AS total_discarded
-            FROM swarm_requests
-            GROUP BY user_id
-        """)
-        user_requests = cur.fetchall()
-        conn.close()
-
-        # Fetch user information for all users involved
-        user_names = {}
-        for uid, _, _, _, _ in user_requests:
-            try:
-                user_info = client.users_info(user=uid)
-                user_names[uid] = user_info["user"]["real_name"]
-            except SlackApiError:
-                user_names[uid] = f"<@{uid}>"  # Fallback to mention format
-
-        # Add user-level statistics blocks
-        for uid, total, open_count, resolved_count, discarded_count in user_requests:
-            user_name_display = user_names.get(uid, f"<@{uid}>")
-            blocks.append(
-                {
-                    "type": "section",
-                    "block_id": f"user_{uid}_stats",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"*{user_name_display}*:\n"
-                                f"- Total Requests: {total}\n"
-                                f"- Open: {open_count}\n"
-                                f"- Resolved: {resolved_count}\n"
-                                f"- Discarded: {discarded_count}"
-                    }
-                }
-            )
-            blocks.append({"type": "divider"})  # Divider between user stats
-
-        # Update the App Home tab
-        client.views_publish(
-            user_id=user_id,
-            view={
-                "type": "home",
-                "blocks": blocks
-            }
-        )
+        load_more(client, body["user"]["id"], state, page["s"], page["after"])
+    except SlackApiError as e:
+        logging.error(f"Error updating app home: {e.response['error']}")
+
 
+@timed_handler("home_skill_groups")
+def handle_home_skill_groups(body, client):
+    selected = [option["value"] for option in body["actions"][0]["selected_options"]]
+    state = json.loads(body["view"].get("private_metadata") or "{}")
+    try:
+        follow_skill_groups(client, body["user"]["id"], state, selected)
     except SlackApiError as e:
-        logging.error(f"Error opening app home: {e.response['error']}")
+        logging.error(f"Error updating app home: {e.response['error']}")
+
+
+app.action("home_load_more")(ack=ack_button, lazy=[handle_home_load_more])
+app.action("home_skill_groups")(ack=ack_button, lazy=[handle_home_skill_groups])
 
-# Start the app
+# Start the app. SLACK_RUNTIME=socket serves it over Socket Mode; otherwise this is the
+# development HTTP server (production HTTP runs wsgi.py under gunicorn)
 if __name__ == "__main__":
-    app.start(port=int(os.environ.get("PORT", 3000)))
\ No newline at end of file
+    start_warm_up(app)
+    start_metrics_server()
+    start_sweeper()
+    if os.environ.get("SLACK_RUNTIME") == "socket":
+        from socket_mode import start_socket_mode
+        start_socket_mode(app)
+    else:
+        app.start(port=int(os.environ.get("PORT", 3000)))
\ No newline at end of file
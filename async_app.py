@@ -0,0 +1,437 @@
+import os
+import json
+import copy
+import asyncio
+import logging
+
+from aiohttp import ClientSession, TCPConnector, web
+from slack_bolt.adapter.aiohttp import to_aiohttp_response, to_bolt_request
+from slack_bolt.async_app import AsyncApp
+from slack_bolt.middleware.async_middleware import AsyncMiddleware
+from slack_sdk.errors import SlackApiError
+from slack_sdk.http_retry.builtin_async_handlers import AsyncConnectionErrorRetryHandler, AsyncRateLimitErrorRetryHandler
+from slack_sdk.web.async_client import AsyncWebClient
+
+from autocomplete import duplicate_ticket_warning, option_index, skill_group_options, ticket_options
+from blocks import create_modal_metadata, render_create_modal, render_swarm_message
+from db import close_pool
+from dedup import release_delivery_async, skip_duplicates_async
+from home import follow_skill_groups_async, load_more_async, publish_home_async
+from installations import OAUTH_ENABLED
+from journal import journal, APPLIED, REJECTED
+from metrics import METRICS_PATH, METRICS_TOKEN, authorized, record_ack_time_async, registry, timed_handler
+from readiness import READINESS_PATH, readiness, start_warm_up
+from rollups import render_summary
+from search import SearchError, parse_query
+from slack_dispatch import SLACK_API_URL, SLACK_MAX_RETRIES, method_of, slack
+from storage import get_db_connection, get_read_connection, rollups, swarms
+from sweeper import start_sweeper
+from thread_activity import active_threads, record_reply
+from user_directory import user_directory
+from workers import run_blocking
+
+
+# The app on asyncio: AsyncApp, AsyncWebClient and aiohttp in one process, so an interaction
+# waiting on Slack or the journal holds no thread and one process can serve hundreds at once.
+# Postgres stays on psycopg2, awaited on the bounded db_executor (workers.py).
+#
+#   python async_app.py
+#
+# It serves the swarm lifecycle (/swarmrequest, the modal and its autocomplete, the buttons),
+# the Home tab and /swarmstats for the SLACK_BOT_TOKEN workspace. OAuth installs, /swarmsearch
+# and /swarmexport are served by the threaded app (wsgi.py).
+
+# How long a button click waits for its status change to be stored before updating the message
+TRANSITION_WAIT_SECONDS = float(os.environ.get("TRANSITION_WAIT_SECONDS", 2))
+# Open connections to the Slack API shared by every in-flight interaction
+SLACK_HTTP_CONNECTIONS = int(os.environ.get("SLACK_HTTP_CONNECTIONS", 100))
+
+
+class _CountingAsyncRateLimitRetryHandler(AsyncRateLimitErrorRetryHandler):
+    def __init__(self, dispatcher, **kwargs):
+        super().__init__(**kwargs)
+        self.dispatcher = dispatcher
+
+    def __deepcopy__(self, memo):
+        return self
+
+    async def prepare_for_next_attempt_async(self, *, state, request, response=None, error=None):
+        if response is not None:
+            retry_after = next((v[0] for k, v in response.headers.items() if k.lower() == "retry-after"), 1)
+            self.dispatcher.pause(method_of(request.url), int(retry_after))
+        self.dispatcher.count("rate_limited")
+        self.dispatcher.count("retried")
+        await super().prepare_for_next_attempt_async(state=state, request=request, response=response, error=error)
+
+
+class _CountingAsyncConnectionErrorRetryHandler(AsyncConnectionErrorRetryHandler):
+    def __init__(self, dispatcher, **kwargs):
+        super().__init__(**kwargs)
+        self.dispatcher = dispatcher
+
+    def __deepcopy__(self, memo):
+        return self
+
+    async def prepare_for_next_attempt_async(self, *, state, request, response=None, error=None):
+        self.dispatcher.count("retried")
+        await super().prepare_for_next_attempt_async(state=state, request=request, response=response, error=error)
+
+
+# AsyncApp copies the client's retry handlers and aiohttp session onto every per-request client
+def build_async_client(token):
+    return AsyncWebClient(token=token, base_url=SLACK_API_URL, retry_handlers=[
+        _CountingAsyncRateLimitRetryHandler(slack, max_retry_count=SLACK_MAX_RETRIES),
+        _CountingAsyncConnectionErrorRetryHandler(slack, max_retry_count=SLACK_MAX_RETRIES),
+    ])
+
+
+# Bolt deep-copies each request, client included, for its lazy listeners. The aiohttp session is
+# bound to the server's loop and connection pool, so a copy keeps using it as is.
+class _SessionSharingClient(AsyncWebClient):
+    def __deepcopy__(self, memo):
+        return copy.copy(self)
+
+
+# Makes the per-request client one whose copies share app.client's session. A class middleware,
+# since building a function middleware's arguments would create say() and the like around the
+# original client. Registered first, before any function middleware.
+class _ShareSession(AsyncMiddleware):
+    async def async_process(self, *, req, resp, next):
+        client = object.__new__(_SessionSharingClient)
+        client.__dict__.update(vars(req.context.client))
+        req.context["client"] = client
+        return await next()
+
+
+app = AsyncApp(client=build_async_client(os.environ.get("SLACK_BOT_TOKEN")))
+app.use(_ShareSession())
+app.use(skip_duplicates_async)
+app.use(record_ack_time_async)
+
+logging.basicConfig(level=logging.INFO)
+
+
+@app.command("/swarmrequest")
+@timed_handler("/swarmrequest")
+async def handle_swarm_request(ack, body, client):
+    await ack()
+    await slack.call_async(client, "views_open", trigger_id=body["trigger_id"], view=render_create_modal(body["channel_id"]))
+
+
+@app.options("ticket_select")
+@timed_handler("ticket_select")
+async def handle_ticket_options(ack, payload):
+    await ack(options=ticket_options(payload.get("value")))
+
+
+@app.options("skill_group_select")
+@timed_handler("skill_group_select")
+async def handle_skill_group_options(ack, payload):
+    await ack(options=skill_group_options(payload.get("value")))
+
+
+async def check_duplicate_ticket(context, view, next):
+    ticket = view["state"]["values"]["ticket"]["ticket_select"]["selected_option"]["value"]
+    _, confirmed_ticket = create_modal_metadata(view)
+    context["duplicate_ticket_warning"] = None if ticket == confirmed_ticket else duplicate_ticket_warning(ticket)
+    await next()
+
+
+async def ack_swarm_request_form(ack, body, view, context):
+    warning = context["duplicate_ticket_warning"]
+    if warning:
+        channel_id, _ = create_modal_metadata(view)
+        ticket = view["state"]["values"]["ticket"]["ticket_select"]["selected_option"]["value"]
+        await release_delivery_async(body)
+        await ack(response_action="update", view=render_create_modal(channel_id, warning, ticket))
+        return
+    await ack()
+
+
+async def _post_swarm(client, channel_id, user_id, swarm):
+    blocks, text = render_swarm_message(swarm)
+    try:
+        result = await slack.call_async(
+            client, "chat_postMessage", channel=channel_id, blocks=blocks, text=text, user=user_id, unfurl_links=True
+        )
+        return result["ts"]
+    except SlackApiError as e:
+        logging.error(f"Error posting message: {e.response['error']}")
+        return None
+
+
+@timed_handler("swarm_request_form")
+async def process_swarm_request_form(body, view, client, context):
+    if context["duplicate_ticket_warning"]:
+        return
+
+    values = view["state"]["values"]
+    channel_id, _ = create_modal_metadata(body["view"])
+    user_id = body["user"]["id"]
+    swarm = {
+        "ticket": values["ticket"]["ticket_select"]["selected_option"]["value"],
+        "entitlement": values["entitlement"]["entitlement_select"]["selected_option"]["value"],
+        "skill_group": values["skill_group"]["skill_group_select"]["selected_option"]["value"],
+        "support_tier": values["support_tier"]["support_tier_select"]["selected_option"]["value"],
+        "priority": values["priority"]["priority_select"]["selected_option"]["value"],
+        "issue_description": values["issue_description"]["issue_description_input"]["value"],
+        "help_required": values["help_required"]["help_required_input"]["value"],
+        "user_id": user_id,
+        "channel_id": channel_id,
+        "enterprise_id": context.enterprise_id,
+        "team_id": context.team_id,
+        "status": "open",
+    }
+
+    message_ts = await _post_swarm(client, channel_id, user_id, swarm)
+
+    # The journal is keyed by the posted message, so the record is queued once it exists
+    journal.create(message_ts=message_ts, **{field: swarm[field] for field in swarms.CREATE_FIELDS if field != "message_ts"})
+
+    if message_ts:
+        option_index.note(dict(swarm, message_ts=message_ts))
+        active_threads.note(dict(swarm, message_ts=message_ts))
+        try:
+            await slack.call_async(client, "pins_add", channel=channel_id, timestamp=message_ts)
+        except SlackApiError as e:
+            logging.error(f"Error pinning message: {e.response['error']}")
+
+
+app.view("swarm_request_form", middleware=[check_duplicate_ticket])(
+    ack=ack_swarm_request_form, lazy=[process_swarm_request_form]
+)
+
+
+async def ack_button(ack):
+    await ack()
+
+
+def _load_swarm(channel_id, message_ts):
+    with get_db_connection() as conn, conn.cursor() as cur:
+        return swarms.get_swarm(cur, channel_id, message_ts)
+
+
+# Same outcomes as app._transition: the stored swarm, False if rejected, None if not loadable yet
+async def _transition(channel_id, message_ts, action, user_id):
+    ticket = journal.transition(channel_id, message_ts, action, user_id)
+    outcome = await ticket.wait_async(TRANSITION_WAIT_SECONDS)
+    if outcome == REJECTED:
+        logging.error(f"No swarm request to {action} found for message_ts: {message_ts}")
+        return False
+    if outcome == APPLIED:
+        return ticket.swarm
+
+    try:
+        swarm = await run_blocking(_load_swarm, channel_id, message_ts)
+    except Exception as e:
+        logging.error(f"Error loading swarm request from database: {e}")
+        return None
+    return dict(swarm, status=swarms.TRANSITIONS[action][1]) if swarm else None
+
+
+async def _apply_action(body, client, action, verb, *steps):
+    user_id = body["user"]["id"]
+    channel_id = body["channel"]["id"]
+    message_ts = body["message"]["ts"]
+
+    swarm = await _transition(channel_id, message_ts, action, user_id)
+    if swarm is False:
+        return
+    if swarm is not None:
+        option_index.note(swarm)
+        active_threads.note(swarm)
+
+    async def update_message():
+        if swarm is None:
+            logging.error(f"Swarm request not found for message_ts: {message_ts}, message left unchanged")
+            return
+        blocks, text = render_swarm_message(swarm, actor_id=user_id)
+        await slack.chat_update_async(client, channel=channel_id, ts=message_ts, blocks=blocks, text=text)
+
+    async def run_step(step):
+        try:
+            await step()
+        except SlackApiError as e:
+            logging.error(f"Error {verb} swarm request: {e.response['error']}")
+
+    await asyncio.gather(run_step(update_message), *(run_step(lambda step=step: step(client, channel_id, message_ts))
+                                                     for step in steps))
+
+
+async def _pin(client, channel_id, message_ts):
+    await slack.call_async(client, "pins_add", channel=channel_id, timestamp=message_ts)
+
+
+async def _unpin(client, channel_id, message_ts):
+    await slack.call_async(client, "pins_remove", channel=channel_id, timestamp=message_ts)
+
+
+async def _post_reopen_notice(client, channel_id, message_ts):
+    await slack.call_async(client, "chat_postMessage", channel=channel_id, thread_ts=message_ts,
+                           text="The swarm request has been reopened and needs attention.")
+
+
+@timed_handler("resolve_button")
+async def handle_resolve_button(body, client):
+    await _apply_action(body, client, "resolve", "resolving", _unpin)
+
+
+@timed_handler("discard_button")
+async def handle_discard_button(body, client):
+    await _apply_action(body, client, "discard", "discarding", _unpin)
+
+
+@timed_handler("reopen_button")
+async def handle_reopen_swarm(body, client):
+    await _apply_action(body, client, "reopen", "reopening", _post_reopen_notice, _pin)
+
+
+app.action("resolve_button")(ack=ack_button, lazy=[handle_resolve_button])
+app.action("discard_button")(ack=ack_button, lazy=[handle_discard_button])
+app.action("reopen_button")(ack=ack_button, lazy=[handle_reopen_swarm])
+
+
+def _summarize(user_id, filters):
+    with get_read_connection(user_id) as conn, conn.cursor() as cur:
+        return rollups.summarize(cur, **filters)
+
+
+async def ack_swarm_stats(ack, body):
+    try:
+        text, filters = parse_query(body.get("text", ""))
+    except SearchError as e:
+        await ack(text=str(e))
+        return
+    if text or "status" in filters:
+        await ack(text="Filter with `skill:` and `priority:`, for example `/swarmstats skill:Data priority:High`.")
+        return
+    await ack()
+
+
+@timed_handler("/swarmstats")
+async def run_swarm_stats(body, respond):
+    # the ack already answered a query it couldn't use
+    try:
+        text, filters = parse_query(body.get("text", ""))
+    except SearchError:
+        return
+    if text or "status" in filters:
+        return
+    try:
+        summary = await run_blocking(_summarize, body["user_id"], filters)
+    except Exception as e:
+        logging.error(f"Error reading swarm rollups: {e}")
+        await respond(text="Swarm statistics are unavailable right now, please try again.", response_type="ephemeral")
+        return
+    described = " · ".join(filters.values()) or "all swarm requests"
+    await respond(
+        text=f"Swarm resolution time for {described}",
+        blocks=render_summary(summary, f"Resolution time, {described}"),
+        response_type="ephemeral"
+    )
+
+
+app.command("/swarmstats")(ack=ack_swarm_stats, lazy=[run_swarm_stats])
+
+
+@app.event("user_change")
+@timed_handler("user_change")
+async def handle_user_change(event):
+    user_directory.invalidate(event["user"]["id"])
+
+
+# Replies in open swarm threads; the lookup and the queueing never block the loop
+@app.event("message")
+@timed_handler("message")
+async def handle_message(event, client, context):
+    ticket = record_reply(event, context.bot_user_id)
+    if ticket is None or await ticket.wait_async(TRANSITION_WAIT_SECONDS) != APPLIED or ticket.swarm["status"] != "open":
+        return
+    swarm = ticket.swarm
+    blocks, text = render_swarm_message(swarm)
+    try:
+        await slack.chat_update_async(client, swarm["channel_id"], swarm["message_ts"], blocks=blocks, text=text)
+    except SlackApiError as e:
+        logging.error(f"Error updating swarm request activity: {e.response['error']}")
+
+
+@app.event("app_home_opened")
+@timed_handler("app_home_opened")
+async def app_home_opened(client, event):
+    if event.get("tab", "home") != "home":
+        return
+    try:
+        await publish_home_async(client, event["user"])
+    except SlackApiError as e:
+        logging.error(f"Error opening app home: {e.response['error']}")
+
+
+@timed_handler("home_load_more")
+async def handle_home_load_more(body, client):
+    page = json.loads(body["actions"][0]["value"])
+    state = json.loads(body["view"].get("private_metadata") or "{}")
+    try:
+        await load_more_async(client, body["user"]["id"], state, page["s"], page["after"])
+    except SlackApiError as e:
+        logging.error(f"Error updating app home: {e.response['error']}")
+
+
+@timed_handler("home_skill_groups")
+async def handle_home_skill_groups(body, client):
+    selected = [option["value"] for option in body["actions"][0]["selected_options"]]
+    state = json.loads(body["view"].get("private_metadata") or "{}")
+    try:
+        await follow_skill_groups_async(client, body["user"]["id"], state, selected)
+    except SlackApiError as e:
+        logging.error(f"Error updating app home: {e.response['error']}")
+
+
+app.action("home_load_more")(ack=ack_button, lazy=[handle_home_load_more])
+app.action("home_skill_groups")(ack=ack_button, lazy=[handle_home_skill_groups])
+
+
+async def handle_slack(request):
+    return await to_aiohttp_response(await app.async_dispatch(await to_bolt_request(request)))
+
+
+async def handle_metrics(request):
+    if not authorized(request.headers.get("Authorization")):
+        return web.Response(status=401, headers={"WWW-Authenticate": "Bearer"})
+    return web.Response(body=registry.exposition().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def handle_readiness(request):
+    status = readiness.status()
+    return web.json_response(status, status=200 if status["ready"] else 503)
+
+
+# One aiohttp session (and connection pool) for every Slack call, opened on the server's loop
+async def _open_session(web_app):
+    app.client.session = ClientSession(connector=TCPConnector(limit=SLACK_HTTP_CONNECTIONS))
+
+
+async def _close(web_app):
+    await app.client.session.close()
+    # Flush queued swarm events and release the Postgres connections before the process exits
+    await run_blocking(journal.close)
+    close_pool()
+
+
+def web_app():
+    server = web.Application()
+    server.router.add_post("/slack/events", handle_slack)
+    # Public port: metrics only behind METRICS_TOKEN (see metrics.py)
+    if METRICS_TOKEN:
+        server.router.add_get(METRICS_PATH, handle_metrics)
+    server.router.add_get(READINESS_PATH, handle_readiness)
+    server.on_startup.append(_open_session)
+    server.on_cleanup.append(_close)
+    return server
+
+
+if __name__ == "__main__":
+    if OAUTH_ENABLED:
+        raise SystemExit("The asyncio runtime serves SLACK_BOT_TOKEN's workspace only; unset SLACK_CLIENT_ID or use wsgi.py")
+    start_warm_up(app)
+    start_sweeper()
+    web.run_app(web_app(), port=int(os.environ.get("PORT", 3000)))
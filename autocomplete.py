@@ -0,0 +1,190 @@
+import os
+import time
+import bisect
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+from blocks import SKILL_GROUPS
+from storage import get_read_connection, swarms
+from workers import side_effect_executor
+
+
+# The create modal's Ticket and Skill Group fields are external selects, answered from this
+# process's memory so suggestions come back within a few milliseconds. Tickets of swarms changed
+# in the last AUTOCOMPLETE_TICKET_DAYS days are loaded once, then kept current from
+# swarm_requests every AUTOCOMPLETE_REFRESH_INTERVAL seconds.
+AUTOCOMPLETE_REFRESH_INTERVAL = float(os.environ.get("AUTOCOMPLETE_REFRESH_INTERVAL", 30))
+AUTOCOMPLETE_TICKET_DAYS = int(os.environ.get("AUTOCOMPLETE_TICKET_DAYS", 90))
+AUTOCOMPLETE_MAX_OPTIONS = int(os.environ.get("AUTOCOMPLETE_MAX_OPTIONS", 20))
+# Each refresh re-reads this much before the last change it saw, so a transaction that committed
+# after a later-stamped one is not skipped
+AUTOCOMPLETE_REFRESH_OVERLAP = timedelta(seconds=int(os.environ.get("AUTOCOMPLETE_REFRESH_OVERLAP", 60)))
+_REFRESH_BATCH_SIZE = 5000
+
+# Slack's limits on an option's text and value
+_MAX_TEXT = 75
+_MAX_VALUE = 150
+
+
+def _key(ticket):
+    return (ticket or "").strip().lower()
+
+
+# Tickets as a sorted array of lowercased keys for prefix lookups by bisection, each with the
+# messages of its open swarms, plus the configured skill groups
+class OptionIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []
+        self._tickets = {}
+        self._skill_groups = SKILL_GROUPS
+        self._cursor = None
+        self._refreshed_at = None
+        self._refreshing = False
+
+    # Apply a swarm as created or transitioned by this process, ahead of the next refresh
+    def note(self, swarm):
+        with self._lock:
+            self._apply(swarm)
+
+    def _apply(self, swarm):
+        key = _key(swarm["ticket"])
+        if not key:
+            return
+        entry = self._tickets.get(key)
+        if entry is None:
+            entry = self._tickets[key] = (swarm["ticket"].strip(), set())
+            bisect.insort(self._keys, key)
+        message = (swarm["channel_id"], swarm["message_ts"])
+        if swarm["status"] == "open" and swarm["message_ts"]:
+            entry[1].add(message)
+        else:
+            entry[1].discard(message)
+
+    # Catch up on swarms changed since the last refresh (or in the last AUTOCOMPLETE_TICKET_DAYS
+    # days on the first one) and reload the skill groups
+    def refresh(self):
+        with self._lock:
+            cursor = self._cursor
+        if cursor is None:
+            since = datetime.now(timezone.utc) - timedelta(days=AUTOCOMPLETE_TICKET_DAYS)
+        else:
+            since = cursor[0] - AUTOCOMPLETE_REFRESH_OVERLAP
+        after_id = 0
+        changes = []
+        with get_read_connection() as conn, conn.cursor() as cur:
+            skill_groups = swarms.list_skill_groups(cur)
+            while True:
+                batch = swarms.ticket_changes(cur, since, after_id, _REFRESH_BATCH_SIZE)
+                changes.extend(batch)
+                if len(batch) < _REFRESH_BATCH_SIZE:
+                    break
+                since, after_id = batch[-1]["updated_at"], batch[-1]["id"]
+
+        with self._lock:
+            for change in changes:
+                self._apply(change)
+            if changes:
+                last = (changes[-1]["updated_at"], changes[-1]["id"])
+                self._cursor = max(self._cursor, last) if self._cursor else last
+            elif self._cursor is None:
+                self._cursor = (since, 0)
+            if skill_groups:
+                self._skill_groups = tuple(skill_groups)
+            self._refreshed_at = time.monotonic()
+
+    # Start a background refresh if the index is older than the refresh interval. Lookups never
+    # wait for it; they answer from what is loaded.
+    def refresh_if_stale(self):
+        with self._lock:
+            if self._refreshing or (
+                self._refreshed_at is not None and time.monotonic() - self._refreshed_at < AUTOCOMPLETE_REFRESH_INTERVAL
+            ):
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Error refreshing the autocomplete index: {e}")
+                with self._lock:
+                    # Wait out the interval before trying again
+                    self._refreshed_at = time.monotonic()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        side_effect_executor.submit(run)
+
+    # Up to limit (ticket, open swarm count) pairs whose ticket starts with prefix, case-insensitively
+    def tickets(self, prefix, limit=AUTOCOMPLETE_MAX_OPTIONS):
+        prefix = _key(prefix)
+        matches = []
+        with self._lock:
+            position = bisect.bisect_left(self._keys, prefix)
+            while position < len(self._keys) and len(matches) < limit and self._keys[position].startswith(prefix):
+                ticket, open_messages = self._tickets[self._keys[position]]
+                matches.append((ticket, len(open_messages)))
+                position += 1
+        return matches
+
+    def open_swarms(self, ticket):
+        with self._lock:
+            entry = self._tickets.get(_key(ticket))
+            return len(entry[1]) if entry else 0
+
+    # Active skill groups containing query, in their configured order
+    def skill_groups(self, query=""):
+        query = query.strip().lower()
+        with self._lock:
+            return [skill_group for skill_group in self._skill_groups if query in skill_group.lower()]
+
+    def size(self):
+        with self._lock:
+            return len(self._keys)
+
+
+option_index = OptionIndex()
+
+
+def _option(text, value):
+    if len(text) > _MAX_TEXT:
+        text = text[:_MAX_TEXT - 1] + "…"
+    return {"text": {"type": "plain_text", "text": text}, "value": value}
+
+
+def _open_label(ticket, open_count):
+    if not open_count:
+        return ticket
+    return f"{ticket} · ⚠ {open_count} open swarm{'s' if open_count > 1 else ''}"
+
+
+# Options for the Ticket field: known tickets matching what was typed, flagged when they already
+# have an open swarm, after the typed ticket itself if it is new
+def ticket_options(query):
+    option_index.refresh_if_stale()
+    typed = (query or "").strip()
+    matches = option_index.tickets(typed)
+    options = []
+    if typed and len(typed) <= _MAX_VALUE and all(_key(ticket) != _key(typed) for ticket, _ in matches):
+        options.append(_option(f"{typed} (new)", typed))
+    options.extend(_option(_open_label(ticket, open_count), ticket) for ticket, open_count in matches
+                   if len(ticket) <= _MAX_VALUE)
+    return options[:AUTOCOMPLETE_MAX_OPTIONS]
+
+
+def skill_group_options(query):
+    option_index.refresh_if_stale()
+    return [_option(skill_group, skill_group) for skill_group in option_index.skill_groups(query or "")]
+
+
+# The modal warning for a ticket with an open swarm known to this process, or None. Only a flag:
+# a swarm opened on another worker since the last refresh isn't known yet, and the user may post anyway.
+def duplicate_ticket_warning(ticket):
+    open_count = option_index.open_swarms(ticket)
+    if not open_count:
+        return None
+    return (f"{ticket.strip()} already has {'an open swarm request' if open_count == 1 else f'{open_count} open swarm requests'}. "
+            "Submit again to post another one anyway.")
@@ -0,0 +1,46 @@
+import os
+import sys
+import json
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SWARM_STORAGE", "memory")
+
+from autocomplete import option_index, skill_group_options, ticket_options
+
+
+# Micro-benchmark for the modal's autocomplete options:
+#   python bench/autocomplete_bench.py [tickets] [iterations]
+# Fills the index with that many tickets, a tenth of them with an open swarm, then times option
+# responses (including their JSON) for typed prefixes of different lengths.
+
+
+def fill(tickets):
+    for n in range(tickets):
+        option_index.note({
+            "ticket": f"{10000000 + n * 7}", "channel_id": "C024BE91L", "message_ts": f"{n}.000100",
+            "status": "open" if n % 10 == 0 else "resolved",
+        })
+
+
+def main(tickets, iterations):
+    fill(tickets)
+    # Stop ticket_options() from scheduling refreshes against the empty memory store
+    option_index._refreshed_at = float("inf")
+    queries = {
+        "1 character": "1",
+        "4 characters": "1002",
+        "full ticket": "10000700",
+        "no match": "9",
+    }
+    print(f"{tickets} tickets indexed")
+    print(f"{'query':<20}{'options':>8}{'us/response':>14}")
+    for name, query in queries.items():
+        cost = min(timeit.repeat(lambda: json.dumps(ticket_options(query)), number=iterations, repeat=5)) / iterations
+        print(f"{name:<20}{len(ticket_options(query)):>8}{cost * 1e6:>14.2f}")
+    cost = min(timeit.repeat(lambda: json.dumps(skill_group_options("d")), number=iterations, repeat=5)) / iterations
+    print(f"{'skill group':<20}{len(skill_group_options('d')):>8}{cost * 1e6:>14.2f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000, int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
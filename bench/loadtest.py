@@ -0,0 +1,324 @@
+import os
+import sys
+import hmac
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import itertools
+import threading
+from urllib.parse import parse_qs, urlencode
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Offline load test: drives signed Slack payloads into the Bolt app while a local stand-in
+# answers the Slack Web API calls it makes. No workspace or Heroku Postgres needed.
+#
+#   python bench/loadtest.py --requests 500 --concurrency 32 --latency-ms 80 --rate-limit 0.02
+#
+# Storage defaults to the in-process backend (SWARM_STORAGE=memory); pass --storage postgres
+# to run against DATABASE_URL instead. --runtime async drives async_app.py's AsyncApp on an
+# event loop instead of the threaded app.
+
+SIGNING_SECRET = "loadtest-signing-secret"
+
+
+class FakeSlack:
+    def __init__(self, latency_ms, jitter_ms, rate_limit):
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.rate_limit = rate_limit
+        self.ts_counter = itertools.count(1)
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.rate_limited = 0
+        # (method, key) -> time the call was answered, where key is the channel, ts, user or trigger
+        self.seen = {}
+        # channel -> ts of the swarm message posted there
+        self.posted = {}
+        self.seen_changed = threading.Condition(self.lock)
+
+    def record(self, method, key):
+        with self.seen_changed:
+            self.seen[(method, key)] = time.perf_counter()
+            self.seen_changed.notify_all()
+
+    def wait_for(self, method, key, timeout):
+        deadline = time.monotonic() + timeout
+        with self.seen_changed:
+            while (method, key) not in self.seen:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.seen_changed.wait(remaining)
+            return self.seen[(method, key)]
+
+    def respond(self, method, args):
+        if method == "auth.test":
+            return {"ok": True, "user_id": "UBOT", "bot_id": "BBOT", "team_id": "T0001", "url": "https://loadtest.slack.com/"}
+        if method == "chat.postMessage":
+            ts = f"{int(time.time())}.{next(self.ts_counter):06d}"
+            if "thread_ts" not in args:
+                with self.lock:
+                    self.posted[args.get("channel")] = ts
+                self.record(method, args.get("channel"))
+            return {"ok": True, "channel": args.get("channel"), "ts": ts}
+        if method in ("chat.update", "pins.add", "pins.remove"):
+            self.record(method, args.get("ts") or args.get("timestamp"))
+            return {"ok": True}
+        if method == "users.info":
+            return {"ok": True, "user": {"id": args.get("user"), "real_name": f"User {args.get('user')}"}}
+        if method == "users.list":
+            return {"ok": True, "members": [], "response_metadata": {"next_cursor": ""}}
+        if method == "views.open":
+            self.record(method, args.get("trigger_id"))
+            return {"ok": True, "view": {"id": "V0001"}}
+        if method == "views.publish":
+            self.record(method, args.get("user_id"))
+            return {"ok": True, "view": {"id": "V0002"}}
+        return {"ok": True}
+
+    def serve(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # users.info and a few other read methods are sent as GETs with the arguments in the query
+            def do_GET(self):
+                path, _, query = self.path.partition("?")
+                self.answer(path.rsplit("/", 1)[-1], {k: v[0] for k, v in parse_qs(query).items()})
+
+            def do_POST(self):
+                method = self.path.split("?", 1)[0].rsplit("/", 1)[-1]
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    args = json.loads(body or "{}")
+                else:
+                    args = {k: v[0] for k, v in parse_qs(body).items()}
+                self.answer(method, args)
+
+            def answer(self, method, args):
+                time.sleep(max(0.0, fake.latency + random.uniform(-fake.jitter, fake.jitter)))
+                with fake.lock:
+                    fake.calls[method] = fake.calls.get(method, 0) + 1
+                if method != "auth.test" and random.random() < fake.rate_limit:
+                    with fake.lock:
+                        fake.rate_limited += 1
+                    self.send_response(429)
+                    self.send_header("Retry-After", "1")
+                    self.send_header("Content-Type", "application/json")
+                    self.end_headers()
+                    self.wfile.write(b'{"ok": false, "error": "ratelimited"}')
+                    return
+                payload = json.dumps(fake.respond(method, args)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        # The default listen backlog of 5 resets connections under any real concurrency
+        ThreadingHTTPServer.request_queue_size = 256
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{server.server_address[1]}/api/"
+
+
+def signed_request(body, content_type):
+    from slack_bolt.request import BoltRequest
+
+    timestamp = str(int(time.time()))
+    signature = "v0=" + hmac.new(SIGNING_SECRET.encode(), f"v0:{timestamp}:{body}".encode(), hashlib.sha256).hexdigest()
+    return BoltRequest(body=body, headers={
+        "content-type": [content_type],
+        "x-slack-request-timestamp": [timestamp],
+        "x-slack-signature": [signature],
+    })
+
+
+def interaction(payload):
+    return signed_request(urlencode({"payload": json.dumps(payload)}), "application/x-www-form-urlencoded")
+
+
+def slash_command(n):
+    form = {"command": "/swarmrequest", "text": "", "team_id": "T0001", "user_id": f"U{n:05d}",
+            "channel_id": f"C{n:05d}", "trigger_id": f"trigger-{n}", "api_app_id": "A0001"}
+    return signed_request(urlencode(form), "application/x-www-form-urlencoded"), ("views.open", f"trigger-{n}")
+
+
+def view_submission(n):
+    def selected(value):
+        return {"selected_option": {"value": value}}
+
+    values = {
+        "ticket": {"ticket_select": selected(f"{10000000 + n}")},
+        "entitlement": {"entitlement_select": selected("Enterprise Premier")},
+        "skill_group": {"skill_group_select": selected(random.choice(["Data", "Runtime", "Other"]))},
+        "support_tier": {"support_tier_select": selected("General Usage")},
+        "priority": {"priority_select": selected(random.choice(["Critical", "High", "Normal"]))},
+        "issue_description": {"issue_description_input": {"value": "Load test issue description " * 8}},
+        "help_required": {"help_required_input": {"value": "Load test help required " * 4}},
+    }
+    payload = {
+        "type": "view_submission", "team": {"id": "T0001"}, "api_app_id": "A0001",
+        "user": {"id": f"U{n % 200:05d}", "team_id": "T0001"},
+        "view": {"id": f"V{n:08d}", "hash": f"hash-{n}", "callback_id": "swarm_request_form", "type": "modal",
+                 "private_metadata": f"C{n:05d}", "state": {"values": values}},
+    }
+    return interaction(payload), ("chat.postMessage", f"C{n:05d}")
+
+
+def button_click(n, action_id, channel_id, message_ts):
+    payload = {
+        "type": "block_actions", "team": {"id": "T0001"}, "api_app_id": "A0001",
+        "user": {"id": f"U{n % 200:05d}", "team_id": "T0001"}, "trigger_id": f"trigger-{action_id}-{n}",
+        "channel": {"id": channel_id}, "container": {"type": "message", "channel_id": channel_id, "message_ts": message_ts},
+        "message": {"ts": message_ts, "blocks": []},
+        "actions": [{"action_id": action_id, "block_id": "actions-block", "type": "button",
+                     "action_ts": f"{time.time():.6f}", "value": action_id.split("_")[0]}],
+    }
+    return interaction(payload), ("chat.update", message_ts)
+
+
+def home_opened(n):
+    event = {
+        "type": "event_callback", "team_id": "T0001", "api_app_id": "A0001", "event_id": f"Ev{n:08d}",
+        "event_time": int(time.time()),
+        "event": {"type": "app_home_opened", "user": f"U{n % 200:05d}", "tab": "home", "channel": f"D{n:05d}"},
+    }
+    return signed_request(json.dumps(event), "application/json"), ("views.publish", f"U{n % 200:05d}")
+
+
+# A message in a channel: a helper's reply in a swarm's thread, which re-renders the swarm message,
+# or (thread_ts None) one of the unrelated messages the app must drop cheaply
+def channel_message(n, channel_id, thread_ts=None):
+    event = {"type": "message", "channel": channel_id, "user": f"H{n:05d}", "text": "On it", "ts": f"{time.time():.6f}"}
+    if thread_ts:
+        event["thread_ts"] = thread_ts
+    body = {"type": "event_callback", "team_id": "T0001", "api_app_id": "A0001", "event_id": f"EvMsg{n:08d}",
+            "event_time": int(time.time()), "event": event}
+    return signed_request(json.dumps(body), "application/json"), ("chat.update", thread_ts) if thread_ts else (None, None)
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+# Run async_app's AsyncApp on an event loop thread; returns a blocking dispatch(request) for the drivers
+def async_dispatcher(async_app):
+    from slack_bolt.request.async_request import AsyncBoltRequest
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(async_app._open_session(None), loop).result()
+
+    def dispatch(request):
+        request = AsyncBoltRequest(body=request.raw_body, headers=request.headers)
+        return asyncio.run_coroutine_threadsafe(async_app.app.async_dispatch(request), loop).result()
+    return dispatch
+
+
+def run_phase(dispatch, fake, name, requests, concurrency, timeout):
+    acks, completions, failures = [], [], 0
+    lock = threading.Lock()
+
+    def drive(item):
+        nonlocal failures
+        request, (method, key) = item
+        started = time.perf_counter()
+        response = dispatch(request)
+        acked = time.perf_counter()
+        # Requests with no side effect complete with their ack
+        completed = fake.wait_for(method, key, timeout) if method else acked
+        with lock:
+            if response.status != 200 or completed is None:
+                failures += 1
+            acks.append(acked - started)
+            if completed is not None:
+                completions.append(completed - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(drive, requests))
+    elapsed = time.perf_counter() - started
+
+    ms = 1000.0
+    print(f"{name:<16}{len(requests):>6}{failures:>6}{len(requests) / elapsed:>9.1f}"
+          f"{percentile(acks, 50) * ms:>9.1f}{percentile(acks, 95) * ms:>9.1f}{percentile(acks, 99) * ms:>9.1f}"
+          f"{percentile(completions, 50) * ms:>9.1f}{percentile(completions, 95) * ms:>9.1f}{percentile(completions, 99) * ms:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200, help="requests per handler")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=50, help="injected Slack API latency")
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of Slack calls answered with 429")
+    parser.add_argument("--rate-scale", type=float, default=1000,
+                        help="SLACK_RATE_SCALE for the dispatcher; 1 applies Slack's real per-workspace tiers")
+    parser.add_argument("--storage", choices=["memory", "postgres"], default="memory")
+    parser.add_argument("--runtime", choices=["threads", "async"], default="threads")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for a request's side effects")
+    args = parser.parse_args()
+
+    fake = FakeSlack(args.latency_ms, args.jitter_ms, args.rate_limit)
+    os.environ.update({
+        "SLACK_API_URL": fake.serve(),
+        "SLACK_BOT_TOKEN": "xoxb-loadtest",
+        "SLACK_SIGNING_SECRET": SIGNING_SECRET,
+        "SWARM_STORAGE": args.storage,
+        "SLACK_RATE_SCALE": str(args.rate_scale),
+    })
+    if args.runtime == "async":
+        import async_app as swarm_app
+        dispatch = async_dispatcher(swarm_app)
+    else:
+        import app as swarm_app
+        dispatch = swarm_app.app.dispatch
+    n = args.requests
+    print(f"{'handler':<16}{'reqs':>6}{'fail':>6}{'req/s':>9}{'ack50':>9}{'ack95':>9}{'ack99':>9}"
+          f"{'e2e50':>9}{'e2e95':>9}{'e2e99':>9}   (ms)")
+    run_phase(dispatch, fake, "/swarmrequest", [slash_command(i) for i in range(n)], args.concurrency, args.timeout)
+    run_phase(dispatch, fake, "view_submission", [view_submission(i) for i in range(n)], args.concurrency, args.timeout)
+
+    # Resolve every swarm just created, then reopen half of them
+    with fake.lock:
+        messages = sorted(fake.posted.items())
+    run_phase(dispatch, fake, "resolve_button",
+              [button_click(i, "resolve_button", channel, ts) for i, (channel, ts) in enumerate(messages)],
+              args.concurrency, args.timeout)
+    with fake.lock:
+        for _, ts in messages:
+            fake.seen.pop(("chat.update", ts), None)
+    half = messages[: len(messages) // 2]
+    run_phase(dispatch, fake, "reopen_button",
+              [button_click(i, "reopen_button", channel, ts) for i, (channel, ts) in enumerate(half)],
+              args.concurrency, args.timeout)
+    with fake.lock:
+        for _, ts in half:
+            fake.seen.pop(("chat.update", ts), None)
+    run_phase(dispatch, fake, "thread_reply",
+              [channel_message(i, channel, ts) for i, (channel, ts) in enumerate(half)],
+              args.concurrency, args.timeout)
+    run_phase(dispatch, fake, "channel_message", [channel_message(i, f"C{i:05d}") for i in range(n * 10)],
+              args.concurrency, args.timeout)
+    run_phase(dispatch, fake, "app_home_opened", [home_opened(i) for i in range(n)], args.concurrency, args.timeout)
+
+    print(f"\nSlack calls: {dict(sorted(fake.calls.items()))}  429s injected: {fake.rate_limited}")
+    print(f"Dispatcher: {swarm_app.slack.counters()}")
+
+
+if __name__ == "__main__":
+    main()
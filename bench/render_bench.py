@@ -0,0 +1,44 @@
+import os
+import sys
+import json
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blocks import render_create_modal, render_swarm_message
+
+
+# Micro-benchmark for the Block Kit renders: python bench/render_bench.py [iterations]
+
+SWARM = {
+    "ticket": "12345678",
+    "entitlement": "Enterprise Premier",
+    "skill_group": "Platform/Web Services",
+    "support_tier": "High Complexity",
+    "priority": "Urgent",
+    "issue_description": "Dyno boot timeouts after stack upgrade. " * 10,
+    "help_required": "Someone familiar with buildpacks to pair on the slug. " * 5,
+    "user_id": "U012AB3CD",
+    "channel_id": "C024BE91L",
+    "status": "open",
+}
+
+CASES = {
+    "create modal": lambda: render_create_modal("C024BE91L"),
+    "open message": lambda: render_swarm_message(SWARM),
+    "resolved message": lambda: render_swarm_message(dict(SWARM, status="resolved"), actor_id="U0G9QF9C6"),
+    "discarded message": lambda: render_swarm_message(dict(SWARM, status="discarded"), actor_id="U0G9QF9C6"),
+    "reopened message": lambda: render_swarm_message(SWARM, actor_id="U0G9QF9C6"),
+}
+
+
+def main(iterations):
+    print(f"{'render':<20}{'us/render':>12}{'us/render+json':>16}")
+    for name, render in CASES.items():
+        render_cost = min(timeit.repeat(render, number=iterations, repeat=5)) / iterations
+        serialize_cost = min(timeit.repeat(lambda: json.dumps(render()), number=iterations, repeat=5)) / iterations
+        print(f"{name:<20}{render_cost * 1e6:>12.2f}{serialize_cost * 1e6:>16.2f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
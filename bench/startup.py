@@ -0,0 +1,123 @@
+import os
+import sys
+import hmac
+import time
+import socket
+import hashlib
+import argparse
+import statistics
+import subprocess
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from loadtest import SIGNING_SECRET, FakeSlack
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Startup benchmark: boots the production server (gunicorn wsgi:application) against a local
+# stand-in for the Slack API and reports, from the moment the process is spawned,
+#   listen  - the port accepts connections
+#   ack     - a signed slash command is first answered with a 200
+#   ready   - READINESS_PATH reports every warm-up step done
+# for FAST_STARTUP on and off.
+#
+#   python bench/startup.py --runs 5 --latency-ms 400
+#
+# The injected latency stands in for the TLS handshake and round trip of auth.test from a dyno.
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _listening(port):
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+            return True
+    except OSError:
+        return False
+
+
+def _slash_command(port):
+    body = urlencode({"command": "/swarmstats", "text": "", "team_id": "T0001", "user_id": "U00001",
+                      "channel_id": "C00001", "api_app_id": "A0001"})
+    timestamp = str(int(time.time()))
+    signature = "v0=" + hmac.new(SIGNING_SECRET.encode(), f"v0:{timestamp}:{body}".encode(), hashlib.sha256).hexdigest()
+    request = Request(f"http://127.0.0.1:{port}/slack/events", data=body.encode(), headers={
+        "Content-Type": "application/x-www-form-urlencoded",
+        "X-Slack-Request-Timestamp": timestamp,
+        "X-Slack-Signature": signature,
+    })
+    try:
+        with urlopen(request, timeout=5) as response:
+            return response.status == 200
+    except (HTTPError, URLError, OSError):
+        return False
+
+
+def _ready(port):
+    try:
+        with urlopen(f"http://127.0.0.1:{port}/ready", timeout=1) as response:
+            return response.status == 200
+    except (HTTPError, URLError, OSError):
+        return False
+
+
+def _wait(check, started, timeout):
+    while time.perf_counter() - started < timeout:
+        if check():
+            return time.perf_counter() - started
+        time.sleep(0.005)
+    return float("nan")
+
+
+def boot_once(api_url, fast, storage, timeout):
+    port = _free_port()
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        WEB_CONCURRENCY="1",
+        FAST_STARTUP="true" if fast else "false",
+        SLACK_API_URL=api_url,
+        SLACK_BOT_TOKEN="xoxb-startup",
+        SLACK_SIGNING_SECRET=SIGNING_SECRET,
+        SWARM_STORAGE=storage,
+        SWEEPER_ENABLED="false",
+    )
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "wsgi:application", "-c", "gunicorn.conf.py", "--access-logfile", "/dev/null"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        listen = _wait(lambda: _listening(port), started, timeout)
+        ack = _wait(lambda: _slash_command(port), started, timeout)
+        ready = _wait(lambda: _ready(port), started, timeout)
+    finally:
+        server.terminate()
+        server.wait()
+    return listen, ack, ready
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time-to-listen and time-to-first-ack of the production server")
+    parser.add_argument("--runs", type=int, default=3, help="boots per mode")
+    parser.add_argument("--latency-ms", type=float, default=400, help="injected Slack API latency")
+    parser.add_argument("--storage", choices=["memory", "postgres"], default="memory")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for each milestone")
+    args = parser.parse_args()
+
+    api_url = FakeSlack(args.latency_ms, 0, 0.0).serve()
+    print(f"{'mode':<14}{'listen':>10}{'ack':>10}{'ready':>10}   (ms, median of {args.runs})")
+    for fast in (True, False):
+        runs = [boot_once(api_url, fast, args.storage, args.timeout) for _ in range(args.runs)]
+        listen, ack, ready = (statistics.median(column) * 1000 for column in zip(*runs))
+        print(f"{'fast' if fast else 'eager':<14}{listen:>10.0f}{ack:>10.0f}{ready:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
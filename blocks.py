@@ -0,0 +1,197 @@
+import json
+
+from rollups import format_duration
+
+
+# Block Kit templates for the create modal and the swarm message.
+# Everything static is built once at import time. The swarm message shares its static blocks
+# with every render, so a render only allocates the few blocks that carry swarm data; shared parts
+# must never be mutated. The create modal is copied per render (see _CREATE_MODAL).
+
+ENTITLEMENTS = ("Enterprise Signature", "Enterprise Premier", "Enterprise Standard", "Online Customer")
+SKILL_GROUPS = ("Data", "Runtime", "Platform/Web Services", "Account Management", "Other")
+SUPPORT_TIERS = ("High Complexity", "General Usage")
+PRIORITIES = ("Critical", "Urgent", "High", "Normal", "Low")
+# Helpers named on the swarm message before the rest are only counted
+MAX_HELPERS_SHOWN = 10
+
+
+def _text(text):
+    return {"type": "plain_text", "text": text}
+
+
+def _options(values):
+    return [{"text": _text(value), "value": value} for value in values]
+
+
+def _select(block_id, action_id, placeholder, label, values):
+    return {
+        "type": "input",
+        "block_id": block_id,
+        "element": {
+            "type": "static_select",
+            "action_id": action_id,
+            "placeholder": _text(placeholder),
+            "options": _options(values)
+        },
+        "label": _text(label)
+    }
+
+
+# Options come from an app.options listener as the user types (see autocomplete.py)
+def _external_select(block_id, action_id, placeholder, label, min_query_length):
+    return {
+        "type": "input",
+        "block_id": block_id,
+        "element": {
+            "type": "external_select",
+            "action_id": action_id,
+            "placeholder": _text(placeholder),
+            "min_query_length": min_query_length
+        },
+        "label": _text(label)
+    }
+
+
+def _text_input(block_id, action_id, label, multiline=False):
+    element = {"type": "plain_text_input", "action_id": action_id}
+    if multiline:
+        element["multiline"] = True
+    return {"type": "input", "block_id": block_id, "element": element, "label": _text(label)}
+
+
+# Kept serialized: decoding it gives every render its own copy, nested blocks included, in a
+# fraction of a deepcopy's time, so a handler that edits one render can't change the next
+_CREATE_MODAL = json.dumps({
+    "type": "modal",
+    "callback_id": "swarm_request_form",
+    "title": _text("Create Swarm Request"),
+    "submit": _text("Submit"),
+    "close": _text("Cancel"),
+    "blocks": (
+        _external_select("ticket", "ticket_select", "Type a ticket number", "Ticket", 1),
+        _select("entitlement", "entitlement_select", "Select Entitlement", "Entitlement", ENTITLEMENTS),
+        _external_select("skill_group", "skill_group_select", "Select Skill Group", "Skill Group", 0),
+        _select("support_tier", "support_tier_select", "Select Support Tier", "Support Tier", SUPPORT_TIERS),
+        _select("priority", "priority_select", "Select Priority", "Priority", PRIORITIES),
+        _text_input("issue_description", "issue_description_input", "Issue Description", multiline=True),
+        _text_input("help_required", "help_required_input", "Help Required", multiline=True),
+    ),
+})
+
+
+# The modal for a swarm in channel_id. With a warning (a ticket that already has an open swarm)
+# it is shown again under the ticket, and submitting confirmed_ticket again posts it anyway.
+def render_create_modal(channel_id, warning=None, confirmed_ticket=None):
+    view = json.loads(_CREATE_MODAL)
+    if warning is None:
+        view["private_metadata"] = channel_id
+        return view
+    view["private_metadata"] = json.dumps({"channel_id": channel_id, "confirmed_ticket": confirmed_ticket})
+    view["blocks"].insert(1, {
+        "type": "context",
+        "block_id": "duplicate_ticket_warning",
+        "elements": [{"type": "mrkdwn", "text": f":warning: {warning}"}],
+    })
+    view["submit"] = _text("Post Anyway")
+    return view
+
+
+# (channel_id, ticket confirmed despite the warning or None) from a submitted create modal
+def create_modal_metadata(view):
+    metadata = view.get("private_metadata") or ""
+    if not metadata.startswith("{"):
+        return metadata, None
+    metadata = json.loads(metadata)
+    return metadata["channel_id"], metadata.get("confirmed_ticket")
+
+
+_HEADER = {"type": "header", "text": {"type": "plain_text", "text": "New Swarm Request", "emoji": True}}
+_DIVIDER = {"type": "divider"}
+
+_RESOLVE_BUTTON = {
+    "type": "button",
+    "text": _text("Resolve Swarm"),
+    "style": "primary",
+    "value": "resolve",
+    "action_id": "resolve_button"
+}
+_DISCARD_BUTTON = {
+    "type": "button",
+    "text": _text("Discard Swarm"),
+    "style": "danger",
+    "value": "discard",
+    "action_id": "discard_button"
+}
+_REOPEN_BUTTON = {
+    "type": "button",
+    "text": _text("Re-Open Swarm"),
+    "style": "primary",
+    "value": "reopen",
+    "action_id": "reopen_button"
+}
+_OPEN_ACTIONS = {"type": "actions", "block_id": "actions-block", "elements": [_RESOLVE_BUTTON, _DISCARD_BUTTON]}
+_CLOSED_ACTIONS = {"type": "actions", "block_id": "actions-block", "elements": [_REOPEN_BUTTON]}
+
+
+def _mrkdwn(text):
+    return {"type": "mrkdwn", "text": text}
+
+
+def _swarm_body(swarm):
+    return [
+        _HEADER,
+        # Section with inline fields for Ticket, Entitlement, Skill Group, Support Tier, and Priority
+        {
+            "type": "section",
+            "block_id": "details-section",
+            "fields": [
+                _mrkdwn("*Ticket:*\n" + swarm["ticket"]),
+                _mrkdwn("*Entitlement:*\n" + swarm["entitlement"]),
+                _mrkdwn("*Skill Group:*\n" + swarm["skill_group"]),
+                _mrkdwn("*Support Tier:*\n" + swarm["support_tier"]),
+                _mrkdwn("*Priority:*\n" + swarm["priority"]),
+                _mrkdwn(f"*Opened By:*\n<@{swarm['user_id']}>"),
+            ]
+        },
+        _DIVIDER,
+        {"type": "section", "block_id": "description-section", "text": _mrkdwn("*Issue Description:*\n" + swarm["issue_description"])},
+        {"type": "section", "block_id": "help-required-section", "text": _mrkdwn("*Help Required:*\n" + swarm["help_required"])},
+    ]
+
+
+# Who has replied in the thread and how soon the first of them did, once anyone has
+def _activity(swarm):
+    if not swarm.get("first_response_at"):
+        return None
+    waited = format_duration(max(0, (swarm["first_response_at"] - swarm["created_at"]).total_seconds()))
+    helpers = swarm["participants"]
+    named = ", ".join(f"<@{user_id}>" for user_id in helpers[:MAX_HELPERS_SHOWN])
+    if len(helpers) > MAX_HELPERS_SHOWN:
+        named += f" and {len(helpers) - MAX_HELPERS_SHOWN} more"
+    return {
+        "type": "context",
+        "block_id": "activity-section",
+        "elements": [_mrkdwn(f"First response after {waited} from <@{swarm['first_responder_id']}> · Helping: {named}")]
+    }
+
+
+# Render the channel message for a swarm record in its current status.
+# actor_id is whoever made the latest change; a reopened swarm is an open one with an actor.
+# Returns (blocks, fallback text).
+def render_swarm_message(swarm, actor_id=None):
+    blocks = _swarm_body(swarm)
+    activity = _activity(swarm)
+    if activity:
+        blocks.append(activity)
+    status = swarm.get("status", "open")
+    if status == "open":
+        if actor_id:
+            blocks.append({"type": "context", "block_id": "status-section", "elements": [_mrkdwn(f"Swarm request reopened by <@{actor_id}>.")]})
+        blocks.append(_OPEN_ACTIONS)
+        return blocks, "New Swarm Request"
+
+    closed_by = f" by <@{actor_id}>" if actor_id else ""
+    blocks.append({"type": "section", "block_id": "status-section", "text": _mrkdwn(f"Swarm request {status}{closed_by}.")})
+    blocks.append(_CLOSED_ACTIONS)
+    return blocks, f"Swarm request {status}"
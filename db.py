@@ -0,0 +1,339 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool
+from psycopg2.extensions import cursor as base_cursor
+
+from metrics import current_listener, db_statement_rows, db_statement_seconds, registry
+from workers import EXPORT_WORKERS, LISTENER_WORKERS, SIDE_EFFECT_WORKERS
+
+
+# Pool sizing, overridable per dyno. By default every thread that may use the database can hold
+# a connection at once: listeners, their side effects, exports, and the journal, sweeper and
+# follower monitor. Connections are only opened as they are needed; lower DB_POOL_MAX to fit the
+# plan's connection limit and the rest wait for a free one.
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", LISTENER_WORKERS + SIDE_EFFECT_WORKERS + EXPORT_WORKERS + 3))
+# How long a checkout waits for a free connection before giving up
+DB_POOL_WAIT_SECONDS = float(os.environ.get("DB_POOL_WAIT_SECONDS", 5))
+# A pooled connection is checked with a SELECT 1 before use only once it has sat idle this long,
+# or when the last block that used it failed; one returned moments ago is handed out as is
+DB_VALIDATE_IDLE_SECONDS = float(os.environ.get("DB_VALIDATE_IDLE_SECONDS", 30))
+
+# Optional Heroku Postgres follower for read-only work (Home, search, exports, analytics). Either
+# its URL or the name of the config var holding it, e.g. HEROKU_POSTGRESQL_PINK_URL, which Heroku
+# keeps current when it rotates credentials. Unset, everything runs on DATABASE_URL.
+DATABASE_FOLLOWER_URL = os.environ.get("DATABASE_FOLLOWER_URL", "")
+DB_FOLLOWER_POOL_MAX = int(os.environ.get("DB_FOLLOWER_POOL_MAX", DB_POOL_MAX))
+# Reads go back to the primary while the follower is further behind than this many seconds
+DB_FOLLOWER_MAX_LAG = float(os.environ.get("DB_FOLLOWER_MAX_LAG", 5))
+DB_FOLLOWER_CHECK_INTERVAL = float(os.environ.get("DB_FOLLOWER_CHECK_INTERVAL", 1))
+# How often an unreachable follower (or primary) is tried again meanwhile
+DB_FOLLOWER_RETRY_INTERVAL = float(os.environ.get("DB_FOLLOWER_RETRY_INTERVAL", 10))
+
+
+# Name a statement for metrics by its leading /* comment */, e.g. "/* swarms.transition */ WITH ...",
+# falling back to its first keyword
+def _statement_name(query):
+    if isinstance(query, bytes):
+        query = query[:200].decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        query = str(query)[:200]
+    head = query.lstrip()
+    if head.startswith("/*"):
+        end = head.find("*/")
+        if end > 0:
+            return head[2:end].strip()
+    return head.split(None, 1)[0].lower() if head else "empty"
+
+
+# Cursor that records each statement's latency and row count
+class TimedCursor(base_cursor):
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self._record(query, started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._record(query, started)
+
+    def _record(self, query, started):
+        name = _statement_name(query)
+        listener = current_listener.get()
+        db_statement_seconds.observe(time.perf_counter() - started, name, listener)
+        if self.rowcount >= 0:
+            db_statement_rows.observe(self.rowcount, name, listener)
+
+
+def _is_healthy(conn):
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("/* db.health_check */ SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+# A pool of connections to one server. A pool must never be shared across a fork, so it is
+# (re)built lazily per process. psycopg2's pool fails at once when every connection is out, so
+# checkouts first wait their turn on a semaphore of the same size.
+class Database:
+    def __init__(self, name, url, max_size, **connect_kwargs):
+        self.name = name
+        self._url = url
+        self.max_size = max_size
+        self._connect_kwargs = connect_kwargs
+        self._pool = None
+        self._pool_pid = None
+        self._slots = None
+        # connection -> when it was last given back after a block that succeeded
+        self._returned = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return self._url()
+
+    def _get_pool(self):
+        if self._pool is not None and self._pool_pid == os.getpid():
+            return self._pool
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                try:
+                    self._pool = pool.ThreadedConnectionPool(
+                        DB_POOL_MIN, self.max_size, self.url, cursor_factory=TimedCursor, **self._connect_kwargs
+                    )
+                    self._slots = threading.BoundedSemaphore(self.max_size)
+                    self._returned = {}
+                    self._pool_pid = os.getpid()
+                except Exception as e:
+                    logging.error(f"Error connecting to the {self.name} database: {e}")
+                    raise
+        return self._pool
+
+    # Check out a connection, waiting up to DB_POOL_WAIT_SECONDS for one to be free. Raises
+    # pool.PoolError if none is, which only connection() gives back.
+    def checkout(self):
+        db_pool = self._get_pool()
+        slots = self._slots
+        if not slots.acquire(timeout=DB_POOL_WAIT_SECONDS):
+            raise pool.PoolError(f"No {self.name} database connection free after {DB_POOL_WAIT_SECONDS} seconds")
+        try:
+            # Every idle connection may have been killed by a failover, so keep discarding
+            # broken ones until we get a live connection or the pool opens a fresh one
+            for _ in range(self.max_size + 1):
+                conn = db_pool.getconn()
+                returned_at = self._returned.pop(conn, None)
+                if not conn.closed and returned_at is not None \
+                        and time.monotonic() - returned_at < DB_VALIDATE_IDLE_SECONDS:
+                    return conn
+                if _is_healthy(conn):
+                    return conn
+                logging.warning(f"Discarding broken {self.name} database connection from pool")
+                db_pool.putconn(conn, close=True)
+            raise psycopg2.OperationalError(f"Could not obtain a healthy {self.name} database connection")
+        except Exception:
+            slots.release()
+            raise
+
+    # Hold a checked out connection (or a new one) for a `with` block.
+    # Commits on success, rolls back on error, and always returns the connection.
+    @contextmanager
+    def connection(self, conn=None):
+        conn = conn or self.checkout()
+        db_pool, slots, returned = self._pool, self._slots, self._returned
+        try:
+            yield conn
+            conn.commit()
+            returned[conn] = time.monotonic()
+        except Exception:
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+            raise
+        finally:
+            db_pool.putconn(conn, close=bool(conn.closed))
+            # The pool closes connections beyond DB_POOL_MIN as they come back
+            if conn.closed:
+                returned.pop(conn, None)
+            slots.release()
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.closeall()
+            self._pool = None
+            self._slots = None
+            self._returned = {}
+
+
+def _follower_url():
+    if DATABASE_FOLLOWER_URL and "://" not in DATABASE_FOLLOWER_URL:
+        return os.environ.get(DATABASE_FOLLOWER_URL) or None
+    return DATABASE_FOLLOWER_URL or None
+
+
+primary = Database("primary", lambda: os.environ.get("DATABASE_URL"), DB_POOL_MAX)
+# Read-only sessions, so a follower URL pointed at a primary by mistake still can't be written to
+follower = Database("follower", _follower_url, DB_FOLLOWER_POOL_MAX, options="-c default_transaction_read_only=on")
+
+
+# Borrow a primary connection for the duration of a `with` block
+def get_db_connection():
+    return primary.connection()
+
+
+# Decides whether a read can go to the follower. Every DB_FOLLOWER_CHECK_INTERVAL seconds it
+# samples the primary's WAL position and then asks the follower how far it has replayed: once
+# the follower is past a sample, it holds every transaction committed before that sample was
+# taken, so it is fresh as of then. A user who committed a write after that (see note_writes())
+# reads from the primary until the follower catches up.
+class FollowerMonitor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=3600)
+        self._fresh_as_of = None
+        self._available = False
+        self._recent_writes = OrderedDict()
+        self._pid = None
+        self._counters = dict.fromkeys(("follower", "lagging", "recent_write", "unavailable"), 0)
+
+    def enabled(self):
+        return follower.url is not None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Samples and writes seen by the parent say nothing about this process's connections
+            self._samples.clear()
+            self._fresh_as_of = None
+            self._available = False
+            self._recent_writes.clear()
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name="db-follower-monitor", daemon=True).start()
+
+    def _run(self):
+        current_listener.set("db_follower_monitor")
+        while True:
+            try:
+                self.check()
+                time.sleep(DB_FOLLOWER_CHECK_INTERVAL)
+            except Exception as e:
+                self.mark_unavailable(e)
+                time.sleep(max(DB_FOLLOWER_CHECK_INTERVAL, DB_FOLLOWER_RETRY_INTERVAL))
+
+    def check(self):
+        sampled_at = time.monotonic()
+        with primary.connection() as conn, conn.cursor() as cur:
+            cur.execute("/* db.primary_wal_position */ SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), '0/0')::bigint")
+            position = cur.fetchone()[0]
+        with self._lock:
+            self._samples.append((sampled_at, position))
+
+        # A follower that was promoted (or is really a primary) has everything it will ever get
+        with follower.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                /* db.follower_replay_position */
+                SELECT pg_wal_lsn_diff(CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn()
+                                            ELSE pg_current_wal_lsn() END, '0/0')::bigint
+            """)
+            replayed = cur.fetchone()[0]
+        with self._lock:
+            if not self._available:
+                logging.info("Database follower is available, routing reads to it")
+            self._available = True
+            while replayed is not None and self._samples and self._samples[0][1] <= replayed:
+                self._fresh_as_of = self._samples.popleft()[0]
+            # Writes older than the allowed lag no longer decide anything
+            horizon = max(self._fresh_as_of or 0, time.monotonic() - DB_FOLLOWER_MAX_LAG)
+            while self._recent_writes and next(iter(self._recent_writes.values())) < horizon:
+                self._recent_writes.popitem(last=False)
+
+    def mark_unavailable(self, error):
+        with self._lock:
+            if self._available:
+                logging.error(f"Database follower unavailable, reading from the primary: {error}")
+            self._available = False
+
+    # Writes by these users have just been committed
+    def note_writes(self, user_ids):
+        if not self.enabled():
+            return
+        now = time.monotonic()
+        with self._lock:
+            for user_id in user_ids:
+                if user_id:
+                    self._recent_writes[user_id] = now
+                    self._recent_writes.move_to_end(user_id)
+
+    # Whether a read for user_id (None when it reads nobody's own writes) may use the follower
+    def use_follower(self, user_id=None):
+        if not self.enabled():
+            return False
+        self._ensure_started()
+        with self._lock:
+            if not self._available or self._fresh_as_of is None:
+                reason = "unavailable"
+            elif time.monotonic() - self._fresh_as_of > DB_FOLLOWER_MAX_LAG:
+                reason = "lagging"
+            elif user_id is not None and self._recent_writes.get(user_id, 0) >= self._fresh_as_of:
+                reason = "recent_write"
+            else:
+                reason = "follower"
+            self._counters[reason] += 1
+        return reason == "follower"
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+follower_monitor = FollowerMonitor()
+
+
+def note_writes(user_ids):
+    follower_monitor.note_writes(user_ids)
+
+
+# Borrow a connection for read-only work: a follower connection when the follower is up, less
+# than DB_FOLLOWER_MAX_LAG behind and has user_id's latest write, otherwise a primary one
+def get_read_connection(user_id=None):
+    if follower_monitor.use_follower(user_id):
+        try:
+            return follower.connection(follower.checkout())
+        except psycopg2.OperationalError as e:
+            follower_monitor.mark_unavailable(e)
+        except pool.PoolError as e:
+            # Busy rather than down; this read goes to the primary, later ones still try the follower
+            logging.warning(f"Reading from the primary: {e}")
+    return primary.connection()
+
+
+def close_pool():
+    primary.close()
+    follower.close()
+
+
+@registry.collector
+def _read_routing_counters():
+    return [("swarm_db_reads_total", "Read-only connections by where they went: follower, or primary and why",
+             ("target",), {(target,): count for target, count in follower_monitor.counters().items()})]
@@ -0,0 +1,186 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from psycopg2.extras import execute_values
+from slack_bolt import BoltResponse
+
+from db import get_db_connection
+from metrics import registry
+from workers import run_blocking
+
+
+# How long a delivery is remembered; Slack gives up retrying well within this
+DEDUP_TTL = int(os.environ.get("DEDUP_TTL", 600))
+# Clicks on the same button of the same message within this many seconds count as one
+DEDUP_CLICK_WINDOW = float(os.environ.get("DEDUP_CLICK_WINDOW", 2))
+DEDUP_MAX_SIZE = int(os.environ.get("DEDUP_MAX_SIZE", 50000))
+# "memory" only remembers deliveries seen by this process; "postgres" also shares them through
+# the slack_deliveries table, for when retries can land on another worker or dyno
+DEDUP_BACKEND = os.environ.get("DEDUP_BACKEND", "memory")
+DEDUP_PURGE_INTERVAL = int(os.environ.get("DEDUP_PURGE_INTERVAL", 60))
+
+_CLAIM_SQL = """
+    /* dedup.claim */
+    INSERT INTO slack_deliveries (key, expires_at)
+    VALUES %s
+    ON CONFLICT (key) DO UPDATE SET expires_at = EXCLUDED.expires_at
+    WHERE slack_deliveries.expires_at < NOW()
+    RETURNING key
+"""
+
+
+# Idempotency keys for a request body, each with how long it stays claimed.
+# Submissions are keyed on the view's id and hash, button clicks on (action_ts, message_ts) for
+# Slack's retries plus the message (or Home view) and button for double-clicks, and events on
+# event_id (message events excepted). Selects get no click window, since picking two options in
+# quick succession is intended.
+def delivery_keys(body):
+    kind = body.get("type")
+    if kind == "view_submission":
+        view = body["view"]
+        return [(f"view:{view['id']}:{view.get('hash', '')}", DEDUP_TTL)]
+    if kind == "block_actions" and body.get("actions"):
+        action = body["actions"][0]
+        container = body.get("container") or {}
+        message_ts = container.get("message_ts") or (body.get("message") or {}).get("ts", "")
+        channel_id = container.get("channel_id") or (body.get("channel") or {}).get("id", "")
+        # Clicks in a view (the Home tab) have no message; the view is per user
+        target = message_ts or container.get("view_id", "")
+        keys = [(f"action:{action.get('action_ts', '')}:{target}", DEDUP_TTL)]
+        if action.get("type", "button") == "button":
+            keys.append((f"click:{action['action_id']}:{channel_id}:{target}", DEDUP_CLICK_WINDOW))
+        return keys
+    if kind == "event_callback" and body.get("event_id"):
+        # Every message in the app's channels is an event; replies are stored once per reply ts
+        # anyway, and the rest must not cost a claim
+        if body.get("event", {}).get("type") == "message":
+            return []
+        return [(f"event:{body['event_id']}", DEDUP_TTL)]
+    return []
+
+
+# Remembers which Slack deliveries have been handled so retries and double-submits are dropped.
+# Keys live in a bounded LRU with per-key expiry; with the postgres backend a key is only
+# claimed once the slack_deliveries table agrees nobody else has it. If Postgres is unreachable
+# the local answer stands, since handling a duplicate beats dropping a first delivery.
+class DeliveryDeduplicator:
+    def __init__(self, max_size=DEDUP_MAX_SIZE, backend=DEDUP_BACKEND):
+        self.max_size = max_size
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._purged_at = time.monotonic()
+        self._duplicates = {}
+
+    # Claim every key; returns False if any of them was already claimed and unexpired
+    def claim(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            for key, _ in keys:
+                expires_at = self._entries.get(key)
+                if expires_at is not None and expires_at > now:
+                    return False
+            for key, ttl in keys:
+                self._entries[key] = now + ttl
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        if self.backend == "postgres":
+            return self._claim_shared(keys)
+        return True
+
+    # Forget claimed keys, so the same delivery is handled again (e.g. a submission answered with
+    # errors or an updated view, which Slack may resubmit under the same view id and hash)
+    def release(self, keys):
+        with self._lock:
+            for key, _ in keys:
+                self._entries.pop(key, None)
+        if self.backend != "postgres":
+            return
+        try:
+            with get_db_connection() as conn, conn.cursor() as cur:
+                cur.execute("/* dedup.release */ DELETE FROM slack_deliveries WHERE key = ANY(%s)",
+                            ([key for key, _ in keys],))
+        except Exception as e:
+            logging.error(f"Error releasing Slack delivery in database: {e}")
+
+    def _claim_shared(self, keys):
+        try:
+            with get_db_connection() as conn, conn.cursor() as cur:
+                claimed = execute_values(
+                    cur,
+                    _CLAIM_SQL,
+                    [(key, ttl) for key, ttl in keys],
+                    template="(%s, NOW() + %s * INTERVAL '1 second')",
+                    fetch=True,
+                )
+                if time.monotonic() - self._purged_at > DEDUP_PURGE_INTERVAL:
+                    self._purged_at = time.monotonic()
+                    cur.execute("/* dedup.purge */ DELETE FROM slack_deliveries WHERE expires_at < NOW()")
+        except Exception as e:
+            logging.error(f"Error checking Slack delivery in database: {e}")
+            return True
+        return len(claimed) == len(keys)
+
+    def count_duplicate(self, kind):
+        with self._lock:
+            self._duplicates[kind] = self._duplicates.get(kind, 0) + 1
+
+    def duplicates(self):
+        with self._lock:
+            return dict(self._duplicates)
+
+
+deduplicator = DeliveryDeduplicator()
+
+
+# Bolt global middleware: ack duplicates with an empty 200 before any listener sees them
+def skip_duplicates(body, next):
+    keys = delivery_keys(body)
+    if not keys or deduplicator.claim(keys):
+        return next()
+    deduplicator.count_duplicate(body.get("type", "unknown"))
+    logging.info(f"Skipping duplicate Slack delivery {keys[0][0]}")
+    return BoltResponse(status=200, body="")
+
+
+# skip_duplicates() for AsyncApp; a claim that has to ask Postgres runs on the blocking pool
+async def skip_duplicates_async(body, next):
+    keys = delivery_keys(body)
+    if not keys:
+        return await next()
+    if deduplicator.backend == "postgres":
+        claimed = await run_blocking(deduplicator.claim, keys)
+    else:
+        claimed = deduplicator.claim(keys)
+    if claimed:
+        return await next()
+    deduplicator.count_duplicate(body.get("type", "unknown"))
+    logging.info(f"Skipping duplicate Slack delivery {keys[0][0]}")
+    return BoltResponse(status=200, body="")
+
+
+# Called by a listener that sends a submission back to the user, before the ack, so the next one is let through
+def release_delivery(body):
+    keys = delivery_keys(body)
+    if keys:
+        deduplicator.release(keys)
+
+
+async def release_delivery_async(body):
+    keys = delivery_keys(body)
+    if not keys:
+        return
+    if deduplicator.backend == "postgres":
+        await run_blocking(deduplicator.release, keys)
+    else:
+        deduplicator.release(keys)
+
+
+@registry.collector
+def _duplicate_counters():
+    return [("swarm_duplicate_deliveries_total", "Slack retries and double-submits that were acked and skipped",
+             ("type",), {(kind,): count for kind, count in deduplicator.duplicates().items()})]
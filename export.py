@@ -0,0 +1,217 @@
+import io
+import os
+import csv
+import sys
+import gzip
+import json
+import shlex
+import logging
+import argparse
+import tempfile
+from datetime import date
+from urllib.request import Request, urlopen
+
+from db import get_read_connection
+from installations import client_for
+from search import FILTERS
+from slack_dispatch import slack
+from swarms import SWARM_COLUMNS, list_skill_groups
+
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_ITERSIZE = int(os.environ.get("EXPORT_ITERSIZE", 2000))
+EXPORT_UPLOAD_TIMEOUT = int(os.environ.get("EXPORT_UPLOAD_TIMEOUT", 300))
+FORMATS = ("csv", "ndjson")
+
+
+class ExportError(ValueError):
+    pass
+
+
+# Dates are inclusive; the range filter uses created_at so it can't be moved by later updates
+_EXPORT_SQL = f"""
+    /* export.swarms */
+    SELECT {", ".join(SWARM_COLUMNS)}
+    FROM swarm_requests
+    WHERE (%(since)s::date IS NULL OR created_at >= %(since)s::date)
+      AND (%(until)s::date IS NULL OR created_at < %(until)s::date + 1)
+      AND (%(skill_group)s::text IS NULL OR skill_group = %(skill_group)s)
+      AND (%(priority)s::text IS NULL OR priority = %(priority)s)
+      AND (%(status)s::text IS NULL OR status = %(status)s)
+    ORDER BY id
+"""
+
+
+class ExportRequest:
+    def __init__(self, since=None, until=None, filters=None, format="csv"):
+        self.since = since
+        self.until = until
+        self.filters = filters or {}
+        self.format = format
+
+    @property
+    def filename(self):
+        parts = ["swarm-requests", str(self.since or "start"), str(self.until or date.today())]
+        parts += [value.replace("/", "-").replace(" ", "-").lower() for value in self.filters.values()]
+        return "_".join(parts) + f".{self.format}.gz"
+
+    def describe(self):
+        described = [f"from {self.since or 'the start'} to {self.until or 'today'}"]
+        described += [f"{column} {value}" for column, value in self.filters.items()]
+        return ", ".join(described)
+
+
+# The values a filter keyword accepts; some filters (skill groups) look theirs up when asked
+def _allowed(keyword):
+    allowed = FILTERS[keyword][1]
+    return allowed() if callable(allowed) else allowed
+
+
+# Parse /swarmexport text such as `from:2024-01-01 to:2024-03-31 skill:Data status:resolved format:ndjson`
+def parse_export(text):
+    export = ExportRequest()
+    try:
+        words = shlex.split(text or "")
+    except ValueError:
+        words = (text or "").split()
+    for word in words:
+        keyword, _, value = word.partition(":")
+        keyword = keyword.lower()
+        if keyword in ("from", "to"):
+            try:
+                day = date.fromisoformat(value)
+            except ValueError:
+                raise ExportError(f"`{word}` is not a date, use YYYY-MM-DD")
+            if keyword == "from":
+                export.since = day
+            else:
+                export.until = day
+        elif keyword == "format" and value.lower() in FORMATS:
+            export.format = value.lower()
+        elif keyword in FILTERS:
+            column, allowed = FILTERS[keyword][0], _allowed(keyword)
+            match = next((option for option in allowed if option.lower() == value.lower()), None)
+            if match is None:
+                raise ExportError(f"Unknown {keyword} `{value}`. Try one of: {', '.join(allowed)}")
+            export.filters[column] = match
+        else:
+            raise ExportError(f"Don't know what to do with `{word}`")
+    return export
+
+
+# Yield matching swarms as dicts through a named (server-side) cursor, EXPORT_ITERSIZE rows
+# at a time, so the whole result set never sits in memory. Reads from the follower when there is
+# one, which includes user_id's own latest changes.
+def stream_rows(export, user_id=None):
+    params = {
+        "since": export.since,
+        "until": export.until,
+        "skill_group": export.filters.get("skill_group"),
+        "priority": export.filters.get("priority"),
+        "status": export.filters.get("status"),
+    }
+    with get_read_connection(user_id) as conn:
+        with conn.cursor(name="swarm_export") as cur:
+            cur.itersize = EXPORT_ITERSIZE
+            cur.execute(_EXPORT_SQL, params)
+            for row in cur:
+                yield dict(zip(SWARM_COLUMNS, row))
+
+
+# Encode rows into fileobj as gzipped CSV or NDJSON as they arrive; returns the row count
+def write_export(fileobj, rows, format):
+    count = 0
+    with gzip.GzipFile(fileobj=fileobj, mode="wb") as compressed, \
+            io.TextIOWrapper(compressed, encoding="utf-8", newline="") as out:
+        if format == "csv":
+            writer = csv.writer(out)
+            writer.writerow(SWARM_COLUMNS)
+            for row in rows:
+                # participants is a list; CSV gets the user ids space-separated
+                writer.writerow([" ".join(value) if isinstance(value, list) else value
+                                 for value in (row[column] for column in SWARM_COLUMNS)])
+                count += 1
+        else:
+            for row in rows:
+                out.write(json.dumps(row, default=str) + "\n")
+                count += 1
+    return count
+
+
+# Upload an already written file through the files_upload_v2 flow (getUploadURLExternal, POST,
+# completeUploadExternal). files_upload_v2 itself reads the whole file into memory first, so the
+# body is streamed from disk here instead.
+def upload_file(client, fileobj, filename, channel_id, title, initial_comment):
+    length = fileobj.seek(0, os.SEEK_END)
+    fileobj.seek(0)
+    upload = slack.call(client, "files_getUploadURLExternal", filename=filename, length=length)
+    request = Request(
+        upload["upload_url"],
+        data=fileobj,
+        method="POST",
+        headers={"Content-Length": str(length), "Content-Type": "application/octet-stream"},
+    )
+    with urlopen(request, timeout=EXPORT_UPLOAD_TIMEOUT) as response:
+        response.read()
+    slack.call(
+        client,
+        "files_completeUploadExternal",
+        files=[{"id": upload["file_id"], "title": title}],
+        channel_id=channel_id,
+        initial_comment=initial_comment,
+    )
+
+
+# Stream the export to a temporary file and upload it to channel_id; returns the row count.
+# The file on disk is the only thing that grows with the number of rows.
+def export_to_slack(client, export, channel_id, user_id=None):
+    with tempfile.TemporaryFile() as spool:
+        count = write_export(spool, stream_rows(export, user_id), export.format)
+        upload_file(
+            client,
+            spool,
+            export.filename,
+            channel_id,
+            title=f"Swarm requests {export.describe()}",
+            initial_comment=f"<@{user_id}> here is your export of {count} swarm requests ({export.describe()})."
+            if user_id else None,
+        )
+    return count
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Export swarm_requests as gzipped CSV or NDJSON")
+    parser.add_argument("--from", dest="since", type=date.fromisoformat)
+    parser.add_argument("--to", dest="until", type=date.fromisoformat)
+    # Checked against the skill_groups table once the arguments are parsed
+    parser.add_argument("--skill-group")
+    parser.add_argument("--priority", choices=_allowed("priority"))
+    parser.add_argument("--status", choices=_allowed("status"))
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--output", help="file to write, default stdout")
+    parser.add_argument("--channel", help="upload to this Slack channel instead")
+    parser.add_argument("--team", help="workspace of --channel when the app is installed over OAuth")
+    parser.add_argument("--enterprise", help="Enterprise Grid org of --team")
+    args = parser.parse_args()
+    if args.skill_group:
+        with get_read_connection() as conn, conn.cursor() as cur:
+            skill_groups = list_skill_groups(cur) or _allowed("skill")
+        match = next((name for name in skill_groups if name.lower() == args.skill_group.lower()), None)
+        if match is None:
+            parser.error(f"argument --skill-group: invalid choice: {args.skill_group!r} (choose from {', '.join(skill_groups)})")
+        args.skill_group = match
+
+    filters = {column: getattr(args, column) for column in ("skill_group", "priority", "status") if getattr(args, column)}
+    export = ExportRequest(args.since, args.until, filters, args.format)
+    if args.channel:
+        client = client_for(args.enterprise, args.team)
+        if client is None:
+            sys.exit(f"The app is not installed in workspace {args.team}")
+        count = export_to_slack(client, export, args.channel)
+    elif args.output:
+        with open(args.output, "wb") as output:
+            count = write_export(output, stream_rows(export), export.format)
+    else:
+        count = write_export(sys.stdout.buffer, stream_rows(export), export.format)
+    logging.info(f"Exported {count} swarm requests ({export.describe()})")
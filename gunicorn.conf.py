@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+
+# Workers share their metrics through this directory; set before metrics is first imported
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), f"swarm-metrics-{os.getpid()}"))
+
+# The app's modules (and with them slack_bolt, slack_sdk and psycopg2) are only imported inside
+# the hooks below: the master reads this file before it binds the port, and workers load the app
+# after forking, so nothing here delays the port opening.
+
+
+# Heroku assigns the port and sizes WEB_CONCURRENCY to the dyno type
+bind = f"0.0.0.0:{os.environ.get('PORT', 3000)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+worker_class = "gthread"
+
+# Heroku sends SIGTERM on dyno shutdown and SIGKILLs 30 seconds later,
+# so in-flight requests get slightly less than that to drain
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 25))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+keepalive = 5
+
+accesslog = "-"
+
+
+def on_starting(server):
+    # Start from empty metrics; files left by this server's own dead workers are kept so counters never go backwards
+    shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
+
+
+def post_fork(server, worker):
+    from readiness import FAST_STARTUP, start_token_verification
+
+    # Verify the bot token while the rest of the app is still being imported
+    if FAST_STARTUP and os.environ.get("SLACK_BOT_TOKEN") and not os.environ.get("SLACK_CLIENT_ID"):
+        start_token_verification()
+
+    from metrics import registry
+    from sweeper import start_sweeper
+
+    registry.start_sync()
+    start_sweeper()
+
+
+def worker_exit(server, worker):
+    from db import close_pool
+    from journal import journal
+    from metrics import registry
+
+    # Flush queued swarm events and release this worker's Postgres connections before it goes away
+    journal.close()
+    close_pool()
+    registry.write_snapshot()
@@ -0,0 +1,294 @@
+import os
+import json
+import time
+import hashlib
+import asyncio
+import threading
+from collections import OrderedDict
+
+from autocomplete import option_index
+from metrics import registry
+from rollups import format_duration, render_summary
+from search import permalink, permalink_async
+from slack_dispatch import slack
+from storage import get_db_connection, get_read_connection, note_writes, rollups, stats, swarms
+from user_directory import user_directory
+from workers import run_blocking
+
+
+HOME_PAGE_SIZE = int(os.environ.get("HOME_PAGE_SIZE", 5))
+# Rows a section may grow to through "Load more"; both sections full plus the rest of the view
+# stay under Slack's 100-block limit
+HOME_MAX_ROWS = int(os.environ.get("HOME_MAX_ROWS", 40))
+HOME_LEADERBOARD_SIZE = int(os.environ.get("HOME_LEADERBOARD_SIZE", 5))
+# Kept short because the cache is per process, see HomeCache
+HOME_CACHE_TTL = int(os.environ.get("HOME_CACHE_TTL", 60))
+HOME_CACHE_MAX_SIZE = int(os.environ.get("HOME_CACHE_MAX_SIZE", 10000))
+
+SECTIONS = {
+    "mine": "Your open swarm requests",
+    "skills": "Open in your skill groups",
+}
+
+
+# Hash of the view this process last published to each user, so reopening an unchanged Home
+# costs no views.publish. The rows are still read every time; only the publish is saved.
+# Each worker keeps its own cache and Slack shows whatever was published last, so after
+# another worker publishes a different view this one may keep skipping a view that is no
+# longer shown. HOME_CACHE_TTL bounds how long that Home can stay stale.
+class HomeCache:
+    def __init__(self, ttl=HOME_CACHE_TTL, max_size=HOME_CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(("published", "unchanged"), 0)
+
+    def unchanged(self, user_id, digest):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic() or entry[1] != digest:
+                return False
+            self._entries.move_to_end(user_id)
+            self._counters["unchanged"] += 1
+            return True
+
+    def remember(self, user_id, digest):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, digest)
+            self._entries.move_to_end(user_id)
+            self._counters["published"] += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+home_cache = HomeCache()
+
+
+def _filters(section, user_id, skill_groups):
+    if section == "mine":
+        return {"user_id": user_id}
+    return {"skill_groups": skill_groups, "exclude_user_id": user_id}
+
+
+# One section's rows and whether there are more. min_id is the oldest row already shown (None
+# for the first page); everything down to it is read again, so resolved swarms drop out.
+def _section_rows(cur, section, user_id, skill_groups, min_id=None):
+    if section == "skills" and not skill_groups:
+        return [], False
+    filters = _filters(section, user_id, skill_groups)
+    if min_id is None:
+        rows = swarms.list_open(cur, limit=HOME_PAGE_SIZE + 1, **filters)
+        return rows[:HOME_PAGE_SIZE], len(rows) > HOME_PAGE_SIZE
+    rows = swarms.list_open(cur, min_id=min_id, limit=HOME_MAX_ROWS, **filters)
+    older = swarms.list_open(cur, before_id=min_id, limit=1, **filters)
+    return rows, bool(older) and len(rows) < HOME_MAX_ROWS
+
+
+def _mrkdwn(text):
+    return {"type": "mrkdwn", "text": text}
+
+
+def _escape(text):
+    return (text or "").replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _swarm_row(section, swarm, link):
+    title = f"Ticket {_escape(swarm['ticket'])}"
+    if link:
+        title = f"<{link}|{title}>"
+    # Slack formats the date in the viewer's timezone, and the text (and hash) stays the same
+    opened = f"<!date^{int(swarm['created_at'].timestamp())}^{{date_short_pretty}} {{time}}|{swarm['created_at']:%Y-%m-%d %H:%M} UTC>"
+    requester = f" · by <@{swarm['user_id']}>" if section == "skills" else ""
+    if swarm["first_response_at"]:
+        waited = format_duration(max(0, (swarm["first_response_at"] - swarm["created_at"]).total_seconds()))
+        helpers = len(swarm["participants"])
+        activity = (f"first response after {waited} · {swarm['reply_count']} repl{'ies' if swarm['reply_count'] != 1 else 'y'}"
+                    f" from {helpers} helper{'s' if helpers != 1 else ''}")
+    else:
+        activity = "no response yet"
+    description = _escape(swarm["issue_description"])
+    if len(description) > 150:
+        description = description[:150].rstrip() + "…"
+    return {
+        "type": "section",
+        "text": _mrkdwn(f"*{title}* · {swarm['priority']} · {swarm['skill_group']}{requester} · opened {opened}\n"
+                        f"_{activity}_\n{description}")
+    }
+
+
+def _section_blocks(section, rows, has_more, skill_groups, links):
+    blocks = [{"type": "section", "block_id": f"home_{section}", "text": _mrkdwn(f"*{SECTIONS[section]}*")}]
+    if not rows:
+        empty = "Nothing open right now."
+        if section == "skills" and not skill_groups:
+            empty = "Follow some skill groups above to see their open swarm requests here."
+        blocks.append({"type": "context", "elements": [_mrkdwn(empty)]})
+    blocks.extend(_swarm_row(section, swarm, links.get(swarm["id"])) for swarm in rows)
+    if has_more:
+        blocks.append({
+            "type": "actions",
+            "block_id": f"home_more_{section}",
+            "elements": [{
+                "type": "button",
+                "text": {"type": "plain_text", "text": "Load more"},
+                "action_id": "home_load_more",
+                "value": json.dumps({"s": section, "after": rows[-1]["id"]}),
+            }]
+        })
+    return blocks
+
+
+def _options(values):
+    return [{"text": {"type": "plain_text", "text": value}, "value": value} for value in values]
+
+
+# The Home view from load_home()'s data, the swarms' permalinks by id and the leaders' names
+def render_home(user_id, home, links, names):
+    skill_groups, sections = home["skill_groups"], home["sections"]
+    totals, mine, leaders = home["totals"], home["mine"], home["leaders"]
+    configured = option_index.skill_groups()
+    follow = {
+        "type": "multi_static_select",
+        "action_id": "home_skill_groups",
+        "placeholder": {"type": "plain_text", "text": "Follow skill groups"},
+        "options": _options(configured),
+    }
+    # A followed group that has since been deactivated can't be preselected
+    initial = [skill_group for skill_group in skill_groups if skill_group in configured]
+    if initial:
+        follow["initial_options"] = _options(initial)
+
+    blocks = [
+        {
+            "type": "section",
+            "block_id": "home_summary",
+            "text": _mrkdwn(
+                f"*Your swarm requests:* {mine['open']} open · {mine['resolved']} resolved · {mine['discarded']} discarded\n"
+                f"*Everyone's:* {totals['open']} open · {totals['resolved']} resolved · {totals['discarded']} discarded"
+            )
+        },
+        {"type": "actions", "block_id": "home_preferences", "elements": [follow]},
+    ]
+    for section, (rows, has_more) in sections.items():
+        blocks.append({"type": "divider"})
+        blocks.extend(_section_blocks(section, rows, has_more, skill_groups, links))
+
+    blocks.append({"type": "divider"})
+    leaderboard = "\n".join(
+        f"{rank}. {_escape(names.get(leader)) or f'<@{leader}>'} · {count}" for rank, (leader, count) in enumerate(leaders, 1)
+    )
+    blocks.append({
+        "type": "section",
+        "block_id": "home_leaderboard",
+        "text": _mrkdwn(f"*Most resolved swarm requests*\n{leaderboard or 'None resolved yet.'}")
+    })
+    blocks.append({"type": "divider"})
+    blocks.extend(render_summary(home["summary"], "Resolution time"))
+    return {"type": "home", "private_metadata": json.dumps(home["state"]), "blocks": blocks}
+
+
+# Everything the viewer's Home shows from the database. state maps each section to the oldest row
+# id shown (absent for the first page).
+def load_home(user_id, state=None):
+    state = {section: min_id for section, min_id in (state or {}).items() if section in SECTIONS and min_id}
+    with get_read_connection(user_id) as conn, conn.cursor() as cur:
+        skill_groups = swarms.followed_skill_groups(cur, user_id)
+        sections = {
+            section: _section_rows(cur, section, user_id, skill_groups, state.get(section)) for section in SECTIONS
+        }
+        totals, mine, leaders = stats.fetch_leaderboard(cur, user_id, HOME_LEADERBOARD_SIZE)
+        summary = rollups.summarize(cur)
+    return {"state": state, "skill_groups": skill_groups, "sections": sections,
+            "totals": totals, "mine": mine, "leaders": leaders, "summary": summary}
+
+
+def _shown_swarms(home):
+    return [swarm for rows, _ in home["sections"].values() for swarm in rows if swarm["message_ts"]]
+
+
+# One after another: only the first can wait for auth.test, the rest are built from its URL
+async def _links_async(client, shown):
+    return {swarm["id"]: await permalink_async(client, swarm["channel_id"], swarm["message_ts"]) for swarm in shown}
+
+
+def _digest(view):
+    return hashlib.sha1(json.dumps(view, sort_keys=True).encode()).hexdigest()
+
+
+# Render the viewer's Home and publish it unless it is identical to what they were last shown.
+# Returns whether views.publish was called.
+def publish_home(client, user_id, state=None):
+    home = load_home(user_id, state)
+    links = {swarm["id"]: permalink(client, swarm["channel_id"], swarm["message_ts"]) for swarm in _shown_swarms(home)}
+    names = user_directory.real_names(client, [leader for leader, _ in home["leaders"]])
+    view = render_home(user_id, home, links, names)
+    digest = _digest(view)
+    if home_cache.unchanged(user_id, digest):
+        return False
+    slack.views_publish(client, user_id=user_id, view=view)
+    home_cache.remember(user_id, digest)
+    return True
+
+
+# publish_home() for the asyncio runtime: the database is read on the blocking pool and the
+# permalinks and names are looked up concurrently
+async def publish_home_async(client, user_id, state=None):
+    home = await run_blocking(load_home, user_id, state)
+    names, links = await asyncio.gather(
+        user_directory.real_names_async(client, [leader for leader, _ in home["leaders"]]),
+        _links_async(client, _shown_swarms(home)),
+    )
+    view = render_home(user_id, home, links, names)
+    digest = _digest(view)
+    if home_cache.unchanged(user_id, digest):
+        return False
+    await slack.call_async(client, "views_publish", user_id=user_id, view=view)
+    home_cache.remember(user_id, digest)
+    return True
+
+
+# "Load more": extend a section by the page after its last shown row
+def _load_more_state(user_id, state, section, after):
+    with get_read_connection(user_id) as conn, conn.cursor() as cur:
+        skill_groups = swarms.followed_skill_groups(cur, user_id)
+        page = swarms.list_open(cur, before_id=after, limit=HOME_PAGE_SIZE, **_filters(section, user_id, skill_groups))
+    return dict(state, **{section: page[-1]["id"]}) if page else state
+
+
+def load_more(client, user_id, state, section, after):
+    if section in SECTIONS:
+        publish_home(client, user_id, _load_more_state(user_id, state, section, after))
+
+
+async def load_more_async(client, user_id, state, section, after):
+    if section in SECTIONS:
+        await publish_home_async(client, user_id, await run_blocking(_load_more_state, user_id, state, section, after))
+
+
+# Store the followed skill groups; returns the view state with the skills section back on its first page
+def _follow(user_id, state, skill_groups):
+    configured = option_index.skill_groups()
+    skill_groups = [skill_group for skill_group in skill_groups if skill_group in configured]
+    with get_db_connection() as conn, conn.cursor() as cur:
+        swarms.follow_skill_groups(cur, user_id, skill_groups)
+    note_writes([user_id])
+    return {section: min_id for section, min_id in state.items() if section != "skills"}
+
+
+def follow_skill_groups(client, user_id, state, skill_groups):
+    publish_home(client, user_id, _follow(user_id, state, skill_groups))
+
+
+async def follow_skill_groups_async(client, user_id, state, skill_groups):
+    await publish_home_async(client, user_id, await run_blocking(_follow, user_id, state, skill_groups))
+
+
+@registry.collector
+def _home_counters():
+    return [("swarm_home_views_total", "Home tab renders that were published or skipped as unchanged",
+             ("result",), {(result,): count for result, count in home_cache.counters().items()})]
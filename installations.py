@@ -0,0 +1,294 @@
+import os
+import json
+import time
+import logging
+import threading
+from uuid import uuid4
+from collections import OrderedDict
+
+from slack_bolt.authorization import AuthorizeResult
+from slack_bolt.authorization.authorize import Authorize
+from slack_bolt.oauth.oauth_settings import OAuthSettings
+from slack_sdk.oauth.installation_store import Bot, Installation, InstallationStore
+from slack_sdk.oauth.state_store import OAuthStateStore
+
+from db import get_db_connection
+from metrics import registry
+from slack_dispatch import slack
+
+
+# Setting SLACK_CLIENT_ID (with SLACK_CLIENT_SECRET) switches the app from the single
+# SLACK_BOT_TOKEN to OAuth installs into any number of workspaces
+SLACK_CLIENT_ID = os.environ.get("SLACK_CLIENT_ID")
+SLACK_CLIENT_SECRET = os.environ.get("SLACK_CLIENT_SECRET")
+# channels:history and groups:history deliver the message events that swarm thread replies are
+# recorded from (see thread_activity.py), in public and private channels
+SLACK_SCOPES = os.environ.get(
+    "SLACK_SCOPES", "commands,chat:write,pins:write,users:read,files:write,channels:history,groups:history"
+).split(",")
+OAUTH_ENABLED = bool(SLACK_CLIENT_ID)
+OAUTH_STATE_TTL = int(os.environ.get("OAUTH_STATE_TTL", 600))
+# How long a workspace's bot token is served from memory. Revocations seen by this process
+# apply at once; other workers and dynos pick them up within this window.
+AUTHORIZE_CACHE_TTL = int(os.environ.get("AUTHORIZE_CACHE_TTL", 300))
+AUTHORIZE_CACHE_MAX_SIZE = int(os.environ.get("AUTHORIZE_CACHE_MAX_SIZE", 10000))
+
+
+def _key(enterprise_id, team_id, is_enterprise_install=False):
+    # Org-wide installs are stored and looked up without a team
+    return enterprise_id or "", "" if is_enterprise_install else team_id or ""
+
+
+# InstallationStore over Postgres, so every worker and dyno sees an install as soon as the OAuth
+# callback stores it. Installations are kept per installing user, the bot per workspace; both as
+# the JSON slack_sdk's own stores use.
+class PostgresInstallationStore(InstallationStore):
+    def __init__(self, client_id=SLACK_CLIENT_ID):
+        self.client_id = client_id
+
+    @property
+    def logger(self):
+        return logging.getLogger(__name__)
+
+    def save(self, installation):
+        enterprise_id, team_id = _key(installation.enterprise_id, installation.team_id,
+                                      installation.is_enterprise_install)
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                """
+                /* installations.save */
+                INSERT INTO slack_installations (client_id, enterprise_id, team_id, user_id, data)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (client_id, enterprise_id, team_id, user_id) DO UPDATE
+                SET data = EXCLUDED.data, installed_at = NOW()
+                """,
+                (self.client_id, enterprise_id, team_id, installation.user_id, json.dumps(installation.__dict__))
+            )
+        if installation.bot_token is not None:
+            self.save_bot(installation.to_bot())
+
+    def save_bot(self, bot):
+        enterprise_id, team_id = _key(bot.enterprise_id, bot.team_id, bot.is_enterprise_install)
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                """
+                /* installations.save_bot */
+                INSERT INTO slack_bots (client_id, enterprise_id, team_id, data)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (client_id, enterprise_id, team_id) DO UPDATE
+                SET data = EXCLUDED.data, installed_at = NOW()
+                """,
+                (self.client_id, enterprise_id, team_id, json.dumps(bot.__dict__))
+            )
+        authorization_cache.invalidate(enterprise_id, team_id)
+
+    def find_bot(self, *, enterprise_id, team_id, is_enterprise_install=False):
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "/* installations.find_bot */ SELECT data FROM slack_bots "
+                "WHERE client_id = %s AND enterprise_id = %s AND team_id = %s",
+                (self.client_id,) + _key(enterprise_id, team_id, is_enterprise_install)
+            )
+            row = cur.fetchone()
+        return Bot(**row[0]) if row else None
+
+    # The given user's installation, or the latest one in the workspace. Either way the bot
+    # fields come from the latest bot install, which a later user-only install doesn't carry.
+    def find_installation(self, *, enterprise_id, team_id, user_id=None, is_enterprise_install=False):
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                """
+                /* installations.find_installation */
+                SELECT data FROM slack_installations
+                WHERE client_id = %s AND enterprise_id = %s AND team_id = %s
+                  AND (%s::text IS NULL OR user_id = %s)
+                ORDER BY installed_at DESC
+                LIMIT 1
+                """,
+                (self.client_id,) + _key(enterprise_id, team_id, is_enterprise_install) + (user_id, user_id)
+            )
+            row = cur.fetchone()
+        if row is None:
+            return None
+        installation = Installation(**row[0])
+        bot = self.find_bot(enterprise_id=enterprise_id, team_id=team_id, is_enterprise_install=is_enterprise_install)
+        if bot is not None:
+            installation.bot_id = bot.bot_id
+            installation.bot_user_id = bot.bot_user_id
+            installation.bot_token = bot.bot_token
+            installation.bot_scopes = bot.bot_scopes
+            installation.bot_refresh_token = bot.bot_refresh_token
+            installation.bot_token_expires_at = bot.bot_token_expires_at
+        return installation
+
+    # The revocation listeners in app.py pass is_enterprise_install from the event, so an
+    # org-wide install is deleted under the key it was saved with
+    def delete_bot(self, *, enterprise_id, team_id, is_enterprise_install=False):
+        key = _key(enterprise_id, team_id, is_enterprise_install)
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "/* installations.delete_bot */ DELETE FROM slack_bots "
+                "WHERE client_id = %s AND enterprise_id = %s AND team_id = %s",
+                (self.client_id,) + key
+            )
+        authorization_cache.invalidate(*key)
+
+    def delete_installation(self, *, enterprise_id, team_id, user_id=None, is_enterprise_install=False):
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                """
+                /* installations.delete_installation */
+                DELETE FROM slack_installations
+                WHERE client_id = %s AND enterprise_id = %s AND team_id = %s
+                  AND (%s::text IS NULL OR user_id = %s)
+                """,
+                (self.client_id,) + _key(enterprise_id, team_id, is_enterprise_install) + (user_id, user_id)
+            )
+
+    def delete_all(self, *, enterprise_id, team_id, is_enterprise_install=False):
+        self.delete_bot(enterprise_id=enterprise_id, team_id=team_id, is_enterprise_install=is_enterprise_install)
+        self.delete_installation(enterprise_id=enterprise_id, team_id=team_id, is_enterprise_install=is_enterprise_install)
+
+
+# OAuth state parameters in Postgres, so the callback can land on any worker or dyno
+class PostgresOAuthStateStore(OAuthStateStore):
+    def __init__(self, expiration_seconds=OAUTH_STATE_TTL):
+        self.expiration_seconds = expiration_seconds
+
+    @property
+    def logger(self):
+        return logging.getLogger(__name__)
+
+    def issue(self, *args, **kwargs):
+        state = str(uuid4())
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "/* installations.issue_state */ INSERT INTO slack_oauth_states (state, expires_at) "
+                "VALUES (%s, NOW() + %s * INTERVAL '1 second')",
+                (state, self.expiration_seconds)
+            )
+            cur.execute("/* installations.purge_states */ DELETE FROM slack_oauth_states WHERE expires_at < NOW()")
+        return state
+
+    def consume(self, state):
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "/* installations.consume_state */ DELETE FROM slack_oauth_states "
+                "WHERE state = %s AND expires_at >= NOW() RETURNING state",
+                (state,)
+            )
+            return cur.fetchone() is not None
+
+
+# Per-workspace authorizations held in memory for AUTHORIZE_CACHE_TTL seconds, keyed by
+# (enterprise_id, team_id). Workspaces without an install are not cached, so a fresh install
+# works on the next request.
+class AuthorizationCache:
+    def __init__(self, ttl=AUTHORIZE_CACHE_TTL, max_size=AUTHORIZE_CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(("hit", "miss", "invalidated"), 0)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self._counters["miss"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hit"] += 1
+            return entry[1]
+
+    def put(self, key, result, expires_at=None):
+        ttl = self.ttl
+        if expires_at is not None:
+            # Never hand out a token past its expiry
+            ttl = min(ttl, max(0, expires_at - time.time()))
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    # Drop a workspace, or every workspace of an org-wide install
+    def invalidate(self, enterprise_id, team_id):
+        enterprise_id, team_id = enterprise_id or "", team_id or ""
+        with self._lock:
+            for key in list(self._entries):
+                if key == (enterprise_id, team_id) or (enterprise_id and key[0] == enterprise_id):
+                    del self._entries[key]
+                    self._counters["invalidated"] += 1
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+authorization_cache = AuthorizationCache()
+
+
+# A workspace's bot authorization from the cache, else from the installation store. The stored
+# bot already carries its ids and scopes, so no auth.test call is made.
+def _authorization(enterprise_id, team_id, is_enterprise_install=False):
+    key = _key(enterprise_id, team_id, is_enterprise_install)
+    result = authorization_cache.get(key)
+    if result is not None:
+        return result
+    bot = installation_store.find_bot(
+        enterprise_id=enterprise_id, team_id=team_id, is_enterprise_install=is_enterprise_install
+    )
+    if bot is None:
+        return None
+    result = AuthorizeResult(
+        enterprise_id=bot.enterprise_id,
+        team_id=bot.team_id,
+        bot_user_id=bot.bot_user_id,
+        bot_id=bot.bot_id,
+        bot_token=bot.bot_token,
+        bot_scopes=bot.bot_scopes,
+    )
+    authorization_cache.put(key, result, bot.bot_token_expires_at)
+    return result
+
+
+# Bolt authorize for OAuth mode; runs on every incoming request
+class CachedAuthorize(Authorize):
+    def __call__(self, *, context, enterprise_id, team_id, user_id, **kwargs):
+        return _authorization(enterprise_id, team_id, context.is_enterprise_install)
+
+
+installation_store = PostgresInstallationStore()
+authorize = CachedAuthorize()
+
+
+def oauth_settings():
+    return OAuthSettings(
+        client_id=SLACK_CLIENT_ID,
+        client_secret=SLACK_CLIENT_SECRET,
+        scopes=SLACK_SCOPES,
+        installation_store=installation_store,
+        installation_store_bot_only=True,
+        state_store=PostgresOAuthStateStore(),
+    )
+
+
+# WebClient for work done outside a Slack request (sweeper, CLI exports) in the workspace a swarm
+# was posted from. Without OAuth every swarm belongs to the SLACK_BOT_TOKEN workspace.
+def client_for(enterprise_id, team_id):
+    if not OAUTH_ENABLED:
+        return slack.build_client(os.environ.get("SLACK_BOT_TOKEN"))
+    result = _authorization(enterprise_id, team_id)
+    if result is None and enterprise_id:
+        result = _authorization(enterprise_id, team_id, is_enterprise_install=True)
+    if result is None:
+        return None
+    return slack.build_client(result.bot_token, team_id=team_id)
+
+
+@registry.collector
+def _authorization_counters():
+    return [("swarm_authorize_cache_total", "Workspace authorizations served from memory, looked up or invalidated",
+             ("result",), {(result,): count for result, count in authorization_cache.counters().items()})]
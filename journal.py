@@ -0,0 +1,393 @@
+import os
+import re
+import json
+import time
+import queue
+import atexit
+import asyncio
+import logging
+import itertools
+import threading
+
+import psycopg2
+from psycopg2 import pool
+
+from metrics import current_listener
+from storage import get_db_connection, note_writes, swarms
+
+
+JOURNAL_BATCH_SIZE = int(os.environ.get("JOURNAL_BATCH_SIZE", 100))
+JOURNAL_FLUSH_INTERVAL = float(os.environ.get("JOURNAL_FLUSH_INTERVAL", 0.1))
+# Heroku's filesystem only lives as long as the dyno, which is enough to ride out a failover.
+# Each journal spools to its own "<path>.<pid>.<n>"; spools left by processes that have exited
+# are taken over by the next journal to start.
+JOURNAL_SPOOL_PATH = os.environ.get("JOURNAL_SPOOL_PATH", "swarm_journal.spool")
+# How many flushes a transition may wait for its create to land before it is dropped
+JOURNAL_MAX_REQUEUES = int(os.environ.get("JOURNAL_MAX_REQUEUES", 100))
+
+# Ticket outcomes
+APPLIED = "applied"
+REJECTED = "rejected"
+DEFERRED = "deferred"
+
+_STOP = object()
+# Errors that mean the database can't be reached right now (including every pooled connection being
+# busy for longer than DB_POOL_WAIT_SECONDS), so the events are kept rather than rejected
+_UNAVAILABLE = (psycopg2.OperationalError, psycopg2.InterfaceError, pool.PoolError)
+_instances = itertools.count(1)
+
+
+# Handed back for each queued transition or reply so the caller can wait for its outcome if it cares
+class Ticket:
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._waiters = []
+        self.outcome = None
+        self.swarm = None
+
+    def resolve(self, outcome, swarm=None):
+        with self._lock:
+            if self._done.is_set():
+                return
+            self.outcome = outcome
+            self.swarm = swarm
+            self._done.set()
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_set_done, future)
+
+    # Returns the outcome, or None if it is still pending after timeout seconds
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self.outcome
+
+    # wait() for coroutines: the flusher thread wakes the event loop instead of a thread blocking
+    async def wait_async(self, timeout=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if self._done.is_set():
+                return self.outcome
+            self._waiters.append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.outcome
+
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _key(event):
+    return (event["channel_id"], event["message_ts"])
+
+
+# Write-behind journal for swarm lifecycle events and thread replies.
+# Creates, transitions and replies are queued in memory and applied by a background thread in batches,
+# once JOURNAL_BATCH_SIZE events are pending or JOURNAL_FLUSH_INTERVAL has passed.
+# Events for the same message are applied in the order they were queued: creates go first within
+# a batch, and a transition whose create has not been stored yet (e.g. it was queued by another
+# worker) is held back, together with any later events for that message, until it has. Replies
+# only add up, so they are applied together right after the creates and held back the same way.
+# If Postgres is unreachable the batch goes to this process's spool file that is replayed,
+# before anything newer, once the database is back.
+class Journal:
+    def __init__(self, batch_size=JOURNAL_BATCH_SIZE, flush_interval=JOURNAL_FLUSH_INTERVAL,
+                 spool_path=JOURNAL_SPOOL_PATH):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool_path = spool_path
+        self._queue = queue.Queue()
+        self._waiting = []
+        self._thread = None
+        self._pid = None
+        self._spool = None
+        self._instance = next(_instances)
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # The flusher thread does not survive a fork, so each process starts its own
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._waiting = []
+                self._pid = os.getpid()
+                self._spool = f"{self.spool_path}.{self._pid}.{self._instance}"
+                self._thread = threading.Thread(target=self._run, name="swarm-journal", daemon=True)
+                self._thread.start()
+
+    def create(self, **swarm):
+        self._ensure_started()
+        event = dict(swarm, kind="create")
+        self._queue.put((event, None))
+
+    # user_id is whoever asked for it, so their next reads see it (see db.note_writes)
+    def transition(self, channel_id, message_ts, action, user_id=None):
+        self._ensure_started()
+        ticket = Ticket()
+        event = {"kind": "transition", "channel_id": channel_id, "message_ts": message_ts,
+                 "action": action, "user_id": user_id, "requeues": 0}
+        self._queue.put((event, ticket))
+        return ticket
+
+    # Someone's reply in the thread of the swarm posted at (channel_id, message_ts). An unconfirmed
+    # reply's thread may turn out not to be a swarm's, so giving up on it is not an error.
+    def reply(self, channel_id, message_ts, reply_ts, user_id, unconfirmed=False):
+        self._ensure_started()
+        ticket = Ticket()
+        event = {"kind": "reply", "channel_id": channel_id, "message_ts": message_ts,
+                 "reply_ts": reply_ts, "user_id": user_id, "unconfirmed": unconfirmed, "requeues": 0}
+        self._queue.put((event, ticket))
+        return ticket
+
+    # Flush everything queued so far and stop the flusher thread
+    def close(self, timeout=10):
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._queue.put((_STOP, None))
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _next_batch(self):
+        items = []
+        try:
+            item = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return items, False
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if item[0] is _STOP:
+                return items, True
+            items.append(item)
+            remaining = deadline - time.monotonic()
+            if len(items) >= self.batch_size or remaining <= 0:
+                return items, False
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                return items, False
+
+    def _run(self):
+        current_listener.set("journal")
+        try:
+            self._adopt_spools()
+        except OSError as e:
+            logging.error(f"Error taking over spooled swarm events: {e}")
+        stopping = False
+        backoff = self.flush_interval
+        while not stopping:
+            items, stopping = self._next_batch()
+            # Transitions still waiting for their create always go ahead of newer events
+            items, self._waiting = self._waiting + items, []
+            try:
+                backoff = self._flush(items, stopping, backoff)
+            except Exception as e:
+                # Keep the events for the next round rather than losing them with the thread
+                logging.error(f"Error flushing swarm journal, retrying {len(items)} events: {e}")
+                self._waiting = items + self._waiting
+                if not stopping:
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, 5)
+        self._spool_waiting()
+
+    # Events still waiting for their create when the journal stops go to the spool, to be
+    # replayed by the next journal, instead of being lost with the process
+    def _spool_waiting(self):
+        if not self._waiting:
+            return
+        try:
+            spooled = self._read_spool() if os.path.exists(self._spool) else []
+            self._write_spool(spooled + self._waiting)
+        except OSError as e:
+            logging.error(f"Error spooling {len(self._waiting)} waiting swarm events: {e}")
+            return
+        logging.info(f"Spooled {len(self._waiting)} swarm events still waiting for their swarm")
+        self._waiting = []
+
+    # Store the batch, replaying the spool first. Returns the backoff for the next round.
+    def _flush(self, items, stopping, backoff):
+        if os.path.exists(self._spool):
+            spooled = self._read_spool()
+            unstored = self._store(spooled)
+            if unstored:
+                if items:
+                    logging.error(f"Database still unavailable, spooling {len(items)} more swarm events")
+                self._write_spool(unstored + items)
+                if not stopping:
+                    time.sleep(backoff)
+                return min(backoff * 2, 5)
+            os.remove(self._spool)
+            logging.info(f"Replayed {len(spooled)} spooled swarm events")
+
+        unstored = self._store(items)
+        if unstored:
+            logging.error(f"Database unavailable, spooling {len(unstored)} swarm events")
+            self._write_spool(unstored)
+            return backoff
+        return self.flush_interval
+
+    # Move the spools of processes that are no longer running (including one they were part way
+    # through taking over, and one from before spools were per process) into this journal's spool.
+    # Each is claimed with a rename first, so two journals starting at once never both replay it.
+    def _adopt_spools(self):
+        directory, base = os.path.split(os.path.abspath(self.spool_path))
+        pattern = re.compile(re.escape(base) + r"(?:\.(\d+)\.\d+(?:\.claimed)?)?")
+        for name in sorted(os.listdir(directory)):
+            match = pattern.fullmatch(name)
+            if match is None or (match.group(1) and _running(int(match.group(1)))):
+                continue
+            claimed = f"{self._spool}.claimed"
+            try:
+                os.rename(os.path.join(directory, name), claimed)
+            except FileNotFoundError:
+                continue
+            with open(claimed, encoding="utf-8") as spool:
+                adopted = [(json.loads(line), None) for line in spool if line.strip()]
+            # Removed only once its events are in this process's spool, so a crash loses nothing
+            if adopted:
+                self._write_spool((self._read_spool() if os.path.exists(self._spool) else []) + adopted)
+                logging.info(f"Took over {len(adopted)} swarm events spooled by {name}")
+            os.remove(claimed)
+
+    # Store a batch in one transaction, falling back to one event at a time if some event fails.
+    # Returns the events that could not be stored because the database is unreachable.
+    def _store(self, items):
+        if not items:
+            return []
+        try:
+            with get_db_connection() as conn, conn.cursor() as cur:
+                outcomes, held = self._apply(cur, items)
+        except _UNAVAILABLE:
+            return items
+        except Exception as e:
+            logging.error(f"Error storing swarm batch, retrying events one at a time: {e}")
+            return self._store_one_by_one(items)
+        self._settle(items, outcomes, held)
+        return []
+
+    def _store_one_by_one(self, items):
+        for index, item in enumerate(items):
+            try:
+                with get_db_connection() as conn, conn.cursor() as cur:
+                    outcomes, held = self._apply(cur, [item])
+            except _UNAVAILABLE:
+                return items[index:]
+            except Exception as e:
+                logging.error(f"Error storing data in database: {e}")
+                if item[1] is not None:
+                    item[1].resolve(REJECTED)
+                continue
+            self._settle([item], outcomes, held)
+        return []
+
+    # Apply a batch: all creates in one statement, then all replies in one, then the transitions
+    # in as few statements as per-message ordering allows. Returns (ticket outcomes, held back transitions), which
+    # only take effect once the transaction has committed.
+    def _apply(self, cur, items):
+        creates = [event for event, _ in items if event["kind"] == "create"]
+        # .get() so creates spooled before a field was added still replay
+        swarms.create_swarms(cur, [{field: event.get(field) for field in swarms.CREATE_FIELDS} for event in creates])
+
+        outcomes = []
+        held = []
+        replies = [(event, ticket) for event, ticket in items if event["kind"] == "reply"]
+        responded = swarms.record_replies(
+            cur, [(event["channel_id"], event["message_ts"], event["reply_ts"], event["user_id"]) for event, _ in replies]
+        )
+        # A reply that changed nothing was either stored before or its swarm has not been yet
+        stored = swarms.existing_keys(cur, {_key(event) for event, _ in replies if _key(event) not in responded})
+        for event, ticket in replies:
+            if _key(event) in responded:
+                outcomes.append((ticket, APPLIED, responded[_key(event)]))
+            elif _key(event) in stored:
+                outcomes.append((ticket, REJECTED, None))
+            else:
+                held.append((event, ticket))
+
+        held_keys = set()
+        transitions = [(event, ticket) for event, ticket in items if event["kind"] == "transition"]
+        while transitions:
+            # Take the longest prefix that touches each message at most once
+            group, seen = [], set()
+            for event, ticket in transitions:
+                if _key(event) in seen:
+                    break
+                seen.add(_key(event))
+                group.append((event, ticket))
+            transitions = transitions[len(group):]
+
+            pending = []
+            for event, ticket in group:
+                if _key(event) in held_keys:
+                    held.append((event, ticket))
+                else:
+                    pending.append((event, ticket))
+
+            updated = swarms.transition_many(
+                cur, [(event["channel_id"], event["message_ts"], event["action"]) for event, _ in pending]
+            )
+            stored = swarms.existing_keys(cur, [_key(event) for event, _ in pending if _key(event) not in updated])
+            for event, ticket in pending:
+                key = _key(event)
+                if key in updated:
+                    outcomes.append((ticket, APPLIED, updated[key]))
+                elif key in stored:
+                    outcomes.append((ticket, REJECTED, None))
+                else:
+                    held_keys.add(key)
+                    held.append((event, ticket))
+        return outcomes, held
+
+    # Runs once the batch has committed. Its users are noted as having written before any
+    # ticket resolves, so a read made by a waiting listener sees the batch.
+    def _settle(self, items, outcomes, held):
+        note_writes({event.get("user_id") for event, _ in items})
+        for ticket, outcome, swarm in outcomes:
+            if ticket is not None:
+                ticket.resolve(outcome, swarm)
+        for event, ticket in held:
+            event = dict(event, requeues=event["requeues"] + 1)
+            if event["requeues"] > JOURNAL_MAX_REQUEUES:
+                if not event.get("unconfirmed"):
+                    logging.error(f"No swarm request found for message_ts: {event['message_ts']}, dropping {event.get('action', event['kind'])}")
+                if ticket is not None:
+                    ticket.resolve(REJECTED)
+                continue
+            self._waiting.append((event, ticket))
+
+    def _read_spool(self):
+        with open(self._spool, encoding="utf-8") as spool:
+            return [(json.loads(line), None) for line in spool if line.strip()]
+
+    # Replace the spool with the given events, atomically so a crash never loses what was there
+    def _write_spool(self, items):
+        temp_path = self._spool + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as spool:
+            for event, ticket in items:
+                spool.write(json.dumps(event) + "\n")
+                if ticket is not None:
+                    ticket.resolve(DEFERRED)
+            spool.flush()
+            os.fsync(spool.fileno())
+        os.replace(temp_path, self._spool)
+
+
+# Whether a process with this pid is running on this machine
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+journal = Journal()
+atexit.register(journal.close)
@@ -0,0 +1,214 @@
+import threading
+import itertools
+from datetime import datetime, timedelta, timezone
+from contextlib import contextmanager
+
+import rollups
+from stats import GLOBAL, STATUSES
+from blocks import SKILL_GROUPS
+from swarms import CREATE_FIELDS, SWARM_COLUMNS, TRANSITIONS
+
+
+# In-process stand-in for the Postgres swarm storage (SWARM_STORAGE=memory), used by the
+# offline load tests. It mirrors the swarms.py/stats.py functions this app calls on the
+# request path; "transactions" are serialized by one process-wide lock.
+
+_lock = threading.RLock()
+_ids = itertools.count(1)
+_rows = {}
+_by_message = {}
+_stats = {}
+_rollups = {}
+_followed = {}
+_replies = set()
+
+
+class _Cursor:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _Connection:
+    def cursor(self):
+        return _Cursor()
+
+
+@contextmanager
+def get_db_connection():
+    with _lock:
+        yield _Connection()
+
+
+# There is no follower; reads share the one store and see every write
+def get_read_connection(user_id=None):
+    return get_db_connection()
+
+
+def note_writes(user_ids):
+    pass
+
+
+def reset():
+    with _lock:
+        _rows.clear()
+        _by_message.clear()
+        _stats.clear()
+        _rollups.clear()
+        _followed.clear()
+        _replies.clear()
+
+
+def _bump(user_id, status, delta):
+    for scope in (GLOBAL, user_id):
+        _stats[(scope, status)] = _stats.get((scope, status), 0) + delta
+
+
+def _record_rollups(deltas):
+    for key, value in deltas.items():
+        _rollups[key] = _rollups.get(key, 0) + value
+
+
+def create_swarms(cur, swarms):
+    created = []
+    for swarm in swarms:
+        key = (swarm["channel_id"], swarm["message_ts"])
+        if swarm["message_ts"] is not None and key in _by_message:
+            continue
+        now = datetime.now(timezone.utc)
+        row = dict.fromkeys(SWARM_COLUMNS)
+        row.update({field: swarm.get(field) for field in CREATE_FIELDS})
+        row.update(id=next(_ids), status="open", created_at=now, updated_at=now, reply_count=0, participants=[])
+        _rows[row["id"]] = row
+        if swarm["message_ts"] is not None:
+            _by_message[key] = row["id"]
+        _bump(row["user_id"], "open", 1)
+        created.append(dict(row))
+    _record_rollups(rollups.deltas_for(created=created))
+    return created
+
+
+def create_swarm(cur, **swarm):
+    created = create_swarms(cur, [swarm])
+    return created[0] if created else None
+
+
+def transition_many(cur, requests):
+    updated = {}
+    for channel_id, message_ts, action in requests:
+        from_statuses, to_status = TRANSITIONS[action]
+        row = _rows.get(_by_message.get((channel_id, message_ts)))
+        if row is None or row["status"] not in from_statuses:
+            continue
+        previous_status = row["status"]
+        row.update(status=to_status, updated_at=datetime.now(timezone.utc))
+        _bump(row["user_id"], previous_status, -1)
+        _bump(row["user_id"], to_status, 1)
+        updated[(channel_id, message_ts)] = dict(row, previous_status=previous_status)
+    _record_rollups(rollups.deltas_for(transitioned=updated.values()))
+    return updated
+
+
+def transition(cur, channel_id, message_ts, action):
+    return transition_many(cur, [(channel_id, message_ts, action)]).get((channel_id, message_ts))
+
+
+def record_replies(cur, replies):
+    updated = {}
+    for channel_id, message_ts, reply_ts, user_id in replies:
+        key = (channel_id, message_ts)
+        row = _rows.get(_by_message.get(key))
+        if (row is None or row["status"] != "open" or row["user_id"] == user_id
+                or (row["id"], reply_ts) in _replies):
+            continue
+        _replies.add((row["id"], reply_ts))
+        replied_at = datetime.fromtimestamp(float(reply_ts), timezone.utc)
+        first_response = updated[key]["first_response"] if key in updated else row["first_response_at"] is None
+        if row["first_response_at"] is None or replied_at < row["first_response_at"]:
+            row.update(first_response_at=replied_at, first_responder_id=user_id)
+        row["reply_count"] += 1
+        if user_id not in row["participants"]:
+            row["participants"] = row["participants"] + [user_id]
+        updated[key] = dict(row, first_response=first_response)
+    _record_rollups(rollups.deltas_for(responded=[swarm for swarm in updated.values() if swarm["first_response"]]))
+    return updated
+
+
+def existing_keys(cur, keys):
+    return {key for key in keys if key in _by_message}
+
+
+def get_swarm(cur, channel_id, message_ts):
+    row = _rows.get(_by_message.get((channel_id, message_ts)))
+    return dict(row) if row else None
+
+
+def fetch_leaderboard(cur, user_id, limit):
+    totals = dict.fromkeys(STATUSES, 0)
+    mine = dict.fromkeys(STATUSES, 0)
+    resolved = []
+    for (row_user_id, status), count in _stats.items():
+        if row_user_id == GLOBAL:
+            totals[status] = count
+        elif row_user_id == user_id:
+            mine[status] = count
+        if status == "resolved" and row_user_id != GLOBAL and count > 0:
+            resolved.append((row_user_id, count))
+    resolved.sort(key=lambda leader: (-leader[1], leader[0]))
+    return totals, mine, resolved[:limit]
+
+
+def list_open(cur, user_id=None, skill_groups=None, exclude_user_id=None, min_id=None, before_id=None, limit=10):
+    rows = []
+    for row_id in sorted(_rows, reverse=True):
+        row = _rows[row_id]
+        if (row["status"] != "open" or (user_id is not None and row["user_id"] != user_id)
+                or (skill_groups is not None and row["skill_group"] not in skill_groups)
+                or (exclude_user_id is not None and row["user_id"] == exclude_user_id)
+                or (min_id is not None and row_id < min_id) or (before_id is not None and row_id >= before_id)):
+            continue
+        rows.append(dict(row))
+        if len(rows) == limit:
+            break
+    return rows
+
+
+def followed_skill_groups(cur, user_id):
+    return sorted(_followed.get(user_id, ()))
+
+
+def follow_skill_groups(cur, user_id, skill_groups):
+    _followed[user_id] = set(skill_groups)
+
+
+def ticket_changes(cur, since, after_id=0, limit=1000):
+    changes = sorted(
+        (row for row in _rows.values() if row["ticket"] is not None and (row["updated_at"], row["id"]) > (since, after_id)),
+        key=lambda row: (row["updated_at"], row["id"])
+    )
+    return [{column: row[column] for column in ("id", "ticket", "channel_id", "message_ts", "status", "updated_at")}
+            for row in changes[:limit]]
+
+
+def open_threads(cur):
+    return [{column: row[column] for column in ("channel_id", "message_ts", "user_id", "participants")}
+            for row in _rows.values() if row["status"] == "open" and row["message_ts"] is not None]
+
+
+def list_skill_groups(cur):
+    return list(SKILL_GROUPS)
+
+
+def summarize(cur, weeks=4, skill_group=None, priority=None):
+    week_starts, day_since = rollups.summary_window(weeks)
+    rows = []
+    for (granularity, bucket, skill, _, _, level, metric), value in _rollups.items():
+        if (skill_group and skill != skill_group) or (priority and level != priority):
+            continue
+        if granularity == "day" and bucket.date() >= week_starts[0]:
+            rows.append((bucket.date() - timedelta(days=bucket.weekday()), metric, value))
+        elif granularity == "hour" and bucket >= day_since:
+            rows.append((None, metric, value))
+    return rollups.summary_from_rows(rows, week_starts)
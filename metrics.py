@@ -0,0 +1,322 @@
+import os
+import hmac
+import json
+import time
+import bisect
+import inspect
+import logging
+import threading
+import contextvars
+from functools import wraps
+
+from slack_bolt.context.ack import Ack
+from slack_bolt.context.ack.async_ack import AsyncAck
+
+
+# Prometheus scrape path on the WSGI app, and an optional standalone port for the
+# Socket Mode and development runtimes, which have no WSGI app to mount it on
+METRICS_PATH = os.environ.get("METRICS_PATH", "/metrics")
+METRICS_PORT = os.environ.get("METRICS_PORT")
+# The web apps share their port with Slack's requests, so they only serve METRICS_PATH when a
+# token is set and the scrape sends it as "Authorization: Bearer <token>". METRICS_PORT is meant
+# to stay internal and serves without one unless METRICS_TOKEN is set there too.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+# gunicorn.conf.py points this at a directory shared by the workers; each worker writes its
+# snapshot there so a scrape that lands on any one of them reports all of them
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_SYNC_INTERVAL = float(os.environ.get("METRICS_SYNC_INTERVAL", 5))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+# The listener (callback_id, action_id, command or event type) the current thread is working for,
+# so Slack API calls and SQL statements are attributed to it
+current_listener = contextvars.ContextVar("current_listener", default="background")
+
+
+# A labelled histogram. Each observation is one bisect and one locked increment,
+# so it is cheap enough to stay on in production.
+class Histogram:
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> per-bucket counts (last one is +Inf), then the sum
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            series = [[list(labels), list(values)] for labels, values in self._series.items()]
+        return {"help": self.help, "labels": list(self.labels), "buckets": list(self.buckets), "series": series}
+
+
+class Registry:
+    def __init__(self):
+        self._histograms = {}
+        self._collectors = []
+        self._sync_pid = None
+
+    def histogram(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        histogram = self._histograms[name] = Histogram(name, help, labels, buckets)
+        return histogram
+
+    # fn() returns [(name, help, labels, {label values: value})] for counters kept elsewhere
+    def collector(self, fn):
+        self._collectors.append(fn)
+        return fn
+
+    def snapshot(self):
+        counters = {}
+        for collect in self._collectors:
+            try:
+                for name, help, labels, values in collect():
+                    counters[name] = {"help": help, "labels": list(labels),
+                                      "series": [[list(key), value] for key, value in values.items()]}
+            except Exception as e:
+                logging.error(f"Error collecting metrics: {e}")
+        return {"histograms": {name: h.snapshot() for name, h in self._histograms.items()}, "counters": counters}
+
+    # Write this process's snapshot to METRICS_DIR every METRICS_SYNC_INTERVAL seconds
+    def start_sync(self):
+        if not METRICS_DIR or self._sync_pid == os.getpid():
+            return
+        self._sync_pid = os.getpid()
+        os.makedirs(METRICS_DIR, exist_ok=True)
+
+        def sync():
+            while True:
+                time.sleep(METRICS_SYNC_INTERVAL)
+                self.write_snapshot()
+
+        threading.Thread(target=sync, name="metrics-sync", daemon=True).start()
+
+    def write_snapshot(self):
+        if not METRICS_DIR:
+            return
+        path = os.path.join(METRICS_DIR, f"metrics-{os.getpid()}.json")
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as snapshot:
+                json.dump(self.snapshot(), snapshot)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logging.error(f"Error writing metrics snapshot: {e}")
+
+    # Prometheus text format for this process, merged with every other worker's latest snapshot
+    def exposition(self):
+        snapshots = [self.snapshot()]
+        if METRICS_DIR and os.path.isdir(METRICS_DIR):
+            own = f"metrics-{os.getpid()}.json"
+            for filename in os.listdir(METRICS_DIR):
+                if filename.startswith("metrics-") and filename.endswith(".json") and filename != own:
+                    try:
+                        with open(os.path.join(METRICS_DIR, filename), encoding="utf-8") as snapshot:
+                            snapshots.append(json.load(snapshot))
+                    except (OSError, ValueError):
+                        continue
+        return _render(snapshots)
+
+
+def _label_string(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _render(snapshots):
+    histograms = {}
+    counters = {}
+    for snapshot in snapshots:
+        for name, histogram in snapshot["histograms"].items():
+            merged = histograms.setdefault(name, dict(histogram, series={}))
+            for labels, values in histogram["series"]:
+                current = merged["series"].get(tuple(labels))
+                merged["series"][tuple(labels)] = values if current is None else [a + b for a, b in zip(current, values)]
+        for name, counter in snapshot["counters"].items():
+            merged = counters.setdefault(name, dict(counter, series={}))
+            for labels, value in counter["series"]:
+                merged["series"][tuple(labels)] = merged["series"].get(tuple(labels), 0) + value
+
+    lines = []
+    for name, histogram in sorted(histograms.items()):
+        lines.append(f"# HELP {name} {histogram['help']}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, values in sorted(histogram["series"].items()):
+            cumulative = 0
+            for bound, count in zip(histogram["buckets"] + ["+Inf"], values[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_label_string(histogram['labels'], labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_label_string(histogram['labels'], labels)} {values[-1]}")
+            lines.append(f"{name}_count{_label_string(histogram['labels'], labels)} {cumulative}")
+    for name, counter in sorted(counters.items()):
+        lines.append(f"# HELP {name} {counter['help']}")
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in sorted(counter["series"].items()):
+            lines.append(f"{name}{_label_string(counter['labels'], labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+listener_ack_seconds = registry.histogram(
+    "swarm_listener_ack_seconds", "Time from receiving a Slack request to acknowledging it", ("listener",)
+)
+listener_handler_seconds = registry.histogram(
+    "swarm_listener_handler_seconds", "Time spent running a listener's handler", ("listener", "outcome")
+)
+slack_api_seconds = registry.histogram(
+    "swarm_slack_api_seconds", "Slack Web API call latency, including rate-limit waits and retries",
+    ("method", "error", "listener")
+)
+db_statement_seconds = registry.histogram(
+    "swarm_db_statement_seconds", "SQL statement latency", ("statement", "listener")
+)
+db_statement_rows = registry.histogram(
+    "swarm_db_statement_rows", "Rows returned or affected per SQL statement", ("statement", "listener"), ROW_BUCKETS
+)
+
+
+# Label for a Slack request body: callback_id, action_id, slash command or event type
+def listener_name(body):
+    if "command" in body:
+        return body["command"]
+    if body.get("type") == "view_submission":
+        return body["view"]["callback_id"]
+    if body.get("type") == "block_suggestion":
+        return body["action_id"]
+    if body.get("actions"):
+        return body["actions"][0]["action_id"]
+    if "event" in body:
+        return body["event"].get("type", "event")
+    return body.get("type", "unknown")
+
+
+class _TimedAck(Ack):
+    def __init__(self, listener, received_at):
+        super().__init__()
+        self.listener = listener
+        self.received_at = received_at
+
+    def __call__(self, *args, **kwargs):
+        response = super().__call__(*args, **kwargs)
+        if self.received_at is not None:
+            listener_ack_seconds.observe(time.perf_counter() - self.received_at, self.listener)
+            self.received_at = None
+        return response
+
+
+class _TimedAsyncAck(AsyncAck):
+    def __init__(self, listener, received_at):
+        super().__init__()
+        self.listener = listener
+        self.received_at = received_at
+
+    async def __call__(self, *args, **kwargs):
+        response = await super().__call__(*args, **kwargs)
+        if self.received_at is not None:
+            listener_ack_seconds.observe(time.perf_counter() - self.received_at, self.listener)
+            self.received_at = None
+        return response
+
+
+# Bolt global middleware: swaps in an ack() that records how long the request took to acknowledge.
+# Bolt runs listeners after the middleware chain returns, so the ack is the only hook that sees both ends.
+def record_ack_time(context, body, next):
+    context["ack"] = _TimedAck(listener_name(body), time.perf_counter())
+    next()
+
+
+# record_ack_time() for AsyncApp
+async def record_ack_time_async(context, body, next):
+    context["ack"] = _TimedAsyncAck(listener_name(body), time.perf_counter())
+    await next()
+
+
+# Time a listener's handler and attribute everything it calls to listener.
+# Bolt injects arguments by inspecting the wrapped function, so this works on any listener,
+# coroutine functions included.
+def timed_handler(listener):
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                token = current_listener.set(listener)
+                started = time.perf_counter()
+                outcome = "ok"
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception:
+                    outcome = "error"
+                    raise
+                finally:
+                    listener_handler_seconds.observe(time.perf_counter() - started, listener, outcome)
+                    current_listener.reset(token)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            token = current_listener.set(listener)
+            started = time.perf_counter()
+            outcome = "ok"
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                outcome = "error"
+                raise
+            finally:
+                listener_handler_seconds.observe(time.perf_counter() - started, listener, outcome)
+                current_listener.reset(token)
+        return wrapper
+    return decorate
+
+
+# Whether an Authorization header carries METRICS_TOKEN; anything goes when no token is set
+def authorized(header):
+    if not METRICS_TOKEN:
+        return True
+    scheme, _, token = (header or "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(token.strip().encode(), METRICS_TOKEN.encode())
+
+
+# Serves METRICS_PATH as a WSGI app
+def wsgi_app(environ, start_response):
+    if not authorized(environ.get("HTTP_AUTHORIZATION")):
+        start_response("401 Unauthorized", [("WWW-Authenticate", "Bearer"), ("Content-Length", "0")])
+        return [b""]
+    body = registry.exposition().encode()
+    start_response("200 OK", [
+        ("Content-Type", "text/plain; version=0.0.4; charset=utf-8"),
+        ("Content-Length", str(len(body))),
+    ])
+    return [body]
+
+
+# Standalone endpoint on METRICS_PORT for runtimes without a WSGI app
+def start_server():
+    if not METRICS_PORT:
+        return
+    from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = make_server("0.0.0.0", int(METRICS_PORT), wsgi_app, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logging.info(f"Serving metrics on port {METRICS_PORT}")
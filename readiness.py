@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import Future
+
+
+# Fast startup: build the Bolt app without its blocking auth.test and leave token verification
+# and the database pool to a background warm-up, so a restarting dyno serves its port at once.
+# FAST_STARTUP=false restores verifying the token before the app is importable.
+FAST_STARTUP = os.environ.get("FAST_STARTUP", "true").lower() == "true"
+READINESS_PATH = os.environ.get("READINESS_PATH", "/ready")
+# Longest a request arriving mid-boot waits for the background token verification
+TOKEN_VERIFICATION_WAIT = float(os.environ.get("TOKEN_VERIFICATION_WAIT", 2.5))
+# Seconds between attempts of a warm-up step that failed, e.g. while Postgres is restarting too
+WARM_UP_RETRY_INTERVAL = float(os.environ.get("WARM_UP_RETRY_INTERVAL", 5))
+
+_STARTED_AT = time.monotonic()
+
+
+# Tracks the warm-up steps of this process. Ready once every step has succeeded; requests are
+# served before that too, they just pay for whatever is still cold.
+class Readiness:
+    def __init__(self):
+        self._steps = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self.ready_after = None
+
+    def expect(self, *steps):
+        with self._lock:
+            for step in steps:
+                self._steps.setdefault(step, None)
+
+    def done(self, step):
+        with self._lock:
+            self._steps[step] = round(time.monotonic() - _STARTED_AT, 3)
+            if all(finished is not None for finished in self._steps.values()):
+                self.ready_after = self._steps[step]
+                self._ready.set()
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def status(self):
+        with self._lock:
+            return {"ready": self._ready.is_set(), "steps": dict(self._steps)}
+
+
+readiness = Readiness()
+
+
+_verification = None
+_verification_pid = None
+_verification_lock = threading.Lock()
+_app = None
+
+
+# auth.test for SLACK_BOT_TOKEN on a background thread, started once per process (and again
+# after a failure). gunicorn's post_fork starts it before the worker imports the app, so the
+# round trip overlaps the import instead of following it; that is also why it is a plain urllib
+# call rather than one through slack_sdk and the dispatcher.
+def start_token_verification():
+    global _verification, _verification_pid
+    with _verification_lock:
+        if _verification_pid == os.getpid() and not (_verification.done() and _verification.exception()):
+            return _verification
+        verification = _verification = Future()
+        _verification_pid = os.getpid()
+
+    def run():
+        from urllib.request import Request, urlopen
+
+        api_url = os.environ.get("SLACK_API_URL", "https://slack.com/api/")
+        request = Request(f"{api_url}auth.test", data=b"", method="POST",
+                          headers={"Authorization": f"Bearer {os.environ.get('SLACK_BOT_TOKEN')}"})
+        try:
+            with urlopen(request, timeout=30) as response:
+                data = json.load(response)
+                headers = {name.lower(): value for name, value in response.headers.items()}
+            if not data.get("ok"):
+                raise RuntimeError(f"auth.test failed: {data.get('error')}")
+            verification.set_result((data, headers))
+        except Exception as e:
+            verification.set_exception(e)
+
+    threading.Thread(target=run, name="swarm-token-verification", daemon=True).start()
+    return verification
+
+
+# The Bolt app was built with token_verification_enabled=False, so its single-workspace
+# authorization would call auth.test on the first request. Hand it the background result instead.
+def _verify_token(app, timeout=None):
+    from slack_bolt.middleware.authorization.single_team_authorization import SingleTeamAuthorization
+    from slack_sdk.web import SlackResponse
+
+    authorization = next((m for m in app._middleware_list if isinstance(m, SingleTeamAuthorization)), None)
+    if authorization is None or authorization.auth_test_result:
+        return
+    data, headers = start_token_verification().result(timeout)
+    authorization.auth_test_result = SlackResponse(
+        client=app.client, http_verb="POST", api_url=f"{app.client.base_url}auth.test",
+        req_args={}, data=data, headers=headers, status_code=200,
+    )
+
+
+# Bolt before_authorize middleware for fast startup: a request that arrives while the token is
+# still being verified waits for that call rather than making its own
+def await_token_verification(next):
+    if _app is not None:
+        try:
+            _verify_token(_app, TOKEN_VERIFICATION_WAIT)
+        except Exception as e:
+            logging.error(f"Slack token not verified yet: {e}")
+    return next()
+
+
+# Open the pool's first connections, so the first request doesn't pay for connecting
+def _warm_pool():
+    import storage
+
+    if storage.SWARM_STORAGE == "memory":
+        return
+    with storage.get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute("/* readiness.warm_pool */ SELECT 1")
+
+
+# Load the ticket autocomplete index, so the first modal's suggestions aren't empty
+def _load_option_index():
+    from autocomplete import option_index
+
+    option_index.refresh()
+
+
+# Load the open swarm threads, so the first replies aren't dropped as unrelated messages
+def _load_active_threads():
+    from thread_activity import active_threads
+
+    active_threads.refresh()
+
+
+# Run every step, then retry the failed ones until all have succeeded; one failing step (Slack
+# unreachable) doesn't hold up the others (the pool)
+def _run_steps(steps):
+    from metrics import current_listener
+
+    current_listener.set("warm_up")
+    pending = list(steps)
+    while pending:
+        for name, step in list(pending):
+            try:
+                step()
+            except Exception as e:
+                logging.error(f"Warm-up step {name} failed, retrying in {WARM_UP_RETRY_INTERVAL}s: {e}")
+                continue
+            readiness.done(name)
+            pending.remove((name, step))
+        if pending:
+            time.sleep(WARM_UP_RETRY_INTERVAL)
+    logging.info(f"Ready {readiness.ready_after}s after start")
+
+
+_started_pid = None
+
+
+# Verify the token, fill the pool and load the in-memory indexes on a daemon thread, once per process
+def start_warm_up(app):
+    global _app, _started_pid
+    if _started_pid == os.getpid():
+        return
+    _app = app
+    _started_pid = os.getpid()
+    steps = [("slack_token", lambda: _verify_token(app)), ("database", _warm_pool), ("autocomplete", _load_option_index),
+             ("threads", _load_active_threads)]
+    readiness.expect(*(name for name, _ in steps))
+    threading.Thread(target=_run_steps, args=(steps,), name="swarm-warm-up", daemon=True).start()
+
+
+# READINESS_PATH: 200 once warmed up, 503 until then, with the time each step finished
+def wsgi_app(environ, start_response):
+    status = readiness.status()
+    body = json.dumps(status).encode()
+    start_response("200 OK" if status["ready"] else "503 Service Unavailable", [
+        ("Content-Type", "application/json"),
+        ("Content-Length", str(len(body))),
+    ])
+    return [body]
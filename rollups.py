@@ -0,0 +1,268 @@
+import os
+import sys
+import logging
+from datetime import datetime, timedelta, timezone
+
+from psycopg2.extras import execute_values
+
+from db import get_db_connection
+
+
+GRANULARITIES = ("hour", "day")
+DIMENSIONS = ("skill_group", "entitlement", "support_tier", "priority")
+# Upper bounds, in seconds, of the time-to-resolve and time-to-first-response histogram buckets
+# (the last one is open-ended).
+# Histograms with fixed bounds add up across buckets, so any window's percentiles come from a
+# handful of rows instead of the swarms themselves.
+RESOLUTION_BOUNDS = (
+    300, 900, 1800, 3600, 2 * 3600, 4 * 3600, 8 * 3600, 12 * 3600,
+    86400, 2 * 86400, 3 * 86400, 7 * 86400, 14 * 86400,
+)
+ROLLUP_HOURLY_RETENTION_DAYS = int(os.environ.get("ROLLUP_HOURLY_RETENTION_DAYS", 35))
+
+# Metrics kept per bucket: created, resolved, discarded, reopened, resolution_seconds (sum of
+# time-to-resolve) and resolved_lt_<bound> / resolved_lt_inf (the histogram), and the same for
+# first responses: responded, response_seconds and responded_lt_<bound> / responded_lt_inf
+_STATUS_METRICS = {"resolved": "resolved", "discarded": "discarded", "open": "reopened"}
+
+
+def _truncate(moment, granularity):
+    moment = moment.astimezone(timezone.utc)
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _histogram_metric(seconds, prefix="resolved"):
+    for bound in RESOLUTION_BOUNDS:
+        if seconds < bound:
+            return f"{prefix}_lt_{bound}"
+    return f"{prefix}_lt_inf"
+
+
+def _add(deltas, moment, swarm, metric, value=1):
+    dimensions = tuple(swarm[dimension] or "" for dimension in DIMENSIONS)
+    for granularity in GRANULARITIES:
+        key = (granularity, _truncate(moment, granularity)) + dimensions + (metric,)
+        deltas[key] = deltas.get(key, 0) + value
+
+
+# Rollup deltas for newly created swarms, transitioned swarms (with previous_status) and swarms
+# that just got their first response. Creates count at created_at, transitions at updated_at and
+# first responses at first_response_at; a resolve and a first response also record how long
+# they took since created_at.
+def deltas_for(created=(), transitioned=(), responded=()):
+    deltas = {}
+    for swarm in created:
+        _add(deltas, swarm["created_at"], swarm, "created")
+    for swarm in transitioned:
+        metric = _STATUS_METRICS.get(swarm["status"])
+        if metric is None:
+            continue
+        _add(deltas, swarm["updated_at"], swarm, metric)
+        if swarm["status"] == "resolved":
+            seconds = max(0, int((swarm["updated_at"] - swarm["created_at"]).total_seconds()))
+            _add(deltas, swarm["updated_at"], swarm, _histogram_metric(seconds))
+            _add(deltas, swarm["updated_at"], swarm, "resolution_seconds", seconds)
+    for swarm in responded:
+        seconds = max(0, int((swarm["first_response_at"] - swarm["created_at"]).total_seconds()))
+        _add(deltas, swarm["first_response_at"], swarm, "responded")
+        _add(deltas, swarm["first_response_at"], swarm, _histogram_metric(seconds, "responded"))
+        _add(deltas, swarm["first_response_at"], swarm, "response_seconds", seconds)
+    return deltas
+
+
+def apply_deltas(cur, deltas):
+    # Sorted so concurrent writers lock rollup rows in the same order
+    rows = sorted(key + (value,) for key, value in deltas.items() if value)
+    if not rows:
+        return
+    execute_values(
+        cur,
+        f"""
+        /* rollups.apply_deltas */
+        INSERT INTO swarm_rollups (granularity, bucket, {", ".join(DIMENSIONS)}, metric, value)
+        VALUES %s
+        ON CONFLICT (granularity, bucket, {", ".join(DIMENSIONS)}, metric) DO UPDATE
+        SET value = swarm_rollups.value + EXCLUDED.value
+        """,
+        rows,
+        page_size=len(rows),
+    )
+
+
+# Record creates, transitions and first responses in the transaction that stored them
+def record(cur, created=(), transitioned=(), responded=()):
+    apply_deltas(cur, deltas_for(created, transitioned, responded))
+
+
+# Estimate a percentile (0-1) of time-to-resolve (or, with prefix "responded", time to first
+# response) from histogram counts {metric: count}, interpolating linearly inside the bucket it falls in
+def percentile(histogram, fraction, prefix="resolved"):
+    total = sum(count for metric, count in histogram.items() if metric.startswith(f"{prefix}_lt_"))
+    if not total:
+        return None
+    target = fraction * total
+    seen = 0
+    lower = 0
+    for bound in RESOLUTION_BOUNDS + (None,):
+        count = histogram.get(f"{prefix}_lt_{bound if bound else 'inf'}", 0)
+        if count and seen + count >= target:
+            if bound is None:
+                return lower
+            return lower + (bound - lower) * (target - seen) / count
+        seen += count
+        lower = bound or lower
+    return lower
+
+
+def _summarize_metrics(metrics):
+    histogram = {metric: value for metric, value in metrics.items() if "_lt_" in metric}
+    return {
+        "created": metrics.get("created", 0),
+        "resolved": metrics.get("resolved", 0),
+        "discarded": metrics.get("discarded", 0),
+        "reopened": metrics.get("reopened", 0),
+        "responded": metrics.get("responded", 0),
+        "p50": percentile(histogram, 0.5),
+        "p90": percentile(histogram, 0.9),
+        "response_p50": percentile(histogram, 0.5, "responded"),
+        "response_p90": percentile(histogram, 0.9, "responded"),
+    }
+
+
+_SUMMARY_SQL = """
+    /* rollups.summarize */
+    SELECT CASE WHEN granularity = 'day' THEN date_trunc('week', bucket AT TIME ZONE 'UTC')::date END AS week,
+           metric, SUM(value)
+    FROM swarm_rollups
+    WHERE ((granularity = 'day' AND bucket >= %(weeks_since)s) OR (granularity = 'hour' AND bucket >= %(day_since)s))
+      AND (%(skill_group)s::text IS NULL OR skill_group = %(skill_group)s)
+      AND (%(priority)s::text IS NULL OR priority = %(priority)s)
+    GROUP BY 1, 2
+"""
+
+
+def summary_window(weeks, now=None):
+    now = now or datetime.now(timezone.utc)
+    this_week = now.date() - timedelta(days=now.weekday())
+    week_starts = [this_week - timedelta(weeks=offset) for offset in range(weeks - 1, -1, -1)]
+    return week_starts, _truncate(now, "hour") - timedelta(hours=23)
+
+
+# Build the summary from (week start, or None for the last day's hourly buckets, metric, value) rows
+def summary_from_rows(rows, week_starts):
+    by_week = {}
+    last_day = {}
+    for week, metric, value in rows:
+        target = last_day if week is None else by_week.setdefault(week, {})
+        target[metric] = target.get(metric, 0) + int(value)
+
+    overall = {}
+    for metrics in by_week.values():
+        for metric, value in metrics.items():
+            overall[metric] = overall.get(metric, 0) + value
+    return {
+        "weeks": [dict(_summarize_metrics(by_week.get(start, {})), week=start) for start in week_starts],
+        "window": _summarize_metrics(overall),
+        "last_24h": _summarize_metrics(last_day),
+    }
+
+
+# Weekly trend and time-to-resolve percentiles over the last `weeks` weeks (from daily buckets)
+# plus the last 24 hours (from hourly buckets). Reads only rollup rows, so the cost depends on
+# the window, never on how many swarms there are.
+def summarize(cur, weeks=4, skill_group=None, priority=None):
+    week_starts, day_since = summary_window(weeks)
+    cur.execute(_SUMMARY_SQL, {
+        "weeks_since": week_starts[0],
+        "day_since": day_since,
+        "skill_group": skill_group,
+        "priority": priority,
+    })
+    return summary_from_rows(cur.fetchall(), week_starts)
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "n/a"
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{minutes}m"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 48:
+        return f"{hours}h {minutes}m"
+    return f"{hours // 24}d {hours % 24}h"
+
+
+def _trend_line(entry):
+    return (f"{entry['created']} created · {entry['resolved']} resolved · {entry['discarded']} discarded · "
+            f"p50 {format_duration(entry['p50'])} · p90 {format_duration(entry['p90'])} · "
+            f"first response p50 {format_duration(entry['response_p50'])} · p90 {format_duration(entry['response_p90'])}")
+
+
+# Time-to-resolve and time-to-first-response percentiles and one trend line per week, as blocks
+# for Home and /swarmstats
+def render_summary(summary, title):
+    lines = [f"Week of {entry['week']:%b %d}: {_trend_line(entry)}" for entry in reversed(summary["weeks"])]
+    return [
+        {
+            "type": "section",
+            "block_id": "resolution_time",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*{title}*\n"
+                        f"Last 24 hours: {_trend_line(summary['last_24h'])}\n"
+                        f"Last {len(summary['weeks'])} weeks: {_trend_line(summary['window'])}"
+            }
+        },
+        {
+            "type": "section",
+            "block_id": "weekly_trend",
+            "text": {"type": "mrkdwn", "text": "\n".join(lines)}
+        },
+    ]
+
+
+# Rebuild every rollup from swarm_requests. Only current statuses are known there, so reopen
+# history and resolutions that were later reopened are lost. Holds a lock that blocks concurrent
+# rollup updates (but not reads) so the rebuilt buckets are exact.
+def backfill():
+    columns = ("created_at", "updated_at", "status", "first_response_at") + DIMENSIONS
+    deltas = {}
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("LOCK TABLE swarm_rollups IN EXCLUSIVE MODE")
+            cur.execute("DELETE FROM swarm_rollups")
+        with conn.cursor(name="rollup_backfill") as rows:
+            rows.itersize = 5000
+            rows.execute(f"/* rollups.backfill */ SELECT {', '.join(columns)} FROM swarm_requests")
+            for row in rows:
+                swarm = dict(zip(columns, row))
+                transitioned = [swarm] if swarm["status"] != "open" else []
+                responded = [swarm] if swarm["first_response_at"] else []
+                for key, value in deltas_for([swarm], transitioned, responded).items():
+                    deltas[key] = deltas.get(key, 0) + value
+        with conn.cursor() as cur:
+            apply_deltas(cur, deltas)
+    return len(deltas)
+
+
+# Hourly buckets are only read for the last day; keep a few weeks for ad-hoc queries
+def prune():
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            "/* rollups.prune */ DELETE FROM swarm_rollups WHERE granularity = 'hour' AND bucket < NOW() - %s * INTERVAL '1 day'",
+            (ROLLUP_HOURLY_RETENTION_DAYS,)
+        )
+        return cur.rowcount
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:] == ["backfill"]:
+        logging.info(f"Rebuilt {backfill()} swarm_rollups rows")
+    elif sys.argv[1:] == ["prune"]:
+        logging.info(f"Pruned {prune()} hourly swarm_rollups rows")
+    else:
+        sys.exit("usage: python rollups.py backfill|prune")
@@ -0,0 +1,188 @@
+import logging
+
+from blocks import SKILL_GROUPS
+from db import get_db_connection
+
+
+# Idempotent DDL for everything the app stores. Run `python schema.py` after a deploy.
+SCHEMA_STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS swarm_requests (
+        id SERIAL PRIMARY KEY,
+        ticket TEXT,
+        entitlement TEXT,
+        skill_group TEXT,
+        support_tier TEXT,
+        priority TEXT,
+        issue_description TEXT,
+        help_required TEXT,
+        user_id TEXT,
+        channel_id TEXT,
+        message_ts TEXT,
+        status TEXT NOT NULL DEFAULT 'open',
+        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    )
+    """,
+    # Lifecycle lookups and button clicks address a swarm by the message it was posted as
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS swarm_requests_channel_message_ts_idx
+    ON swarm_requests (channel_id, message_ts)
+    """,
+    # When the stale-swarm sweeper last nudged an open swarm's thread
+    """
+    ALTER TABLE swarm_requests ADD COLUMN IF NOT EXISTS last_reminded_at TIMESTAMPTZ
+    """,
+    # The sweeper only ever looks at open swarms, which stay a small slice of the table
+    """
+    CREATE INDEX IF NOT EXISTS swarm_requests_open_priority_updated_at_idx
+    ON swarm_requests (priority, updated_at) WHERE status = 'open'
+    """,
+    # The Home tab pages through open swarms per requester and per skill group, newest first
+    """
+    CREATE INDEX IF NOT EXISTS swarm_requests_open_user_id_id_idx
+    ON swarm_requests (user_id, id) WHERE status = 'open'
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS swarm_requests_open_skill_group_id_idx
+    ON swarm_requests (skill_group, id) WHERE status = 'open'
+    """,
+    # The ticket autocomplete index catches up on swarms changed since its last refresh
+    """
+    CREATE INDEX IF NOT EXISTS swarm_requests_updated_at_id_idx ON swarm_requests (updated_at, id)
+    """,
+    # Skill groups offered in the create modal; add rows (or set active = FALSE) to change the list
+    """
+    CREATE TABLE IF NOT EXISTS skill_groups (
+        name TEXT PRIMARY KEY,
+        position INT NOT NULL DEFAULT 0,
+        active BOOLEAN NOT NULL DEFAULT TRUE
+    )
+    """,
+    f"""
+    INSERT INTO skill_groups (name, position)
+    VALUES {", ".join(f"('{name}', {position})" for position, name in enumerate(SKILL_GROUPS))}
+    ON CONFLICT (name) DO NOTHING
+    """,
+    # Workspace a swarm was posted from, so background jobs can pick its bot token
+    """
+    ALTER TABLE swarm_requests ADD COLUMN IF NOT EXISTS enterprise_id TEXT,
+                               ADD COLUMN IF NOT EXISTS team_id TEXT
+    """,
+    # Full-text search over past swarms for /swarmsearch, weighted ticket > description > help
+    """
+    ALTER TABLE swarm_requests ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', COALESCE(ticket, '')), 'A') ||
+        setweight(to_tsvector('english', COALESCE(issue_description, '')), 'B') ||
+        setweight(to_tsvector('english', COALESCE(help_required, '')), 'C')
+    ) STORED
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS swarm_requests_search_vector_idx
+    ON swarm_requests USING GIN (search_vector)
+    """,
+    # Replies in a swarm's thread from anyone but its requester, recorded by the journal. The
+    # first response, reply count and helpers are kept on the swarm alongside, for rendering.
+    """
+    CREATE TABLE IF NOT EXISTS swarm_replies (
+        swarm_id INT NOT NULL REFERENCES swarm_requests (id) ON DELETE CASCADE,
+        reply_ts TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        replied_at TIMESTAMPTZ NOT NULL,
+        PRIMARY KEY (swarm_id, reply_ts)
+    )
+    """,
+    """
+    ALTER TABLE swarm_requests ADD COLUMN IF NOT EXISTS first_response_at TIMESTAMPTZ,
+                               ADD COLUMN IF NOT EXISTS first_responder_id TEXT,
+                               ADD COLUMN IF NOT EXISTS reply_count INT NOT NULL DEFAULT 0,
+                               ADD COLUMN IF NOT EXISTS participants TEXT[] NOT NULL DEFAULT '{}'
+    """,
+    # Per-status counters, globally (user_id = '*') and per requester, maintained by stats.py
+    """
+    CREATE TABLE IF NOT EXISTS swarm_stats (
+        user_id TEXT NOT NULL,
+        status TEXT NOT NULL,
+        count BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, status)
+    )
+    """,
+    # The Home tab's leaderboard reads the top of the resolved counters
+    """
+    CREATE INDEX IF NOT EXISTS swarm_stats_status_count_idx ON swarm_stats (status, count DESC)
+    """,
+    # Skill groups each user follows on the Home tab
+    """
+    CREATE TABLE IF NOT EXISTS user_skill_groups (
+        user_id TEXT NOT NULL,
+        skill_group TEXT NOT NULL,
+        PRIMARY KEY (user_id, skill_group)
+    )
+    """,
+    # Hourly and daily analytics buckets per skill group, entitlement, support tier and priority,
+    # maintained by rollups.py alongside every create and transition
+    """
+    CREATE TABLE IF NOT EXISTS swarm_rollups (
+        granularity TEXT NOT NULL,
+        bucket TIMESTAMPTZ NOT NULL,
+        skill_group TEXT NOT NULL,
+        entitlement TEXT NOT NULL,
+        support_tier TEXT NOT NULL,
+        priority TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        value BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (granularity, bucket, skill_group, entitlement, support_tier, priority, metric)
+    )
+    """,
+    # OAuth installs for multi-workspace mode, kept by installations.py. Org-wide installs have
+    # team_id '' and single workspaces enterprise_id ''.
+    """
+    CREATE TABLE IF NOT EXISTS slack_installations (
+        client_id TEXT NOT NULL,
+        enterprise_id TEXT NOT NULL,
+        team_id TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        data JSONB NOT NULL,
+        installed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (client_id, enterprise_id, team_id, user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS slack_bots (
+        client_id TEXT NOT NULL,
+        enterprise_id TEXT NOT NULL,
+        team_id TEXT NOT NULL,
+        data JSONB NOT NULL,
+        installed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (client_id, enterprise_id, team_id)
+    )
+    """,
+    # Losing an OAuth state only means an install in progress has to be started again
+    """
+    CREATE UNLOGGED TABLE IF NOT EXISTS slack_oauth_states (
+        state TEXT PRIMARY KEY,
+        expires_at TIMESTAMPTZ NOT NULL
+    )
+    """,
+    # Slack deliveries already handled, shared across workers when DEDUP_BACKEND=postgres.
+    # Losing it in a crash only means a retry may run twice, so it skips the WAL.
+    """
+    CREATE UNLOGGED TABLE IF NOT EXISTS slack_deliveries (
+        key TEXT PRIMARY KEY,
+        expires_at TIMESTAMPTZ NOT NULL
+    )
+    """,
+]
+
+
+def apply_schema():
+    with get_db_connection() as conn, conn.cursor() as cur:
+        for statement in SCHEMA_STATEMENTS:
+            cur.execute(statement)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    apply_schema()
+    logging.info("Schema is up to date")
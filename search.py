@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import shlex
+import threading
+from collections import OrderedDict
+
+from autocomplete import option_index
+from blocks import PRIORITIES
+from db import get_read_connection
+from slack_dispatch import slack, team_of
+from stats import STATUSES
+
+
+SEARCH_PAGE_SIZE = int(os.environ.get("SEARCH_PAGE_SIZE", 5))
+SEARCH_CACHE_TTL = int(os.environ.get("SEARCH_CACHE_TTL", 60))
+SEARCH_CACHE_MAX_SIZE = int(os.environ.get("SEARCH_CACHE_MAX_SIZE", 500))
+# Keeps a pathological query from eating the slash command's 3 second budget
+SEARCH_TIMEOUT_MS = int(os.environ.get("SEARCH_TIMEOUT_MS", 2000))
+
+# Filter keywords accepted in the command text -> (column, allowed values, or a function returning them)
+FILTERS = {
+    "skill": ("skill_group", option_index.skill_groups),
+    "skill_group": ("skill_group", option_index.skill_groups),
+    "priority": ("priority", PRIORITIES),
+    "status": ("status", STATUSES),
+}
+
+# Ranked by relevance, then newest first. Pages continue after the (rank, id) of the last row
+# shown; rank is real, so the cursor is compared as real too or equal ranks would be skipped.
+_SEARCH_SQL = """
+    /* search.swarms */
+    SELECT id, ticket, skill_group, priority, status, channel_id, message_ts, created_at, rank,
+           ts_headline('english', issue_description, query,
+                       'StartSel=*, StopSel=*, MaxWords=30, MinWords=10, MaxFragments=1') AS headline
+    FROM (
+        SELECT s.*, q.query, ts_rank_cd(s.search_vector, q.query) AS rank
+        FROM swarm_requests AS s, websearch_to_tsquery('english', %(text)s) AS q (query)
+        WHERE (%(text)s = '' OR s.search_vector @@ q.query)
+          AND (%(skill_group)s IS NULL OR s.skill_group = %(skill_group)s)
+          AND (%(priority)s IS NULL OR s.priority = %(priority)s)
+          AND (%(status)s IS NULL OR s.status = %(status)s)
+    ) AS matches
+    WHERE %(after_rank)s IS NULL OR (rank, id) < (%(after_rank)s::real, %(after_id)s)
+    ORDER BY rank DESC, id DESC
+    LIMIT %(limit)s
+"""
+
+SEARCH_COLUMNS = (
+    "id", "ticket", "skill_group", "priority", "status", "channel_id", "message_ts", "created_at", "rank", "headline",
+)
+
+
+class SearchError(ValueError):
+    pass
+
+
+# Split command text such as `timeout priority:High skill:"Platform/Web Services"` into
+# (search text, {column: value}). Filter values are matched case-insensitively.
+def parse_query(text):
+    try:
+        words = shlex.split(text or "")
+    except ValueError:
+        words = (text or "").split()
+    terms, filters = [], {}
+    for word in words:
+        keyword, _, value = word.partition(":")
+        if value and keyword.lower() in FILTERS:
+            column, allowed = FILTERS[keyword.lower()]
+            if callable(allowed):
+                allowed = allowed()
+            match = next((option for option in allowed if option.lower() == value.lower()), None)
+            if match is None:
+                raise SearchError(f"Unknown {keyword} `{value}`. Try one of: {', '.join(allowed)}")
+            filters[column] = match
+        else:
+            terms.append(word)
+    return " ".join(terms), filters
+
+
+# Short-lived cache of result pages, so a repeated search (or someone paging back and forth)
+# skips the database. Pages can be up to SEARCH_CACHE_TTL seconds stale.
+class SearchCache:
+    def __init__(self, ttl=SEARCH_CACHE_TTL, max_size=SEARCH_CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, rows = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return rows
+
+    def put(self, key, rows):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, rows)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+search_cache = SearchCache()
+
+
+# One page of results, plus whether there is another one after it
+def search(text, filters, after=None):
+    key = (text.lower(), tuple(sorted(filters.items())), tuple(after) if after else None)
+    cached = search_cache.get(key)
+    if cached is not None:
+        return cached
+
+    params = {
+        "text": text,
+        "skill_group": filters.get("skill_group"),
+        "priority": filters.get("priority"),
+        "status": filters.get("status"),
+        "after_rank": after[0] if after else None,
+        "after_id": after[1] if after else None,
+        "limit": SEARCH_PAGE_SIZE + 1,
+    }
+    with get_read_connection() as conn, conn.cursor() as cur:
+        cur.execute("SET LOCAL statement_timeout = %s", (SEARCH_TIMEOUT_MS,))
+        cur.execute(_SEARCH_SQL, params)
+        rows = [dict(zip(SEARCH_COLUMNS, row)) for row in cur.fetchall()]
+
+    page = (rows[:SEARCH_PAGE_SIZE], len(rows) > SEARCH_PAGE_SIZE)
+    search_cache.put(key, page)
+    return page
+
+
+_workspace_urls = {}
+
+
+# Message permalinks built from the workspace URL, which costs one auth.test per workspace and
+# process instead of a chat.getPermalink call per result
+def permalink(client, channel_id, message_ts):
+    team_id = team_of(client)
+    workspace_url = _workspace_urls.get(team_id)
+    if workspace_url is None:
+        workspace_url = _workspace_urls[team_id] = slack.call(client, "auth_test")["url"]
+    return f"{workspace_url}archives/{channel_id}/p{message_ts.replace('.', '')}"
+
+
+async def permalink_async(client, channel_id, message_ts):
+    team_id = team_of(client)
+    workspace_url = _workspace_urls.get(team_id)
+    if workspace_url is None:
+        workspace_url = _workspace_urls[team_id] = (await slack.call_async(client, "auth_test"))["url"]
+    return f"{workspace_url}archives/{channel_id}/p{message_ts.replace('.', '')}"
+
+
+def _escape(text):
+    return (text or "").replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+# Ephemeral result message; the "Next" button carries the query and the keyset cursor
+def render_results(client, text, filters, rows, has_more):
+    described = " ".join([text] + [f"{column}:{value}" for column, value in filters.items()]).strip()
+    if not rows:
+        return [{"type": "section", "text": {"type": "mrkdwn", "text": f"No swarm requests match `{_escape(described)}`."}}]
+
+    blocks = [{"type": "section", "text": {"type": "mrkdwn", "text": f"Swarm requests matching `{_escape(described)}`:"}}]
+    for row in rows:
+        title = f"Ticket {_escape(row['ticket'])}"
+        if row["message_ts"]:
+            title = f"<{permalink(client, row['channel_id'], row['message_ts'])}|{title}>"
+        blocks.append({
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*{title}* · {row['priority']} · {row['skill_group']} · {row['status']} · "
+                        f"{row['created_at']:%Y-%m-%d}\n{_escape(row['headline'])}"
+            }
+        })
+    if has_more:
+        last = rows[-1]
+        blocks.append({
+            "type": "actions",
+            "elements": [{
+                "type": "button",
+                "text": {"type": "plain_text", "text": "Next results"},
+                "action_id": "swarmsearch_next",
+                "value": json.dumps({"q": text, "f": filters, "after": [last["rank"], last["id"]]}),
+            }]
+        })
+    return blocks
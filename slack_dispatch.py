@@ -0,0 +1,320 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+from slack_sdk.http_retry.builtin_handlers import ConnectionErrorRetryHandler, RateLimitErrorRetryHandler
+
+from metrics import current_listener, registry, slack_api_seconds
+
+
+# Slack's published per-workspace limits, in calls per minute, for the methods this app uses
+TIER_1, TIER_2, TIER_3, TIER_4 = 1, 20, 50, 100
+METHOD_LIMITS = {
+    "chat.postMessage": 60,  # "special" tier: roughly one message per second per channel
+    "chat.update": TIER_3,
+    "chat.getPermalink": TIER_4,
+    "files.completeUploadExternal": TIER_4,
+    "files.getUploadURLExternal": TIER_4,
+    "pins.add": TIER_2,
+    "pins.remove": TIER_2,
+    "users.info": TIER_4,
+    "users.list": TIER_2,
+    "views.open": TIER_4,
+    "views.publish": TIER_4,
+}
+DEFAULT_LIMIT = TIER_3
+
+# Fraction of each limit this process may use; lower it when several workers or dynos share a workspace
+SLACK_RATE_SCALE = float(os.environ.get("SLACK_RATE_SCALE", 1.0))
+SLACK_MAX_RETRIES = int(os.environ.get("SLACK_MAX_RETRIES", 2))
+# Only overridden to point the app at a stand-in Slack API, e.g. in bench/loadtest.py
+SLACK_API_URL = os.environ.get("SLACK_API_URL", WebClient.BASE_URL)
+
+
+def method_of(url):
+    return url.rstrip("/").rsplit("/", 1)[-1]
+
+
+# Workspace a client was built for (Bolt sets it on per-request clients), None for SLACK_BOT_TOKEN's
+def team_of(client):
+    return client.default_params.get("team_id")
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = max(per_minute * SLACK_RATE_SCALE, 1)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    # Take a token if one is available; otherwise returns how long to wait before trying again
+    def _take(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if now >= self.paused_until and self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return max(self.paused_until - now, (1 - self.tokens) / self.rate)
+
+    # Take a token, sleeping until one is available; returns True if the caller had to wait
+    def acquire(self):
+        waited = False
+        while delay := self._take():
+            waited = True
+            time.sleep(delay)
+        return waited
+
+    # acquire() for coroutines, which must not block the event loop while they wait
+    async def acquire_async(self):
+        waited = False
+        while delay := self._take():
+            waited = True
+            await asyncio.sleep(delay)
+        return waited
+
+    # Slack told us to back off (Retry-After); stop handing out tokens until then
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+class _CountingRateLimitRetryHandler(RateLimitErrorRetryHandler):
+    def __init__(self, dispatcher, **kwargs):
+        super().__init__(**kwargs)
+        self.dispatcher = dispatcher
+
+    # Bolt deep-copies requests (and their clients) for lazy listeners; keep sharing the dispatcher
+    def __deepcopy__(self, memo):
+        return self
+
+    def prepare_for_next_attempt(self, *, state, request, response=None, error=None):
+        if response is not None:
+            retry_after = next((v[0] for k, v in response.headers.items() if k.lower() == "retry-after"), 1)
+            self.dispatcher.pause(method_of(request.url), int(retry_after))
+        self.dispatcher.count("rate_limited")
+        self.dispatcher.count("retried")
+        super().prepare_for_next_attempt(state=state, request=request, response=response, error=error)
+
+
+class _CountingConnectionErrorRetryHandler(ConnectionErrorRetryHandler):
+    def __init__(self, dispatcher, **kwargs):
+        super().__init__(**kwargs)
+        self.dispatcher = dispatcher
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def prepare_for_next_attempt(self, *, state, request, response=None, error=None):
+        self.dispatcher.count("retried")
+        super().prepare_for_next_attempt(state=state, request=request, response=response, error=error)
+
+
+# Record a Slack call's latency since started (so token bucket waits count), labelled with
+# its error code, "ok" on success
+def _timed(method, started, send):
+    error = "ok"
+    try:
+        return send()
+    except SlackApiError as e:
+        error = e.response.get("error", "unknown")
+        raise
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        slack_api_seconds.observe(time.perf_counter() - started, method, error, current_listener.get())
+
+
+async def _timed_async(method, started, send):
+    error = "ok"
+    try:
+        return await send()
+    except SlackApiError as e:
+        error = e.response.get("error", "unknown")
+        raise
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        slack_api_seconds.observe(time.perf_counter() - started, method, error, current_listener.get())
+
+
+class _PendingUpdate:
+    def __init__(self, client, kwargs):
+        self.latest = (client, kwargs)
+
+
+# All outbound Slack Web API calls go through here.
+# Each method draws from a token bucket sized to its Slack tier (one per workspace, as Slack's
+# limits are), 429s and connection errors are
+# retried by slack_sdk's retry handlers, and chat.update calls for the same message are coalesced
+# so only the latest render is sent.
+class SlackDispatcher:
+    def __init__(self):
+        self._buckets = {}
+        self._pending_updates = {}
+        self._counters = dict.fromkeys(("calls", "throttled", "retried", "rate_limited", "coalesced"), 0)
+        self._lock = threading.Lock()
+
+    def retry_handlers(self):
+        return [
+            _CountingRateLimitRetryHandler(self, max_retry_count=SLACK_MAX_RETRIES),
+            _CountingConnectionErrorRetryHandler(self, max_retry_count=SLACK_MAX_RETRIES),
+        ]
+
+    # WebClient for App(client=...); Bolt copies its retry handlers onto every per-request client
+    # and sets its team_id, which picks the workspace's token buckets
+    def build_client(self, token, team_id=None):
+        return WebClient(token=token, base_url=SLACK_API_URL, team_id=team_id, retry_handlers=self.retry_handlers())
+
+    def bucket(self, method, team_id=None):
+        key = (team_id, method)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.setdefault(key, TokenBucket(METHOD_LIMITS.get(method, DEFAULT_LIMIT)))
+        return bucket
+
+    # A 429 doesn't say which workspace it was for, so every workspace's bucket for the method backs off
+    def pause(self, method, seconds):
+        with self._lock:
+            buckets = [bucket for (_, bucket_method), bucket in self._buckets.items() if bucket_method == method]
+        for bucket in buckets:
+            bucket.pause(seconds)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    # Call a WebClient method by its Python name, e.g. call(client, "pins_add", channel=..., timestamp=...)
+    def call(self, client, method_name, **kwargs):
+        method = method_name.replace("_", ".", 1)
+        started = time.perf_counter()
+        if self.bucket(method, team_of(client)).acquire():
+            self.count("throttled")
+        self.count("calls")
+        return _timed(method, started, lambda: getattr(client, method_name)(**kwargs))
+
+    # call() for an AsyncWebClient, awaited by the asyncio runtime (async_app.py)
+    async def call_async(self, client, method_name, **kwargs):
+        method = method_name.replace("_", ".", 1)
+        started = time.perf_counter()
+        if await self.bucket(method, team_of(client)).acquire_async():
+            self.count("throttled")
+        self.count("calls")
+        return await _timed_async(method, started, lambda: getattr(client, method_name)(**kwargs))
+
+    def chat_postMessage(self, client, **kwargs):
+        return self.call(client, "chat_postMessage", **kwargs)
+
+    def pins_add(self, client, **kwargs):
+        return self.call(client, "pins_add", **kwargs)
+
+    def pins_remove(self, client, **kwargs):
+        return self.call(client, "pins_remove", **kwargs)
+
+    def users_info(self, client, **kwargs):
+        return self.call(client, "users_info", **kwargs)
+
+    def users_list(self, client, **kwargs):
+        return self.call(client, "users_list", **kwargs)
+
+    def views_open(self, client, **kwargs):
+        return self.call(client, "views_open", **kwargs)
+
+    def views_publish(self, client, **kwargs):
+        return self.call(client, "views_publish", **kwargs)
+
+    # Only one thread sends updates for a given message at a time. Renders that arrive while it
+    # waits for a token or is mid-send replace any render still pending, and the sender keeps
+    # going until nothing newer is left. Returns None for a caller whose render was handed off.
+    def chat_update(self, client, channel, ts, **kwargs):
+        key = (channel, ts)
+        with self._lock:
+            pending = self._pending_updates.get(key)
+            if pending is not None:
+                if pending.latest is not None:
+                    self._counters["coalesced"] += 1
+                pending.latest = (client, kwargs)
+                return None
+            pending = self._pending_updates[key] = _PendingUpdate(client, kwargs)
+
+        response = None
+        while True:
+            with self._lock:
+                if pending.latest is None:
+                    del self._pending_updates[key]
+                    return response
+            started = time.perf_counter()
+            if self.bucket("chat.update", team_of(client)).acquire():
+                self.count("throttled")
+            with self._lock:
+                client, kwargs = pending.latest
+                pending.latest = None
+            self.count("calls")
+            try:
+                response = _timed("chat.update", started, lambda: client.chat_update(channel=channel, ts=ts, **kwargs))
+            except Exception:
+                with self._lock:
+                    if pending.latest is None:
+                        del self._pending_updates[key]
+                        raise
+                logging.warning(f"chat.update failed for {ts}, sending the newer render instead")
+
+    # chat_update() for an AsyncWebClient, coalescing the same way. Updates sent from threads
+    # and from the event loop share the pending renders, though a process only runs one runtime.
+    async def chat_update_async(self, client, channel, ts, **kwargs):
+        key = (channel, ts)
+        with self._lock:
+            pending = self._pending_updates.get(key)
+            if pending is not None:
+                if pending.latest is not None:
+                    self._counters["coalesced"] += 1
+                pending.latest = (client, kwargs)
+                return None
+            pending = self._pending_updates[key] = _PendingUpdate(client, kwargs)
+
+        response = None
+        while True:
+            with self._lock:
+                if pending.latest is None:
+                    del self._pending_updates[key]
+                    return response
+            started = time.perf_counter()
+            if await self.bucket("chat.update", team_of(client)).acquire_async():
+                self.count("throttled")
+            with self._lock:
+                client, kwargs = pending.latest
+                pending.latest = None
+            self.count("calls")
+            try:
+                response = await _timed_async(
+                    "chat.update", started, lambda: client.chat_update(channel=channel, ts=ts, **kwargs)
+                )
+            except Exception:
+                with self._lock:
+                    if pending.latest is None:
+                        del self._pending_updates[key]
+                        raise
+                logging.warning(f"chat.update failed for {ts}, sending the newer render instead")
+
+slack = SlackDispatcher()
+
+
+@registry.collector
+def _dispatcher_counters():
+    return [("swarm_slack_dispatcher_events_total", "Slack dispatcher calls, throttles, retries and coalesced updates",
+             ("event",), {(name,): value for name, value in slack.counters().items()})]
@@ -0,0 +1,44 @@
+import os
+import signal
+import logging
+import threading
+
+from slack_bolt.adapter.socket_mode import SocketModeHandler
+
+from db import close_pool
+from journal import journal
+
+
+# Slack spreads events across up to 10 open connections per app
+SOCKET_MODE_CONNECTIONS = int(os.environ.get("SOCKET_MODE_CONNECTIONS", 2))
+# Threads per connection that hand envelopes to Bolt
+SOCKET_MODE_CONCURRENCY = int(os.environ.get("SOCKET_MODE_CONCURRENCY", 10))
+
+
+# Serve the app's listeners over persistent WebSocket connections instead of inbound HTTP.
+# Each connection reconnects on its own if Slack drops or refreshes it. Blocks until SIGTERM/SIGINT.
+def start_socket_mode(app):
+    app_token = os.environ["SLACK_APP_TOKEN"]
+    handlers = [
+        SocketModeHandler(
+            app,
+            app_token,
+            concurrency=SOCKET_MODE_CONCURRENCY,
+            auto_reconnect_enabled=True,
+        )
+        for _ in range(SOCKET_MODE_CONNECTIONS)
+    ]
+    for handler in handlers:
+        handler.connect()
+    logging.info(f"Socket Mode connected with {len(handlers)} connections")
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    stopping.wait()
+
+    logging.info("Shutting down Socket Mode connections")
+    for handler in handlers:
+        handler.close()
+    journal.close()
+    close_pool()
@@ -0,0 +1,60 @@
+import sys
+import logging
+
+from db import get_db_connection
+
+
+# swarm_stats row that holds the workspace-wide totals
+GLOBAL = "*"
+STATUSES = ("open", "resolved", "discarded")
+
+
+# Returns ({status: count} for the workspace, {status: count} for user_id, and the top `limit`
+# requesters as [(user_id, resolved count)]). Reads a fixed number of rows however many users there are.
+def fetch_leaderboard(cur, user_id, limit):
+    cur.execute(
+        """
+        /* stats.leaderboard */
+        (SELECT user_id, status, count FROM swarm_stats WHERE user_id IN (%(global)s, %(user_id)s))
+        UNION ALL
+        (SELECT user_id, NULL, count FROM swarm_stats
+         WHERE status = 'resolved' AND user_id <> %(global)s AND count > 0
+         ORDER BY count DESC, user_id
+         LIMIT %(limit)s)
+        """,
+        {"global": GLOBAL, "user_id": user_id, "limit": limit}
+    )
+    totals = dict.fromkeys(STATUSES, 0)
+    mine = dict.fromkeys(STATUSES, 0)
+    leaders = []
+    for row_user_id, status, count in cur.fetchall():
+        if status is None:
+            leaders.append((row_user_id, count))
+        elif row_user_id == GLOBAL:
+            totals[status] = count
+        else:
+            mine[status] = count
+    return totals, mine, leaders
+
+
+# Rebuild every counter from swarm_requests. Holds a lock that blocks concurrent
+# counter updates (but not reads) so the rebuilt totals are exact.
+def reconcile():
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute("LOCK TABLE swarm_stats IN EXCLUSIVE MODE")
+        cur.execute("DELETE FROM swarm_stats")
+        cur.execute("""
+            INSERT INTO swarm_stats (user_id, status, count)
+            SELECT CASE WHEN GROUPING(user_id) = 1 THEN %s ELSE user_id END, status, COUNT(*)
+            FROM swarm_requests
+            GROUP BY GROUPING SETS ((user_id, status), (status))
+        """, (GLOBAL,))
+        cur.execute("SELECT COUNT(*) FROM swarm_stats")
+        return cur.fetchone()[0]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:] != ["reconcile"]:
+        sys.exit("usage: python stats.py reconcile")
+    logging.info(f"Rebuilt {reconcile()} swarm_stats rows")
@@ -0,0 +1,19 @@
+import os
+
+
+# Storage backend for the swarm lifecycle: "postgres" (default) or "memory", an in-process
+# stand-in for offline load tests. Both expose get_db_connection(), get_read_connection() for
+# read-only work that may go to a follower, note_writes(), the swarms.py repository functions,
+# stats.fetch_leaderboard() and rollups.summarize().
+SWARM_STORAGE = os.environ.get("SWARM_STORAGE", "postgres")
+
+if SWARM_STORAGE == "memory":
+    import memory_store as swarms
+    import memory_store as stats
+    import memory_store as rollups
+    from memory_store import get_db_connection, get_read_connection, note_writes
+else:
+    import swarms
+    import stats
+    import rollups
+    from db import get_db_connection, get_read_connection, note_writes
@@ -0,0 +1,314 @@
+from psycopg2.extras import execute_values
+
+import rollups
+from stats import GLOBAL
+
+
+# Allowed lifecycle transitions: action -> (statuses it may start from, resulting status)
+TRANSITIONS = {
+    "resolve": (("open",), "resolved"),
+    "discard": (("open",), "discarded"),
+    "reopen": (("resolved", "discarded"), "open"),
+}
+
+SWARM_COLUMNS = (
+    "id", "ticket", "entitlement", "skill_group", "support_tier", "priority",
+    "issue_description", "help_required", "user_id", "channel_id", "message_ts",
+    "status", "created_at", "updated_at", "enterprise_id", "team_id",
+    "first_response_at", "first_responder_id", "reply_count", "participants",
+)
+
+CREATE_FIELDS = (
+    "ticket", "entitlement", "skill_group", "support_tier", "priority",
+    "issue_description", "help_required", "user_id", "channel_id", "message_ts",
+    "enterprise_id", "team_id",
+)
+
+# The inserts and their counter bumps run as one statement, so a batch of creates is a single
+# round trip. Re-inserting an already stored message (e.g. a replayed journal) is a no-op.
+_CREATE_SQL = f"""
+    /* swarms.create */
+    WITH created AS (
+        INSERT INTO swarm_requests ({", ".join(CREATE_FIELDS)})
+        VALUES %s
+        ON CONFLICT (channel_id, message_ts) DO NOTHING
+        RETURNING {", ".join(SWARM_COLUMNS)}
+    ), counted AS (
+        INSERT INTO swarm_stats (user_id, status, count)
+        SELECT scopes.scope, created.status, COUNT(*)
+        FROM created, LATERAL (VALUES ('{GLOBAL}'), (created.user_id)) AS scopes(scope)
+        GROUP BY scopes.scope, created.status
+        ON CONFLICT (user_id, status) DO UPDATE
+        SET count = swarm_stats.count + EXCLUDED.count
+    )
+    SELECT {", ".join(SWARM_COLUMNS)} FROM created
+"""
+
+# Guarded transitions: each row is locked and re-checked against its allowed source statuses,
+# so of two concurrent clicks only one matches. The counters move in the same statement.
+# A single statement can only move a given swarm once, so callers batch distinct messages only.
+_TRANSITION_SQL = f"""
+    /* swarms.transition */
+    WITH requested (channel_id, message_ts, to_status, from_statuses) AS (
+        VALUES %s
+    ), previous AS (
+        SELECT s.id, s.status, requested.to_status
+        FROM swarm_requests AS s
+        JOIN requested ON s.channel_id = requested.channel_id AND s.message_ts = requested.message_ts
+        WHERE s.status = ANY(requested.from_statuses)
+        FOR UPDATE OF s
+    ), updated AS (
+        UPDATE swarm_requests AS s
+        SET status = previous.to_status, updated_at = NOW()
+        FROM previous
+        WHERE s.id = previous.id
+        RETURNING {", ".join("s." + column for column in SWARM_COLUMNS)}, previous.status AS previous_status
+    ), counted AS (
+        INSERT INTO swarm_stats (user_id, status, count)
+        SELECT deltas.scope, deltas.status, SUM(deltas.delta)
+        FROM updated, LATERAL (VALUES
+            ('{GLOBAL}', updated.previous_status, -1), ('{GLOBAL}', updated.status, 1),
+            (updated.user_id, updated.previous_status, -1), (updated.user_id, updated.status, 1)
+        ) AS deltas(scope, status, delta)
+        GROUP BY deltas.scope, deltas.status
+        ON CONFLICT (user_id, status) DO UPDATE
+        SET count = swarm_stats.count + EXCLUDED.count
+    )
+    SELECT {", ".join(SWARM_COLUMNS)}, previous_status FROM updated
+"""
+
+
+# Replies are inserted once per (swarm, reply ts), so a redelivered event or a replayed journal
+# counts nothing twice. Only replies to open swarms by someone but the requester count. The swarm's reply count, first response and helpers (in the order they
+# first replied) move in the same statement, as do the counters for transitions above.
+_REPLIES_SQL = f"""
+    /* swarms.record_replies */
+    WITH incoming (channel_id, message_ts, reply_ts, user_id) AS (
+        VALUES %s
+    ), inserted AS (
+        INSERT INTO swarm_replies (swarm_id, reply_ts, user_id, replied_at)
+        SELECT s.id, incoming.reply_ts, incoming.user_id, to_timestamp(incoming.reply_ts::double precision)
+        FROM incoming
+        JOIN swarm_requests AS s ON s.channel_id = incoming.channel_id AND s.message_ts = incoming.message_ts
+        WHERE s.status = 'open' AND s.user_id <> incoming.user_id
+        ON CONFLICT (swarm_id, reply_ts) DO NOTHING
+        RETURNING swarm_id, user_id, replied_at
+    ), responders AS (
+        SELECT swarm_id, user_id, MIN(replied_at) AS replied_at, COUNT(*) AS replies
+        FROM inserted
+        GROUP BY swarm_id, user_id
+    ), batch AS (
+        SELECT swarm_id, SUM(replies) AS replies, MIN(replied_at) AS first_at,
+               ARRAY_AGG(user_id ORDER BY replied_at) AS users
+        FROM responders
+        GROUP BY swarm_id
+    ), previous AS (
+        SELECT s.id, s.first_response_at
+        FROM swarm_requests AS s
+        JOIN batch ON s.id = batch.swarm_id
+        FOR UPDATE OF s
+    ), updated AS (
+        UPDATE swarm_requests AS s
+        SET reply_count = s.reply_count + batch.replies,
+            first_response_at = LEAST(s.first_response_at, batch.first_at),
+            first_responder_id = CASE WHEN s.first_response_at IS NULL OR batch.first_at < s.first_response_at
+                                      THEN batch.users[1] ELSE s.first_responder_id END,
+            participants = s.participants || ARRAY(
+                SELECT u.user_id FROM unnest(batch.users) WITH ORDINALITY AS u (user_id, position)
+                WHERE u.user_id <> ALL(s.participants)
+                ORDER BY u.position
+            )
+        FROM batch, previous
+        WHERE s.id = batch.swarm_id AND s.id = previous.id
+        RETURNING {", ".join("s." + column for column in SWARM_COLUMNS)}, previous.first_response_at IS NULL AS first_response
+    )
+    SELECT {", ".join(SWARM_COLUMNS)}, first_response FROM updated
+"""
+
+
+def _to_dict(columns, row):
+    return dict(zip(columns, row)) if row else None
+
+
+# Insert swarms given as dicts of CREATE_FIELDS; returns the rows actually inserted
+def create_swarms(cur, swarms):
+    if not swarms:
+        return []
+    rows = execute_values(
+        cur,
+        _CREATE_SQL,
+        [tuple(swarm[field] for field in CREATE_FIELDS) for swarm in swarms],
+        page_size=len(swarms),
+        fetch=True,
+    )
+    created = [_to_dict(SWARM_COLUMNS, row) for row in rows]
+    rollups.record(cur, created=created)
+    return created
+
+
+def create_swarm(cur, **swarm):
+    created = create_swarms(cur, [swarm])
+    return created[0] if created else None
+
+
+# Apply lifecycle actions given as (channel_id, message_ts, action) with distinct messages.
+# Returns {(channel_id, message_ts): updated swarm with previous_status} for those that matched.
+def transition_many(cur, requests):
+    if not requests:
+        return {}
+    values = []
+    for channel_id, message_ts, action in requests:
+        from_statuses, to_status = TRANSITIONS[action]
+        values.append((channel_id, message_ts, to_status, list(from_statuses)))
+    rows = execute_values(
+        cur,
+        _TRANSITION_SQL,
+        values,
+        template="(%s::text, %s::text, %s::text, %s::text[])",
+        page_size=len(values),
+        fetch=True,
+    )
+    columns = SWARM_COLUMNS + ("previous_status",)
+    updated = [_to_dict(columns, row) for row in rows]
+    rollups.record(cur, transitioned=updated)
+    return {(swarm["channel_id"], swarm["message_ts"]): swarm for swarm in updated}
+
+
+# Apply a lifecycle action to the swarm posted at (channel_id, message_ts).
+# Returns the updated swarm (with its previous_status), or None if no swarm there allows the action.
+def transition(cur, channel_id, message_ts, action):
+    return transition_many(cur, [(channel_id, message_ts, action)]).get((channel_id, message_ts))
+
+
+# Record thread replies given as (channel_id, message_ts of the swarm, reply_ts, user_id).
+# Returns {(channel_id, message_ts): updated swarm} for the swarms that gained replies; replies
+# already stored, by the requester, to swarms that aren't open, or not stored (yet), change nothing.
+def record_replies(cur, replies):
+    if not replies:
+        return {}
+    rows = execute_values(
+        cur,
+        _REPLIES_SQL,
+        list(replies),
+        template="(%s::text, %s::text, %s::text, %s::text)",
+        page_size=len(replies),
+        fetch=True,
+    )
+    updated = [_to_dict(SWARM_COLUMNS + ("first_response",), row) for row in rows]
+    rollups.record(cur, responded=[swarm for swarm in updated if swarm["first_response"]])
+    return {(swarm["channel_id"], swarm["message_ts"]): swarm for swarm in updated}
+
+
+# Which of the given (channel_id, message_ts) keys have a stored swarm
+def existing_keys(cur, keys):
+    if not keys:
+        return set()
+    rows = execute_values(
+        cur,
+        """
+        /* swarms.existing_keys */
+        SELECT s.channel_id, s.message_ts
+        FROM swarm_requests AS s
+        JOIN (VALUES %s) AS k (channel_id, message_ts)
+          ON s.channel_id = k.channel_id AND s.message_ts = k.message_ts
+        """,
+        list(keys),
+        template="(%s::text, %s::text)",
+        page_size=len(keys),
+        fetch=True,
+    )
+    return set(rows)
+
+
+def get_swarm(cur, channel_id, message_ts):
+    cur.execute(
+        f"/* swarms.get_swarm */ SELECT {', '.join(SWARM_COLUMNS)} FROM swarm_requests WHERE channel_id = %s AND message_ts = %s",
+        (channel_id, message_ts)
+    )
+    return _to_dict(SWARM_COLUMNS, cur.fetchone())
+
+
+# Open swarms for the Home tab, newest first: one requester's (user_id), or those in skill_groups
+# raised by anyone but exclude_user_id. Pages are keyset bounded by id: before_id continues
+# after the last row shown, min_id re-reads everything down to it.
+def list_open(cur, user_id=None, skill_groups=None, exclude_user_id=None, min_id=None, before_id=None, limit=10):
+    cur.execute(
+        f"""
+        /* swarms.list_open */
+        SELECT {", ".join(SWARM_COLUMNS)}
+        FROM swarm_requests
+        WHERE status = 'open'
+          AND (%(user_id)s::text IS NULL OR user_id = %(user_id)s)
+          AND (%(skill_groups)s::text[] IS NULL OR skill_group = ANY(%(skill_groups)s))
+          AND (%(exclude_user_id)s::text IS NULL OR user_id <> %(exclude_user_id)s)
+          AND (%(min_id)s::int IS NULL OR id >= %(min_id)s)
+          AND (%(before_id)s::int IS NULL OR id < %(before_id)s)
+        ORDER BY id DESC
+        LIMIT %(limit)s
+        """,
+        {
+            "user_id": user_id,
+            "skill_groups": list(skill_groups) if skill_groups is not None else None,
+            "exclude_user_id": exclude_user_id,
+            "min_id": min_id,
+            "before_id": before_id,
+            "limit": limit,
+        }
+    )
+    return [_to_dict(SWARM_COLUMNS, row) for row in cur.fetchall()]
+
+
+# Skill groups a user follows on the Home tab
+def followed_skill_groups(cur, user_id):
+    cur.execute(
+        "/* swarms.followed_skill_groups */ SELECT skill_group FROM user_skill_groups WHERE user_id = %s ORDER BY skill_group",
+        (user_id,)
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def follow_skill_groups(cur, user_id, skill_groups):
+    cur.execute("/* swarms.unfollow_skill_groups */ DELETE FROM user_skill_groups WHERE user_id = %s", (user_id,))
+    if skill_groups:
+        execute_values(
+            cur,
+            "/* swarms.follow_skill_groups */ INSERT INTO user_skill_groups (user_id, skill_group) VALUES %s",
+            [(user_id, skill_group) for skill_group in skill_groups],
+        )
+
+
+# Swarms changed since the (updated_at, id) cursor, oldest change first, for the ticket
+# autocomplete index to apply incrementally
+def ticket_changes(cur, since, after_id=0, limit=1000):
+    cur.execute(
+        """
+        /* swarms.ticket_changes */
+        SELECT id, ticket, channel_id, message_ts, status, updated_at
+        FROM swarm_requests
+        WHERE (updated_at, id) > (%s, %s) AND ticket IS NOT NULL
+        ORDER BY updated_at, id
+        LIMIT %s
+        """,
+        (since, after_id, limit)
+    )
+    return [_to_dict(("id", "ticket", "channel_id", "message_ts", "status", "updated_at"), row) for row in cur.fetchall()]
+
+
+# Skill groups offered in the create modal, as configured in the skill_groups table
+def list_skill_groups(cur):
+    cur.execute("/* swarms.list_skill_groups */ SELECT name FROM skill_groups WHERE active ORDER BY position, name")
+    return [row[0] for row in cur.fetchall()]
+
+
+# Threads of every open swarm with its requester and helpers so far, for the reply index in
+# thread_activity.py. Served by the partial indexes on open swarms.
+def open_threads(cur):
+    cur.execute(
+        """
+        /* swarms.open_threads */
+        SELECT channel_id, message_ts, user_id, participants
+        FROM swarm_requests
+        WHERE status = 'open' AND message_ts IS NOT NULL
+        """
+    )
+    return [_to_dict(("channel_id", "message_ts", "user_id", "participants"), row) for row in cur.fetchall()]
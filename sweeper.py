@@ -0,0 +1,194 @@
+import os
+import time
+import logging
+import threading
+
+import schedule
+from psycopg2.extras import execute_values
+from slack_sdk.errors import SlackApiError
+
+import rollups
+import storage
+import swarms
+from blocks import PRIORITIES, render_swarm_message
+from db import get_db_connection
+from installations import client_for
+from metrics import current_listener
+from slack_dispatch import slack
+
+
+def _hours_by_priority(value):
+    hours = {}
+    for pair in value.split(","):
+        if "=" in pair:
+            priority, amount = pair.split("=", 1)
+            hours[priority.strip()] = float(amount)
+    return hours
+
+
+SWEEPER_ENABLED = os.environ.get("SWEEPER_ENABLED", "true").lower() == "true"
+SWEEP_INTERVAL_MINUTES = int(os.environ.get("SWEEP_INTERVAL_MINUTES", 15))
+# Most stale swarms handled per sweep; the rest wait for the next one
+SWEEP_BATCH_SIZE = int(os.environ.get("SWEEP_BATCH_SIZE", 50))
+# Hours an open swarm may go without an update before its thread gets a reminder, and again
+# after each further period of that length
+STALE_AFTER_HOURS = _hours_by_priority(os.environ.get(
+    "STALE_AFTER_HOURS", "Critical=1,Urgent=4,High=12,Normal=24,Low=72"
+))
+# Hours after which an open swarm is discarded automatically; priorities left out never expire
+EXPIRE_AFTER_HOURS = _hours_by_priority(os.environ.get("EXPIRE_AFTER_HOURS", ""))
+# Any constant shared by every dyno; only the one holding it runs a given sweep
+SWEEP_LOCK_ID = int(os.environ.get("SWEEP_LOCK_ID", 7420016))
+
+# Claims a batch of stale open swarms by stamping last_reminded_at, so a swarm is reminded once
+# per stale period however many dynos sweep. Served by the partial index on open swarms.
+_CLAIM_STALE_SQL = f"""
+    /* sweeper.claim_stale */
+    WITH thresholds (priority, stale_after, expire_after) AS (
+        VALUES %s
+    ), stale AS (
+        SELECT s.id, COALESCE(s.updated_at < NOW() - thresholds.expire_after, FALSE) AS expire
+        FROM swarm_requests AS s
+        JOIN thresholds ON s.priority = thresholds.priority
+        WHERE s.status = 'open'
+          AND s.message_ts IS NOT NULL
+          AND ((s.updated_at < NOW() - thresholds.stale_after
+                AND (s.last_reminded_at IS NULL OR s.last_reminded_at < NOW() - thresholds.stale_after))
+               OR s.updated_at < NOW() - thresholds.expire_after)
+        ORDER BY s.updated_at
+        LIMIT {SWEEP_BATCH_SIZE}
+        FOR UPDATE OF s SKIP LOCKED
+    )
+    UPDATE swarm_requests AS s
+    SET last_reminded_at = NOW()
+    FROM stale
+    WHERE s.id = stale.id
+    RETURNING {", ".join("s." + column for column in swarms.SWARM_COLUMNS)}, stale.expire
+"""
+
+
+def _hours_open(swarm):
+    return int((time.time() - swarm["updated_at"].timestamp()) // 3600)
+
+
+# Find stale open swarms, discard the expired ones and return what needs posting.
+# Returns None if another dyno holds the sweep lock.
+def _claim(cur):
+    cur.execute("/* sweeper.lock */ SELECT pg_try_advisory_xact_lock(%s)", (SWEEP_LOCK_ID,))
+    if not cur.fetchone()[0]:
+        return None
+    thresholds = [
+        (priority, f"{STALE_AFTER_HOURS[priority]} hours",
+         f"{EXPIRE_AFTER_HOURS[priority]} hours" if priority in EXPIRE_AFTER_HOURS else None)
+        for priority in PRIORITIES if priority in STALE_AFTER_HOURS
+    ]
+    if not thresholds:
+        return []
+    rows = execute_values(cur, _CLAIM_STALE_SQL, thresholds,
+                          template="(%s::text, %s::interval, %s::interval)", fetch=True)
+    stale = [dict(zip(swarms.SWARM_COLUMNS + ("expire",), row)) for row in rows]
+
+    expired = swarms.transition_many(
+        cur, [(swarm["channel_id"], swarm["message_ts"], "discard") for swarm in stale if swarm["expire"]]
+    )
+    return [
+        (expired.get((swarm["channel_id"], swarm["message_ts"])) if swarm["expire"] else None, swarm)
+        for swarm in stale
+    ]
+
+
+def _remind(client, swarm):
+    slack.chat_postMessage(
+        client,
+        channel=swarm["channel_id"],
+        thread_ts=swarm["message_ts"],
+        text=f"This {swarm['priority']} swarm request has been open for {_hours_open(swarm)} hours "
+             f"without an update. <@{swarm['user_id']}>, is it still needed?"
+    )
+
+
+def _expire(client, swarm, hours):
+    blocks, text = render_swarm_message(swarm)
+    slack.chat_update(client, channel=swarm["channel_id"], ts=swarm["message_ts"], blocks=blocks, text=text)
+    slack.pins_remove(client, channel=swarm["channel_id"], timestamp=swarm["message_ts"])
+    slack.chat_postMessage(
+        client,
+        channel=swarm["channel_id"],
+        thread_ts=swarm["message_ts"],
+        text=f"This swarm request was discarded automatically after {hours} hours without an update."
+    )
+
+
+# One sweep: claim stale swarms in a single transaction, then post reminders and expiry
+# notices one at a time, paced by the dispatcher's token buckets, each with its workspace's token
+def sweep():
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            claimed = _claim(cur)
+    except Exception as e:
+        logging.error(f"Error finding stale swarm requests: {e}")
+        return
+    if claimed is None:
+        logging.info("Stale swarm sweep is running on another dyno")
+        return
+
+    clients = {}
+    for expired, swarm in claimed:
+        # One swarm failing (a lost connection looking up its workspace, say) leaves the rest to run
+        try:
+            workspace = (swarm["enterprise_id"], swarm["team_id"])
+            if workspace not in clients:
+                clients[workspace] = client_for(*workspace)
+            client = clients[workspace]
+            if client is None:
+                logging.info(f"Not nudging stale swarm request {swarm['message_ts']}, its workspace has uninstalled the app")
+                continue
+            if expired is not None:
+                _expire(client, expired, _hours_open(swarm))
+            elif swarm["expire"]:
+                # Someone resolved or discarded it since it was found
+                continue
+            else:
+                _remind(client, swarm)
+        except SlackApiError as e:
+            logging.error(f"Error nudging stale swarm request {swarm['message_ts']}: {e.response['error']}")
+        except Exception as e:
+            logging.error(f"Error nudging stale swarm request {swarm['message_ts']}: {e}")
+    if claimed:
+        logging.info(f"Swept {len(claimed)} stale swarm requests")
+
+
+def _prune_rollups():
+    try:
+        pruned = rollups.prune()
+    except Exception as e:
+        logging.error(f"Error pruning swarm rollups: {e}")
+        return
+    logging.info(f"Pruned {pruned} hourly swarm rollups")
+
+
+_started_pid = None
+
+
+# Run sweep() every SWEEP_INTERVAL_MINUTES on a daemon thread, once per process.
+# Every worker and dyno runs one; the advisory lock lets only one of them sweep at a time.
+def start_sweeper():
+    global _started_pid
+    if not SWEEPER_ENABLED or storage.SWARM_STORAGE == "memory" or _started_pid == os.getpid():
+        return
+    _started_pid = os.getpid()
+    scheduler = schedule.Scheduler()
+    scheduler.every(SWEEP_INTERVAL_MINUTES).minutes.do(sweep)
+    scheduler.every().day.do(_prune_rollups)
+
+    def run():
+        current_listener.set("sweeper")
+        while True:
+            # An error in a job must not end the thread, or nothing is swept until the next restart
+            try:
+                scheduler.run_pending()
+            except Exception:
+                logging.exception("Error running the stale swarm sweeper")
+            time.sleep(max(1, min(scheduler.idle_seconds or 60, 60)))
+
+    threading.Thread(target=run, name="swarm-sweeper", daemon=True).start()
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The tests run against the in-process storage, without Postgres or Slack
+os.environ.setdefault("SWARM_STORAGE", "memory")
+os.environ.setdefault("SLACK_BOT_TOKEN", "xoxb-test")
+os.environ.setdefault("SLACK_SIGNING_SECRET", "test-secret")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
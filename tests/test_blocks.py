@@ -0,0 +1,60 @@
+from datetime import datetime
+
+from blocks import MAX_HELPERS_SHOWN, render_create_modal, render_swarm_message
+
+
+def test_create_modal_renders_are_independent():
+    first = render_create_modal("C1")
+    first["blocks"][0]["label"]["text"] = "Changed"
+    first["blocks"][1]["element"]["options"].clear()
+
+    second = render_create_modal("C2")
+    assert second["blocks"][0]["label"]["text"] == "Ticket"
+    assert len(second["blocks"][1]["element"]["options"]) == 4
+    assert second["private_metadata"] == "C2"
+
+
+def _swarm(**values):
+    swarm = {
+        "ticket": "T-1", "entitlement": "Enterprise Premier", "skill_group": "Data", "support_tier": "General Usage",
+        "priority": "High", "issue_description": "Broken", "help_required": "Ideas", "user_id": "U1",
+        "status": "open", "created_at": datetime(2024, 1, 1, 9, 0), "first_response_at": None,
+    }
+    swarm.update(values)
+    return swarm
+
+
+def _block(blocks, block_id):
+    return next((block for block in blocks if block.get("block_id") == block_id), None)
+
+
+def test_swarm_message_open():
+    blocks, text = render_swarm_message(_swarm())
+    assert text == "New Swarm Request"
+    assert "*Opened By:*\n<@U1>" in [field["text"] for field in _block(blocks, "details-section")["fields"]]
+    assert [button["action_id"] for button in _block(blocks, "actions-block")["elements"]] == \
+        ["resolve_button", "discard_button"]
+    assert _block(blocks, "status-section") is None
+    assert _block(blocks, "activity-section") is None
+
+
+def test_swarm_message_closed_and_reopened():
+    blocks, text = render_swarm_message(_swarm(status="resolved"), actor_id="U2")
+    assert text == "Swarm request resolved"
+    assert _block(blocks, "status-section")["text"]["text"] == "Swarm request resolved by <@U2>."
+    assert [button["action_id"] for button in _block(blocks, "actions-block")["elements"]] == ["reopen_button"]
+
+    blocks, text = render_swarm_message(_swarm(), actor_id="U3")
+    assert text == "New Swarm Request"
+    assert _block(blocks, "status-section")["elements"][0]["text"] == "Swarm request reopened by <@U3>."
+
+
+def test_swarm_message_activity():
+    helpers = [f"U{n}" for n in range(2, 2 + MAX_HELPERS_SHOWN + 3)]
+    blocks, _ = render_swarm_message(_swarm(
+        first_response_at=datetime(2024, 1, 1, 9, 5), first_responder_id="U2", participants=helpers
+    ))
+    activity = _block(blocks, "activity-section")["elements"][0]["text"]
+    assert activity.startswith("First response after 5m from <@U2>")
+    assert activity.endswith("and 3 more")
+    assert activity.count("<@") == MAX_HELPERS_SHOWN + 1
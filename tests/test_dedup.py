@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+import app
+from autocomplete import option_index
+from dedup import DEDUP_CLICK_WINDOW, deduplicator, skip_duplicates
+
+
+def _submission(ticket, metadata="C1"):
+    return {
+        "type": "view_submission",
+        "view": {
+            "id": "V1",
+            "hash": "1700000000.abc",
+            "private_metadata": metadata,
+            "state": {"values": {"ticket": {"ticket_select": {"selected_option": {"value": ticket}}}}},
+        },
+    }
+
+
+def _deliver(body):
+    handled = []
+    skip_duplicates(body, lambda: handled.append(True))
+    return bool(handled)
+
+
+def _ack(body):
+    context, acks = {}, []
+    app.check_duplicate_ticket(context, body["view"], lambda: None)
+    app.ack_swarm_request_form(lambda **response: acks.append(response), body, body["view"], context)
+    return acks[0]
+
+
+@pytest.fixture(autouse=True)
+def _open_swarm():
+    option_index.note({"ticket": "T-1", "channel_id": "C1", "message_ts": "1.000", "status": "open"})
+    yield
+    option_index.note({"ticket": "T-1", "channel_id": "C1", "message_ts": "1.000", "status": "resolved"})
+    deduplicator._entries.clear()
+
+
+def test_duplicate_ticket_is_flagged_then_posted_once_confirmed():
+    flagged = _submission("T-1")
+    assert _deliver(flagged)
+    response = _ack(flagged)
+    assert response["response_action"] == "update"
+    warned = response["view"]
+    assert warned["blocks"][1]["block_id"] == "duplicate_ticket_warning"
+
+    # Slack resubmits the same view; the confirmed ticket goes through
+    confirmed = _submission("T-1", warned["private_metadata"])
+    assert _deliver(confirmed)
+    assert _ack(confirmed) == {}
+    # Slack retrying the accepted submission is still dropped
+    assert not _deliver(confirmed)
+
+
+def test_changed_ticket_after_warning_is_checked_again():
+    warned = _ack(_submission("T-1"))["view"]
+    assert _ack(_submission("T-2", warned["private_metadata"])) == {}
+
+
+
+def _event(event_id, type="app_home_opened"):
+    return {"type": "event_callback", "event_id": event_id, "event": {"type": type}}
+
+
+def _click(action_ts, action_id="resolve_button", message_ts="1.000"):
+    return {
+        "type": "block_actions",
+        "container": {"channel_id": "C1", "message_ts": message_ts},
+        "actions": [{"type": "button", "action_id": action_id, "action_ts": action_ts}],
+    }
+
+
+def test_retried_event_is_skipped():
+    assert _deliver(_event("Ev1"))
+    assert not _deliver(_event("Ev1"))
+    assert _deliver(_event("Ev2"))
+
+
+def test_message_events_are_not_claimed():
+    assert _deliver(_event("Ev3", "message"))
+    assert _deliver(_event("Ev3", "message"))
+
+
+def test_double_click_is_skipped_within_the_window(monkeypatch):
+    assert _deliver(_click("1.1"))
+    # Slack's retry of the same click, then a second click on the same button
+    assert not _deliver(_click("1.1"))
+    assert not _deliver(_click("1.2"))
+    # Another button or message is its own click
+    assert _deliver(_click("1.3", "discard_button"))
+    assert _deliver(_click("1.4", message_ts="2.000"))
+
+    clock = time.monotonic() + DEDUP_CLICK_WINDOW + 1
+    monkeypatch.setattr(time, "monotonic", lambda: clock)
+    assert _deliver(_click("1.5"))
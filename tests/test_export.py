@@ -0,0 +1,63 @@
+import io
+import csv
+import gzip
+import json
+from datetime import date, datetime
+
+import pytest
+
+from export import ExportError, parse_export, write_export
+from swarms import SWARM_COLUMNS
+
+
+def test_parse_export_skill_filter():
+    export = parse_export('from:2024-01-01 skill:"platform/web services" status:resolved')
+    assert export.filters == {"skill_group": "Platform/Web Services", "status": "resolved"}
+
+
+def test_parse_export_unknown_skill():
+    with pytest.raises(ExportError, match="Try one of: Data, Runtime"):
+        parse_export("skill:Nope")
+
+
+def test_parse_export_dates_and_format():
+    export = parse_export("from:2024-01-01 to:2024-03-31 format:NDJSON")
+    assert (export.since, export.until, export.format) == (date(2024, 1, 1), date(2024, 3, 31), "ndjson")
+    assert export.filename == "swarm-requests_2024-01-01_2024-03-31.ndjson.gz"
+
+
+def test_parse_export_rejects_bad_input():
+    with pytest.raises(ExportError, match="is not a date"):
+        parse_export("from:yesterday")
+    with pytest.raises(ExportError, match="Don't know what to do"):
+        parse_export("everything")
+
+
+def _row(**values):
+    row = dict.fromkeys(SWARM_COLUMNS, "")
+    row.update(id=1, ticket="T-1", created_at=datetime(2024, 1, 2, 3, 4, 5), participants=["U1", "U2"])
+    row.update(values)
+    return row
+
+
+def _read(fileobj):
+    return gzip.decompress(fileobj.getvalue()).decode("utf-8")
+
+
+def test_write_export_csv():
+    out = io.BytesIO()
+    assert write_export(out, iter([_row(), _row(id=2, ticket="T-2, urgent")]), "csv") == 2
+    header, first, second = csv.reader(io.StringIO(_read(out)))
+    assert header == list(SWARM_COLUMNS)
+    assert first[SWARM_COLUMNS.index("participants")] == "U1 U2"
+    assert second[SWARM_COLUMNS.index("ticket")] == "T-2, urgent"
+
+
+def test_write_export_ndjson():
+    out = io.BytesIO()
+    assert write_export(out, iter([_row()]), "ndjson") == 1
+    lines = _read(out).splitlines()
+    assert len(lines) == 1
+    row = json.loads(lines[0])
+    assert row["created_at"] == "2024-01-02 03:04:05"
+    assert row["participants"] == ["U1", "U2"]
@@ -0,0 +1,121 @@
+import os
+import glob
+import subprocess
+import sys
+
+import psycopg2
+import pytest
+
+import journal
+import memory_store
+
+
+def _swarm(index):
+    return {
+        "ticket": f"T-{index}", "entitlement": "Premier", "skill_group": "Data", "support_tier": "Tier 2",
+        "priority": "High", "issue_description": "Broken", "help_required": "Anything", "user_id": "U1",
+        "channel_id": "C1", "message_ts": f"{index}.000", "enterprise_id": None, "team_id": "T1",
+    }
+
+
+def _unavailable():
+    raise psycopg2.OperationalError("database is down")
+
+
+def _spooled(spool_path):
+    events = []
+    for path in glob.glob(f"{spool_path}.*"):
+        with open(path, encoding="utf-8") as spool:
+            events += [line for line in spool if line.strip()]
+    return events
+
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+@pytest.fixture(autouse=True)
+def _reset():
+    memory_store.reset()
+
+
+def test_two_journals_on_one_spool_path_keep_every_event(tmp_path, monkeypatch):
+    spool_path = str(tmp_path / "swarm_journal.spool")
+    monkeypatch.setattr(journal, "get_db_connection", _unavailable)
+    journals = [journal.Journal(batch_size=500, flush_interval=0.01, spool_path=spool_path) for _ in range(2)]
+    for index in range(200):
+        for number, each in enumerate(journals):
+            each.create(**_swarm(f"{number}{index}"))
+    for each in journals:
+        each.close()
+        assert not each._waiting
+
+    assert len(_spooled(spool_path)) == 400
+
+    # Once those processes have exited, the next journal replays both spools
+    for path in glob.glob(f"{spool_path}.*"):
+        dead = path.replace(f".{journals[0]._pid}.", f".{_dead_pid()}.")
+        (tmp_path / path).rename(dead)
+    monkeypatch.setattr(journal, "get_db_connection", memory_store.get_db_connection)
+    replaying = journal.Journal(batch_size=500, flush_interval=0.01, spool_path=spool_path)
+    replaying.transition("C1", "0199.000", "resolve").wait(5)
+    replaying.close()
+
+    assert len(memory_store._rows) == 400
+    assert _spooled(spool_path) == []
+
+
+def test_flusher_keeps_running_after_an_error(tmp_path, monkeypatch):
+    failing = journal.Journal(flush_interval=0.01, spool_path=str(tmp_path / "swarm_journal.spool"))
+    store = failing._store
+    calls = []
+
+    def store_once_failing(items):
+        calls.append(items)
+        if len(calls) == 1:
+            raise OSError("disk full")
+        return store(items)
+
+    monkeypatch.setattr(failing, "_store", store_once_failing)
+    failing.create(**_swarm(1))
+    ticket = failing.transition("C1", "1.000", "resolve")
+    assert ticket.wait(5) == journal.APPLIED
+    failing.close()
+    assert len(memory_store._rows) == 1
+
+
+def _pool_busy():
+    raise psycopg2.pool.PoolError("No primary database connection free after 5 seconds")
+
+
+def test_busy_pool_spools_the_batch_instead_of_rejecting_it(tmp_path, monkeypatch):
+    spool_path = str(tmp_path / "swarm_journal.spool")
+    monkeypatch.setattr(journal, "get_db_connection", _pool_busy)
+    busy = journal.Journal(flush_interval=0.01, spool_path=spool_path)
+    busy.create(**_swarm(1))
+    ticket = busy.transition("C1", "1.000", "resolve")
+    assert ticket.wait(5) == journal.DEFERRED
+    busy.close()
+    assert len(_spooled(spool_path)) == 2
+    assert memory_store._rows == {}
+
+    # Once connections are free again the spool is replayed, here by the next process
+    os.rename(busy._spool, busy._spool.replace(f".{busy._pid}.", f".{_dead_pid()}."))
+    monkeypatch.setattr(journal, "get_db_connection", memory_store.get_db_connection)
+    replaying = journal.Journal(flush_interval=0.01, spool_path=spool_path)
+    replaying._ensure_started()
+    replaying.close()
+    assert [row["status"] for row in memory_store._rows.values()] == ["resolved"]
+    assert _spooled(spool_path) == []
+
+
+def test_transitions_waiting_at_close_are_spooled(tmp_path):
+    spool_path = str(tmp_path / "swarm_journal.spool")
+    closing = journal.Journal(flush_interval=0.01, spool_path=spool_path)
+    # Its create was queued by another worker and hasn't been stored yet
+    ticket = closing.transition("C1", "1.000", "resolve")
+    closing.close()
+    assert ticket.outcome == journal.DEFERRED
+    assert len(_spooled(spool_path)) == 1
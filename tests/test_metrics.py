@@ -0,0 +1,24 @@
+import metrics
+
+
+def _scrape(authorization=None):
+    environ = {"PATH_INFO": metrics.METRICS_PATH}
+    if authorization is not None:
+        environ["HTTP_AUTHORIZATION"] = authorization
+    statuses = []
+    body = b"".join(metrics.wsgi_app(environ, lambda status, headers: statuses.append(status)))
+    return statuses[0], body
+
+
+def test_metrics_require_the_token(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "s3cret")
+    assert _scrape()[0] == "401 Unauthorized"
+    assert _scrape("Bearer wrong")[0] == "401 Unauthorized"
+    status, body = _scrape("Bearer s3cret")
+    assert status == "200 OK"
+    assert b"# TYPE" in body
+
+
+def test_metrics_without_a_token(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", None)
+    assert _scrape()[0] == "200 OK"
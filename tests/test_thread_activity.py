@@ -0,0 +1,59 @@
+import pytest
+
+import journal
+import memory_store
+import thread_activity
+from thread_activity import ActiveThreads, record_reply
+
+from test_journal import _swarm
+
+BOT = "UBOT"
+
+
+def _reply(user_id, thread_ts="1.000", parent_user_id=BOT):
+    event = {"type": "message", "channel": "C1", "user": user_id, "ts": "1700000000.000100", "thread_ts": thread_ts}
+    if parent_user_id:
+        event["parent_user_id"] = parent_user_id
+    return event
+
+
+@pytest.fixture(autouse=True)
+def threads(monkeypatch):
+    memory_store.reset()
+    memory_store._replies.clear()
+    threads = ActiveThreads()
+    # Nothing loaded yet, as right after a worker starts
+    monkeypatch.setattr(threads, "refresh_if_stale", lambda: None)
+    monkeypatch.setattr(thread_activity, "active_threads", threads)
+    return threads
+
+
+def test_reply_in_unknown_swarm_thread_is_recorded(threads):
+    # Opened on another worker: stored, but not in this process's index
+    with memory_store.get_db_connection() as conn:
+        memory_store.create_swarms(conn.cursor(), [_swarm(1)])
+
+    ticket = record_reply(_reply("U2"), BOT)
+    assert ticket.wait(5) == journal.APPLIED
+    assert ticket.swarm["first_responder_id"] == "U2"
+    assert threads.counters()["unconfirmed"] == 1
+
+
+def test_unknown_thread_of_someone_elses_message_is_ignored(threads):
+    assert record_reply(_reply("U2", parent_user_id="U3"), BOT) is None
+    assert threads.counters()["ignored"] == 1
+
+
+def test_unknown_thread_without_parent_counts_until_first_refresh(threads):
+    assert threads.may_be_swarm("1.000")
+    threads.refresh()
+    assert not threads.may_be_swarm("1.000")
+    assert threads.may_be_swarm("99999999999.000")
+
+
+def test_requester_reply_in_unknown_thread_is_not_counted(threads):
+    with memory_store.get_db_connection() as conn:
+        memory_store.create_swarms(conn.cursor(), [_swarm(1)])
+
+    assert record_reply(_reply("U1"), BOT).wait(5) == journal.REJECTED
+    assert memory_store._rows[next(iter(memory_store._rows))]["reply_count"] == 0
@@ -0,0 +1,176 @@
+import os
+import time
+import logging
+import threading
+
+from journal import journal
+from metrics import registry
+from storage import get_read_connection, swarms
+from workers import side_effect_executor
+
+
+# Every message in every channel the app is in arrives as a message event. Replies in the thread
+# of an open swarm are picked out with one lookup in this process's memory; everything else is
+# dropped there, without a database round trip. The set of open threads is reloaded from
+# swarm_requests every THREAD_INDEX_REFRESH_INTERVAL seconds and kept current in between by the
+# swarms this process creates and transitions. A thread the index doesn't know may still be a swarm
+# opened or reopened on another worker since, so replies in threads of the app's own messages (and,
+# when Slack doesn't say whose the parent is, in threads started since the last refresh) go to the
+# journal unconfirmed; storing them only keeps replies to open swarms by someone but the requester.
+THREAD_INDEX_REFRESH_INTERVAL = float(os.environ.get("THREAD_INDEX_REFRESH_INTERVAL", 60))
+
+# Message subtypes that are someone writing in a thread; edits, deletions, joins and bot
+# messages are not replies
+_REPLY_SUBTYPES = {None, "thread_broadcast"}
+
+
+# (channel_id, thread_ts) of each open swarm -> (requester, set of helpers who replied so far)
+class ActiveThreads:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._threads = {}
+        # Swarms noted while a refresh was reading the database, reapplied on top of what it read
+        self._noted = None
+        self._refreshed_at = None
+        # Wall-clock time the loaded threads were read as of, None until the first refresh
+        self._loaded_as_of = None
+        self._refreshing = False
+        self._counters = dict.fromkeys(("ignored", "recorded", "unconfirmed"), 0)
+
+    # Apply a swarm as created or transitioned by this process, ahead of the next refresh
+    def note(self, swarm):
+        if not swarm.get("message_ts"):
+            return
+        with self._lock:
+            self._apply(self._threads, swarm)
+            if self._noted is not None:
+                self._noted.append(swarm)
+
+    @staticmethod
+    def _apply(threads, swarm):
+        key = (swarm["channel_id"], swarm["message_ts"])
+        if swarm["status"] != "open":
+            threads.pop(key, None)
+        elif key not in threads:
+            threads[key] = (swarm["user_id"], set(swarm.get("participants") or ()))
+
+    # Reload the open threads. Helpers this process has seen reply are kept, whether or not
+    # their replies have been stored yet.
+    def refresh(self):
+        read_at = time.time()
+        with self._lock:
+            self._noted = []
+        try:
+            with get_read_connection() as conn, conn.cursor() as cur:
+                rows = swarms.open_threads(cur)
+        except Exception:
+            with self._lock:
+                self._noted = None
+            raise
+
+        threads = {(row["channel_id"], row["message_ts"]): (row["user_id"], set(row["participants"] or ()))
+                   for row in rows}
+        with self._lock:
+            for swarm in self._noted:
+                self._apply(threads, swarm)
+            for key, (_, helpers) in threads.items():
+                known = self._threads.get(key)
+                if known is not None:
+                    helpers |= known[1]
+            self._threads = threads
+            self._noted = None
+            self._refreshed_at = time.monotonic()
+            self._loaded_as_of = read_at
+
+    # Start a background refresh if the set is older than the refresh interval
+    def refresh_if_stale(self):
+        with self._lock:
+            if self._refreshing or (
+                self._refreshed_at is not None and time.monotonic() - self._refreshed_at < THREAD_INDEX_REFRESH_INTERVAL
+            ):
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Error refreshing the open swarm threads: {e}")
+                with self._lock:
+                    # Wait out the interval before trying again
+                    self._refreshed_at = time.monotonic()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        side_effect_executor.submit(run)
+
+    # Whether user_id's message in the thread at key is a reply to count, and if so whether
+    # they are a new helper there. None for a thread that isn't a known open swarm.
+    def replied(self, key, user_id):
+        with self._lock:
+            entry = self._threads.get(key)
+            if entry is None:
+                return None
+            if entry[0] == user_id:
+                self._counters["ignored"] += 1
+                return False, False
+            self._counters["recorded"] += 1
+            helpers = entry[1]
+            if user_id in helpers:
+                return True, False
+            helpers.add(user_id)
+            return True, True
+
+    # Whether a reply in a thread the index doesn't know could still be in a swarm's: the thread
+    # of a message the app posted, or if that isn't known, one started since the last refresh
+    def may_be_swarm(self, thread_ts, parent_user_id=None, bot_user_id=None):
+        with self._lock:
+            if parent_user_id and bot_user_id:
+                unconfirmed = parent_user_id == bot_user_id
+            else:
+                unconfirmed = self._loaded_as_of is None or float(thread_ts) >= self._loaded_as_of
+            self._counters["unconfirmed" if unconfirmed else "ignored"] += 1
+            return unconfirmed
+
+    def size(self):
+        with self._lock:
+            return len(self._threads)
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+active_threads = ActiveThreads()
+
+
+# Queue a message event for the journal if it is a reply in an open swarm's thread by someone
+# other than its requester, or may be (see may_be_swarm()). Returns the journal ticket for a reply
+# from a new or possibly new helper, whose name the swarm message should show, otherwise None.
+# bot_user_id is the app's bot user in the event's workspace, if known.
+def record_reply(event, bot_user_id=None):
+    active_threads.refresh_if_stale()
+    thread_ts = event.get("thread_ts")
+    user_id = event.get("user")
+    if (event.get("subtype") not in _REPLY_SUBTYPES or not thread_ts or thread_ts == event.get("ts")
+            or not user_id or event.get("bot_id")):
+        return None
+    replied = active_threads.replied((event["channel"], thread_ts), user_id)
+    if replied is None:
+        if not active_threads.may_be_swarm(thread_ts, event.get("parent_user_id"), bot_user_id):
+            return None
+        return journal.reply(event["channel"], thread_ts, event["ts"], user_id, unconfirmed=True)
+    recorded, new_helper = replied
+    if not recorded:
+        return None
+    ticket = journal.reply(event["channel"], thread_ts, event["ts"], user_id)
+    return ticket if new_helper else None
+
+
+@registry.collector
+def _thread_counters():
+    return [
+        ("swarm_thread_messages_total", "Thread messages recorded as swarm replies, sent to be checked against the database (unconfirmed) or ignored",
+         ("result",), {(result,): count for result, count in active_threads.counters().items()}),
+    ]
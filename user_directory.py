@@ -0,0 +1,183 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+
+from slack_sdk.errors import SlackApiError
+
+from slack_dispatch import slack, team_of
+from workers import run_concurrently, side_effect_executor
+
+
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 3600))
+USER_CACHE_NEGATIVE_TTL = int(os.environ.get("USER_CACHE_NEGATIVE_TTL", 60))
+USER_CACHE_MAX_SIZE = int(os.environ.get("USER_CACHE_MAX_SIZE", 10000))
+USERS_LIST_PAGE_SIZE = 200
+
+
+def _display_name(user):
+    profile = user.get("profile") or {}
+    return user.get("real_name") or profile.get("real_name") or user.get("name")
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.name = None
+
+
+# Process-wide cache of Slack user id -> real name.
+# Entries expire after a TTL and the least recently used ones are evicted past max_size.
+# Failed lookups are cached as None for a shorter negative TTL, and concurrent misses
+# for the same user share a single users.info call.
+class UserDirectory:
+    def __init__(self, ttl=USER_CACHE_TTL, negative_ttl=USER_CACHE_NEGATIVE_TTL, max_size=USER_CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._inflight_async = {}
+        self._lock = threading.Lock()
+        self._warm_locks = {}
+        self._warmed_at = {}
+
+    def _get_cached(self, user_id):
+        # Returns (hit, name); must be called with self._lock held
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return False, None
+        expires_at, name = entry
+        if expires_at < time.monotonic():
+            del self._entries[user_id]
+            return False, None
+        self._entries.move_to_end(user_id)
+        return True, name
+
+    def _store(self, user_id, name):
+        # Must be called with self._lock held
+        ttl = self.ttl if name is not None else self.negative_ttl
+        self._entries[user_id] = (time.monotonic() + ttl, name)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _fetch(self, client, user_id):
+        try:
+            response = slack.users_info(client, user=user_id)
+            return _display_name(response["user"])
+        except SlackApiError as e:
+            logging.error(f"Error fetching user info: {e.response['error']}")
+            return None
+
+    def real_name(self, client, user_id, default=None):
+        with self._lock:
+            hit, name = self._get_cached(user_id)
+            if hit:
+                return name if name is not None else default
+            flight = self._inflight.get(user_id)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[user_id] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            return flight.name if flight.name is not None else default
+
+        name = None
+        try:
+            name = self._fetch(client, user_id)
+        finally:
+            with self._lock:
+                self._store(user_id, name)
+                del self._inflight[user_id]
+            flight.name = name
+            flight.done.set()
+        return name if name is not None else default
+
+    # Misses are looked up concurrently, one users.info each, while the workspace is warmed in the
+    # background for the next caller; paging through users.list here would hold up the request
+    def real_names(self, client, user_ids, default=None):
+        user_ids = list(dict.fromkeys(user_ids))
+        with self._lock:
+            misses = [uid for uid in user_ids if not self._get_cached(uid)[0]]
+        if len(misses) > 1:
+            side_effect_executor.submit(self.warm, client)
+            run_concurrently(*(lambda uid=uid: self.real_name(client, uid) for uid in misses))
+        return {uid: self.real_name(client, uid, default) for uid in user_ids}
+
+    # real_name() for an AsyncWebClient (async_app.py); concurrent misses share one users.info task
+    async def real_name_async(self, client, user_id, default=None):
+        with self._lock:
+            hit, name = self._get_cached(user_id)
+            if hit:
+                return name if name is not None else default
+            task = self._inflight_async.get(user_id)
+            if task is None:
+                task = self._inflight_async[user_id] = asyncio.ensure_future(self._fetch_async(client, user_id))
+        # One caller giving up must not cancel the lookup for the others
+        name = await asyncio.shield(task)
+        return name if name is not None else default
+
+    async def _fetch_async(self, client, user_id):
+        name = None
+        try:
+            response = await slack.call_async(client, "users_info", user=user_id)
+            name = _display_name(response["user"])
+        except SlackApiError as e:
+            logging.error(f"Error fetching user info: {e.response['error']}")
+        finally:
+            with self._lock:
+                self._store(user_id, name)
+                del self._inflight_async[user_id]
+        return name
+
+    # The misses are looked up concurrently rather than through users.list
+    async def real_names_async(self, client, user_ids, default=None):
+        user_ids = list(dict.fromkeys(user_ids))
+        names = await asyncio.gather(*(self.real_name_async(client, uid, default) for uid in user_ids))
+        return dict(zip(user_ids, names))
+
+    # Bulk-load the client's workspace from users.list, only into room the cache has to spare so
+    # no cached user is evicted for it. Skipped if another thread is already warming that
+    # workspace or its last warm-up is younger than the TTL.
+    def warm(self, client, force=False):
+        team = team_of(client)
+        with self._lock:
+            lock = self._warm_locks.setdefault(team, threading.Lock())
+        if not lock.acquire(blocking=False):
+            return
+        try:
+            warmed_at = self._warmed_at.get(team)
+            if not force and warmed_at is not None and time.monotonic() - warmed_at < self.ttl:
+                return
+            cursor = None
+            loaded = 0
+            while True:
+                response = slack.users_list(client, limit=USERS_LIST_PAGE_SIZE, cursor=cursor)
+                with self._lock:
+                    for user in response["members"]:
+                        if len(self._entries) >= self.max_size:
+                            break
+                        if user["id"] not in self._entries:
+                            self._store(user["id"], _display_name(user))
+                            loaded += 1
+                    full = len(self._entries) >= self.max_size
+                cursor = (response.get("response_metadata") or {}).get("next_cursor")
+                if not cursor or full:
+                    break
+            self._warmed_at[team] = time.monotonic()
+            logging.info(f"Warmed user directory with {loaded} users")
+        except SlackApiError as e:
+            logging.error(f"Error warming user directory: {e.response['error']}")
+        finally:
+            lock.release()
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+user_directory = UserDirectory()
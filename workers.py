@@ -0,0 +1,64 @@
+import os
+import asyncio
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+
+LISTENER_WORKERS = int(os.environ.get("LISTENER_WORKERS", 16))
+SIDE_EFFECT_WORKERS = int(os.environ.get("SIDE_EFFECT_WORKERS", 32))
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", 2))
+
+# Bounded pool that runs Bolt listeners and lazy listeners
+listener_executor = ThreadPoolExecutor(
+    max_workers=LISTENER_WORKERS,
+    thread_name_prefix="listener",
+)
+
+# Runs each task in a copy of the submitter's context, so a step still knows which
+# listener it works for (see metrics.current_listener)
+class ContextPreservingExecutor(ThreadPoolExecutor):
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+# Separate pool for the independent Slack/DB steps a lazy listener fans out to.
+# A listener blocks on its own steps, so sharing listener_executor could deadlock it.
+side_effect_executor = ContextPreservingExecutor(
+    max_workers=SIDE_EFFECT_WORKERS,
+    thread_name_prefix="side-effect",
+)
+
+
+# Long-running jobs such as /swarmexport, kept apart so they can't starve listeners
+export_executor = ContextPreservingExecutor(
+    max_workers=EXPORT_WORKERS,
+    thread_name_prefix="export",
+)
+
+
+# Blocking work (psycopg2, the journal's tickets) awaited by the asyncio runtime. Sized to the
+# connection pool, so a thread never waits for a connection while holding the loop's work.
+db_executor = ContextPreservingExecutor(
+    max_workers=int(os.environ.get("DB_WORKERS", os.environ.get("DB_POOL_MAX", 10))),
+    thread_name_prefix="db",
+)
+
+
+# Await a blocking call on db_executor from a coroutine
+async def run_blocking(fn, *args, **kwargs):
+    return await asyncio.wrap_future(db_executor.submit(fn, *args, **kwargs))
+
+
+# Run independent steps in parallel and return their results in order.
+# Steps are expected to handle their own errors; anything that escapes is logged and yields None.
+def run_concurrently(*steps):
+    futures = [side_effect_executor.submit(step) for step in steps]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            logging.error(f"Error running swarm side effect: {e}")
+            results.append(None)
+    return results
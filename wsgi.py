@@ -0,0 +1,20 @@
+from slack_bolt.adapter.wsgi import SlackRequestHandler
+
+from app import app
+from metrics import METRICS_PATH, METRICS_TOKEN, wsgi_app as metrics_app
+from readiness import READINESS_PATH, start_warm_up, wsgi_app as readiness_app
+
+
+# WSGI entry point for production serving (see gunicorn.conf.py)
+slack_handler = SlackRequestHandler(app)
+start_warm_up(app)
+
+
+# Prometheus scrapes METRICS_PATH (only when METRICS_TOKEN is set, see metrics.py) and health
+# checks poll READINESS_PATH; everything else is a Slack request
+def application(environ, start_response):
+    if METRICS_TOKEN and environ.get("PATH_INFO") == METRICS_PATH:
+        return metrics_app(environ, start_response)
+    if environ.get("PATH_INFO") == READINESS_PATH:
+        return readiness_app(environ, start_response)
+    return slack_handler(environ, start_response)